@@ -9,6 +9,7 @@ import ply.yacc
 import ply.lex
 from ply import lex, yacc
 from io import StringIO
+from time import perf_counter
 
 # ------------------------------------------------------------------------------
 
@@ -383,113 +384,242 @@ class TempMap(dict):
                 super().__setitem__(tmp, val)
 
 
+class Frame:
+    """Activation record of one call to a procedure. Frames of suspended
+    callers are kept on an explicit stack by execute()."""
+    __slots__ = ('proc', 'values', 'labels', 'pc', 'params', 'result',
+                 'desc')
+
+    def __init__(self, gvars, proc, args):
+        self.proc = proc
+        self.values = TempMap(gvars)
+        for i in range(len(proc.args)):
+            self.values[proc.args[i]] = args[i]
+        self.labels = dict()
+        for i, instr in enumerate(proc.body):
+            if instr.opcode != 'label':
+                continue
+            if instr.arg1 in self.labels:
+                raise RuntimeError(f'Reused label {instr.arg1}')
+            self.labels[instr.arg1] = i + 1  # spot right after the label
+        self.pc = 0
+        self.params = []
+        self.result = None
+        self.desc = f'{proc.name}({",".join(k + "=" + str(v) for k, v in self.values.items())})'
+
+
+class Profiler:
+    """Counts the instructions run by opcode, the visits of each block,
+    how often each conditional jump is taken or not, and the calls and
+    time (inclusive and exclusive of callees) of each procedure.
+
+    The results are available as a JSON object (js_obj) and as folded call
+    stacks with exclusive times in microseconds (write_folded), which is
+    the input format of the usual flamegraph tools."""
+
+    def __init__(self):
+        self.opcodes = dict()       # opcode -> count
+        self.blocks = dict()        # proc name -> {block label -> count}
+        self.branches = dict()      # proc name -> {pc -> [instr, count, taken]}
+        self.procs = dict()         # proc name -> [calls, inclusive, exclusive]
+        self.folded = dict()        # call stack -> exclusive time
+        self._stack = []            # [stack, start time, time in callees]
+        self._active = dict()       # proc name -> number of activations
+
+    def enter(self, name):
+        stack = name if len(self._stack) == 0 else \
+            f'{self._stack[-1][0]};{name}'
+        self._stack.append([stack, perf_counter(), 0.0])
+        self._active[name] = self._active.get(name, 0) + 1
+
+    def leave(self, name):
+        stack, start, inner = self._stack.pop()
+        elapsed = perf_counter() - start
+        self._active[name] -= 1
+        stats = self.procs.setdefault(name, [0, 0.0, 0.0])
+        stats[0] += 1
+        if self._active[name] == 0:
+            stats[1] += elapsed
+        stats[2] += elapsed - inner
+        self.folded[stack] = self.folded.get(stack, 0.0) + elapsed - inner
+        if len(self._stack) > 0:
+            self._stack[-1][2] += elapsed
+
+    def block(self, name, lab):
+        counts = self.blocks.setdefault(name, dict())
+        counts[lab] = counts.get(lab, 0) + 1
+
+    def instr(self, proc, pc, instr):
+        self.opcodes[instr.opcode] = self.opcodes.get(instr.opcode, 0) + 1
+        if instr.opcode == 'label':
+            self.block(proc.name, instr.arg1)
+        elif pc == 0:
+            self.block(proc.name, proc.name)
+
+    def branch(self, proc, pc, instr, taken):
+        if instr.opcode in jumps:
+            branches = self.branches.setdefault(proc.name, dict())
+            stats = branches.get(pc)
+            if stats is None:
+                stats = branches[pc] = [str(instr).strip(), 0, 0]
+            stats[1] += 1
+            stats[2] += taken
+        if taken:
+            self.block(proc.name, instr.arg1 if instr.opcode == 'jmp'
+                       else instr.arg2)
+
+    @property
+    def js_obj(self):
+        """A basic Python object ready to JSONify with json.dump()"""
+        return {'opcodes': self.opcodes,
+                'blocks': self.blocks,
+                'branches': {name: [{'pc': pc, 'instr': instr,
+                                     'taken': taken,
+                                     'not_taken': count - taken}
+                                    for pc, (instr, count, taken)
+                                    in sorted(branches.items())]
+                             for name, branches in self.branches.items()},
+                'procs': {name: {'calls': calls,
+                                 'inclusive': incl,
+                                 'exclusive': excl}
+                          for name, (calls, incl, excl)
+                          in self.procs.items()}}
+
+    def write_folded(self, fp):
+        for stack, secs in self.folded.items():
+            print(f'{stack} {round(secs * 1e6)}', file=fp)
+
+
 def execute(gvars, procs, proc_name, args, **kwargs):
     show_proc = kwargs.get('show_proc', False)
     show_instr = kwargs.get('show_instr', False)
     only_decimal = kwargs.get('only_decimal', True)
+    profiler = kwargs.get('profiler', None)
     depth = kwargs.get('depth', 0)
     indent = '  ' * depth
 
-    values = TempMap(gvars)
-    proc = procs[proc_name]
-
-    for i in range(len(proc.args)):
-        values[proc.args[i]] = args[i]
-
-    proc_desc = f'{proc_name}({",".join(k + "=" + str(v) for k, v in values.items())})'
+    stack = []      # suspended callers
+    frame = Frame(gvars, procs[proc_name], args)
     if show_proc:
-        print(f'// {indent}entering {proc_desc}')
-
-    labels = dict()
-    for i, instr in enumerate(proc.body):
-        if instr.opcode != 'label':
-            continue
-        if instr.arg1 in labels:
-            raise RuntimeError(f'Reused label {instr.arg1}')
-        labels[instr.arg1] = i + 1  # spot right after the label
-
-    pc = 0
-    params = []
-    while pc in range(len(proc.body)):
-        instr = proc.body[pc]
-
-        if show_instr:
-            print(f'// {indent}[{pc+1: 4d}] {instr}')
-        if instr.opcode == 'nop' or instr.opcode == 'label':
-            pc += 1
-        elif instr.opcode == 'jmp':
-            if instr.arg1 not in labels:
-                raise RuntimeError(f'Unknown jump destination {instr.arg1}')
-            pc = labels[instr.arg1]
-        elif instr.opcode in jumps:
-            k = values[instr.arg1]
-            if instr.arg2 not in labels:
-                raise RuntimeError(f'Unknown jump destination {instr.arg2}')
-            pc = labels[instr.arg2] if jumps[instr.opcode](k) else pc + 1
-        elif instr.opcode == 'const':
-            if not isinstance(instr.arg1, int):
-                print(f'Missing or bad argument: {instr.arg1}')
-                raise RuntimeError
-            values[instr.result] = twoc(instr.arg1)
-            pc += 1
-        elif instr.opcode == 'copy':
-            values[instr.result] = values[instr.arg1]
-            pc += 1
-        elif instr.opcode == 'param':
-            if not isinstance(instr.arg1, int) or instr.arg1 < 1:
-                print(f'Bad argument to param: '
-                      f'expecting int >= 1, got {instr.arg1}')
-            # make params big enough to hold instr.arg1 items
-            for _ in range(instr.arg1 - len(params)):
-                params.append(None)
-            params[instr.arg1 - 1] = values[instr.arg2]
-            pc += 1
-        elif instr.opcode == 'call':
-            if instr.arg1.startswith('@__bx_print'):
-                if len(params) != 1:
-                    raise RuntimeError(f'Bad number of arguments to print(): '
-                                       f'expected 1, got {len(params)}')
-                if instr.arg1 == '@__bx_print_int':
-                    u = params[0]
-                    if only_decimal:
-                        print(str(untwoc(u)))
+        print(f'// {indent}entering {frame.desc}')
+    if profiler:
+        profiler.enter(proc_name)
+
+    while True:
+        proc, values, labels = frame.proc, frame.values, frame.labels
+        pc, params = frame.pc, frame.params
+        called = False
+        while pc in range(len(proc.body)):
+            instr = proc.body[pc]
+
+            if show_instr:
+                print(f'// {indent}[{pc+1: 4d}] {instr}')
+            if profiler:
+                profiler.instr(proc, pc, instr)
+            if instr.opcode == 'nop' or instr.opcode == 'label':
+                pc += 1
+            elif instr.opcode == 'jmp':
+                if instr.arg1 not in labels:
+                    raise RuntimeError(f'Unknown jump destination {instr.arg1}')
+                if profiler:
+                    profiler.branch(proc, pc, instr, True)
+                pc = labels[instr.arg1]
+            elif instr.opcode in jumps:
+                k = values[instr.arg1]
+                if instr.arg2 not in labels:
+                    raise RuntimeError(f'Unknown jump destination {instr.arg2}')
+                taken = jumps[instr.opcode](k)
+                if profiler:
+                    profiler.branch(proc, pc, instr, taken)
+                pc = labels[instr.arg2] if taken else pc + 1
+            elif instr.opcode == 'const':
+                if not isinstance(instr.arg1, int):
+                    print(f'Missing or bad argument: {instr.arg1}')
+                    raise RuntimeError
+                values[instr.result] = twoc(instr.arg1)
+                pc += 1
+            elif instr.opcode == 'copy':
+                values[instr.result] = values[instr.arg1]
+                pc += 1
+            elif instr.opcode == 'param':
+                if not isinstance(instr.arg1, int) or instr.arg1 < 1:
+                    print(f'Bad argument to param: '
+                          f'expecting int >= 1, got {instr.arg1}')
+                # make params big enough to hold instr.arg1 items
+                for _ in range(instr.arg1 - len(params)):
+                    params.append(None)
+                params[instr.arg1 - 1] = values[instr.arg2]
+                pc += 1
+            elif instr.opcode == 'call':
+                if instr.arg1.startswith('@__bx_print'):
+                    if len(params) != 1:
+                        raise RuntimeError(f'Bad number of arguments to print(): '
+                                           f'expected 1, got {len(params)}')
+                    if instr.arg1 == '@__bx_print_int':
+                        u = params[0]
+                        if only_decimal:
+                            print(str(untwoc(u)))
+                        else:
+                            print(f'{untwoc(u): 20d}  0x{u:016x}  0b{u:064b}')
+                    elif instr.arg1 == '@__bx_print_bool':
+                        print('false' if params[0] == 0 else 'true')
                     else:
-                        print(f'{untwoc(u): 20d}  0x{u:016x}  0b{u:064b}')
-                elif instr.arg1 == '@__bx_print_bool':
-                    print('false' if params[0] == 0 else 'true')
+                        raise RuntimeError(
+                            f'Unknown print() specialization: {instr.arg1}')
+                    params = []
+                    pc += 1
                 else:
-                    raise RuntimeError(
-                        f'Unknown print() specialization: {instr.arg1}')
+                    if len(params) < instr.arg2:
+                        raise RuntimeError(f'Bad number of arguments to {instr.arg1}(): '
+                                           f'expected {instr.arg2}, got {len(params)}')
+                    # suspend this frame and enter the callee
+                    frame.pc, frame.params = pc, []
+                    stack.append(frame)
+                    indent = '  ' * (depth + len(stack))
+                    frame = Frame(gvars, procs[instr.arg1], params)
+                    if show_proc:
+                        print(f'// {indent}entering {frame.desc}')
+                    if profiler:
+                        profiler.enter(instr.arg1)
+                    called = True
+                    break
+            elif instr.opcode == 'ret':
+                frame.result = None if instr.arg1 == None else values[instr.arg1]
+                if show_proc:
+                    print(f'// {indent}{frame.desc} --> {frame.result}')
+                if profiler:
+                    profiler.leave(proc.name)
+                break
+            elif instr.opcode in binops:
+                u = values[instr.arg1]
+                v = values[instr.arg2]
+                values[instr.result] = binops[instr.opcode](u, v)
+                pc += 1
+            elif instr.opcode in unops:
+                u = values[instr.arg1]
+                if instr.arg2 != None:
+                    print(f'Unary operator {instr.opcode} has two arguments!')
+                    raise RuntimeError
+                values[instr.result] = unops[instr.opcode](u)
+                pc += 1
             else:
-                if len(params) < instr.arg2:
-                    raise RuntimeError(f'Bad number of arguments to {instr.arg1}(): '
-                                       f'expected {instr.arg2}, got {len(params)}')
-                kwargs['depth'] = depth + 1
-                values[instr.result] = execute(
-                    gvars, procs, instr.arg1, params, **kwargs)
-            params = []
-            pc += 1
-        elif instr.opcode == 'ret':
-            retval = None if instr.arg1 == None else values[instr.arg1]
-            if show_proc:
-                print(f'// {indent}{proc_desc} --> {retval}')
-            return retval
-        elif instr.opcode in binops:
-            u = values[instr.arg1]
-            v = values[instr.arg2]
-            values[instr.result] = binops[instr.opcode](u, v)
-            pc += 1
-        elif instr.opcode in unops:
-            u = values[instr.arg1]
-            if instr.arg2 != None:
-                print(f'Unary operator {instr.opcode} has two arguments!')
+                print(f'Unknown opcode {instr.opcode}')
                 raise RuntimeError
-            values[instr.result] = unops[instr.opcode](u)
-            pc += 1
         else:
-            print(f'Unknown opcode {instr.opcode}')
-            raise RuntimeError
-    print(f'// {indent}{proc_desc} --> NONE')
+            print(f'// {indent}{frame.desc} --> NONE')
+            frame.result = None
+            if profiler:
+                profiler.leave(proc.name)
+        if called:
+            continue
+        # the current frame has returned
+        if len(stack) == 0:
+            return frame.result
+        result, frame = frame.result, stack.pop()
+        indent = '  ' * (depth + len(stack))
+        instr = frame.proc.body[frame.pc]
+        frame.values[instr.result] = result
+        frame.pc += 1
 
 # --------------------------------------------------------------------------------
 
@@ -528,6 +658,10 @@ if __name__ == '__main__':
     ap.add_argument('--trace-all', dest='trace_all',
                     action='store_true', default=False,
                     help='Turn on all the trace-* options')
+    ap.add_argument('--profile', dest='profile',
+                    action='store_true', default=False,
+                    help='Write an execution profile of FILE to '
+                    'FILE.profile.json and FILE.folded')
     ap.add_argument('--no-exec', dest='execute', action='store_false',
                     default=True,
                     help='Do not run the interpreter')
@@ -555,7 +689,14 @@ if __name__ == '__main__':
                 gvars[tlv.name] = tlv
         print("HEREEE")
         if args.execute:
+            if args.profile:
+                kwargs['profiler'] = Profiler()
             execute(gvars, procs, '@main', (), **kwargs)
+            if args.profile:
+                with open(srcfile + '.profile.json', 'w') as fp:
+                    json.dump(kwargs['profiler'].js_obj, fp, indent=2)
+                with open(srcfile + '.folded', 'w') as fp:
+                    kwargs['profiler'].write_folded(fp)
         elif args.verbosity > 0:
             for gvar in gvars.values():
                 print(gvar)
@@ -6,6 +6,8 @@ Control Flow Graphs (CFG)
 
 import re
 import tac
+from array import array
+from collections import deque
 from io import StringIO
 
 # ------------------------------------------------------------------------------
@@ -68,6 +70,208 @@ def get_jump_dest(jinstr):
     # return None otherwise
 
 
+class CFGIndex:
+    """Dense integer form of the graph of a CFG. The blocks are numbered
+    0, 1, ... in the order of CFG.nodes(); `labels' gives the label of
+    each number and `numbers' the number of each label. The successors
+    of block u are succ[succ_start[u]:succ_start[u + 1]], and likewise
+    its predecessors in `pred' and `pred_start' (all of these are
+    array('i')). `postorder' and `rpo' (reverse postorder) list the
+    blocks reachable from the entry block `entry', in the order of a
+    depth-first search that visits the successors in order."""
+
+    def __init__(self, cfg):
+        self.labels = list(cfg._blockmap)
+        self.numbers = {lab: u for u, lab in enumerate(self.labels)}
+        self.succ_start, self.succ = self._csr(cfg._fwd)
+        self.pred_start, self.pred = self._csr(cfg._bwd)
+        self.entry = self.numbers.get(cfg.lab_entry, -1)
+        self.postorder = self._postorder()
+        self.rpo = array('i', reversed(self.postorder))
+        self._dominators = dict()   # post -> Dominators
+
+    def _csr(self, adj):
+        start, targets = array('i', [0]), array('i')
+        for lab in self.labels:
+            targets.extend(self.numbers[lab_to] for lab_to in adj[lab])
+            start.append(len(targets))
+        return start, targets
+
+    def _postorder(self):
+        order = array('i')
+        if self.entry < 0:
+            return order
+        succ_start, succ = self.succ_start, self.succ
+        seen = bytearray(len(self.labels))
+        seen[self.entry] = 1
+        stack = [(self.entry, succ_start[self.entry])]
+        while len(stack) > 0:
+            u, k = stack[-1]
+            if k < succ_start[u + 1]:
+                stack[-1] = (u, k + 1)
+                v = succ[k]
+                if not seen[v]:
+                    seen[v] = 1
+                    stack.append((v, succ_start[v]))
+            else:
+                stack.pop()
+                order.append(u)
+        return order
+
+    def __len__(self):
+        return len(self.labels)
+
+    def successors(self, u):
+        """The numbers of the immediate successors of block number `u'"""
+        return self.succ[self.succ_start[u]:self.succ_start[u + 1]]
+
+    def predecessors(self, u):
+        """The numbers of the immediate predecessors of block number `u'"""
+        return self.pred[self.pred_start[u]:self.pred_start[u + 1]]
+
+    def dominators(self, post=False):
+        """The Dominators of the graph, or its post-dominators if `post'
+        is true, computed on first use. They go away with the index when
+        the CFG changes."""
+        doms = self._dominators.get(post)
+        if doms is None:
+            doms = self._dominators[post] = Dominators(self, post)
+        return doms
+
+
+class Dominators:
+    """The dominator tree of the graph of a CFGIndex, computed with the
+    iterative algorithm of Cooper, Harvey and Kennedy on the reverse
+    postorder. With `post' true, it is the post-dominator tree instead:
+    the same on the reversed graph, from a virtual exit numbered
+    len(index) that comes after every block with no successors.
+
+    `idoms' gives the number of the immediate dominator of each block,
+    the root being its own, and -1 for a block that cannot be reached
+    (from the entry, or for `post', cannot reach an exit). The tree is
+    numbered in a depth-first search, into `pre' and `last' (the largest
+    pre number in the subtree of each block), so that dominates() is a
+    comparison. The dominance frontiers are computed on first use."""
+
+    def __init__(self, index, post=False):
+        self.index = index
+        self.post = post
+        n = len(index)
+        if post:
+            self.root = n
+            exits = array('i', (u for u in range(n)
+                                if len(index.successors(u)) == 0))
+            to_root = array('i', [n])
+
+            def preds(u):
+                if u == n:
+                    return array('i')
+                succs = index.successors(u)
+                return succs if len(succs) > 0 else to_root
+
+            def succs(u):
+                return exits if u == n else index.predecessors(u)
+            postorder = self._postorder(n + 1, self.root, succs)
+        else:
+            self.root = index.entry
+            preds = index.predecessors
+            postorder = index.postorder
+        self.sources = preds
+        size = n + 1 if post else n
+        order = array('i', [-1]) * size   # block -> position in postorder
+        for k, u in enumerate(postorder):
+            order[u] = k
+        idoms = self.idoms = array('i', [-1]) * size
+        self.children = [[] for _ in range(size)]
+        self.pre, self.last = array('i', [-1]) * size, array('i', [-1]) * size
+        self._frontiers = None
+        if self.root < 0:
+            return
+        idoms[self.root] = self.root
+        changed = True
+        while changed:
+            changed = False
+            for u in reversed(postorder):
+                if u == self.root:
+                    continue
+                new = -1
+                for p in preds(u):
+                    if idoms[p] < 0:
+                        continue
+                    if new < 0:
+                        new = p
+                        continue
+                    # walk up to the common dominator of p and new
+                    while p != new:
+                        while order[p] < order[new]:
+                            p = idoms[p]
+                        while order[new] < order[p]:
+                            new = idoms[new]
+                if idoms[u] != new:
+                    idoms[u] = new
+                    changed = True
+        for u in reversed(postorder):
+            if u != self.root:
+                self.children[idoms[u]].append(u)
+        count = 0
+        stack = [(self.root, False)]
+        while len(stack) > 0:
+            u, done = stack.pop()
+            if done:
+                self.last[u] = count - 1
+                continue
+            self.pre[u] = count
+            count += 1
+            stack.append((u, True))
+            stack.extend((v, False) for v in reversed(self.children[u]))
+
+    @staticmethod
+    def _postorder(size, root, succs):
+        order = array('i')
+        seen = bytearray(size)
+        seen[root] = 1
+        stack = [(root, iter(succs(root)))]
+        while len(stack) > 0:
+            u, it = stack[-1]
+            for v in it:
+                if not seen[v]:
+                    seen[v] = 1
+                    stack.append((v, iter(succs(v))))
+                    break
+            else:
+                stack.pop()
+                order.append(u)
+        return order
+
+    def dominates(self, u, v):
+        """Whether block number `u' dominates block number `v' (every block
+        dominates itself), which are both reachable"""
+        pre = self.pre[u]
+        return pre >= 0 and pre <= self.pre[v] <= self.last[u]
+
+    def frontiers(self):
+        """The dominance frontier of each block number, as a set"""
+        if self._frontiers is None:
+            idoms = self.idoms
+            frontiers = self._frontiers = [set() for _ in idoms]
+            for u in range(len(idoms)):
+                if idoms[u] < 0:
+                    continue
+                preds = [p for p in self.sources(u) if idoms[p] >= 0]
+                # the root is also entered from outside the graph
+                if u == self.root:
+                    stop = -1
+                elif len(preds) < 2:
+                    continue
+                else:
+                    stop = idoms[u]
+                for p in preds:
+                    while p != stop:
+                        frontiers[p].add(u)
+                        p = -1 if p == self.root else idoms[p]
+        return self._frontiers
+
+
 class CFG:
     """Control flow graph"""
 
@@ -80,6 +284,7 @@ class CFG:
         """
         self.proc_name = proc_name
         self.lab_entry = lab_entry
+        self._index = None
         self._blockmap = {bl.label: bl for bl in blocks}
         self._fwd = {lab: set() for lab in self._blockmap}  # next()
         self._bwd = {lab: set() for lab in self._blockmap}  # prev()
@@ -97,19 +302,63 @@ class CFG:
         """
         return self._blockmap[lab]
 
+    @property
+    def index(self):
+        """The CFGIndex of this CFG, built on first use and rebuilt after
+        the blocks or edges change"""
+        if self._index is None:
+            self._index = CFGIndex(self)
+        return self._index
+
     def successors(self, lab):
         """Returns iterator over immediate successor blocks"""
-        return iter(self._fwd[lab])
+        index = self.index
+        labels = index.labels
+        return (labels[v] for v in index.successors(index.numbers[lab]))
 
     def out_degree(self, lab):
-        return len(self._fwd[lab])
+        index = self.index
+        u = index.numbers[lab]
+        return index.succ_start[u + 1] - index.succ_start[u]
 
     def predecessors(self, lab):
         """Returns iterator over immediate predecessor blocks"""
-        return iter(self._bwd[lab])
+        index = self.index
+        labels = index.labels
+        return (labels[v] for v in index.predecessors(index.numbers[lab]))
 
     def in_degree(self, lab):
-        return len(self._bwd[lab])
+        index = self.index
+        u = index.numbers[lab]
+        return index.pred_start[u + 1] - index.pred_start[u]
+
+    def idom(self, lab, post=False):
+        """The label of the immediate dominator of the block `lab', or of
+        its immediate post-dominator if `post' is true. It is None for the
+        entry block (or for a block with no successors) and for the blocks
+        that have no dominator because they cannot be reached."""
+        index = self.index
+        u = index.numbers[lab]
+        d = index.dominators(post).idoms[u]
+        if d < 0 or d == u or d == len(index):
+            return None
+        return index.labels[d]
+
+    def dominates(self, lab1, lab2, post=False):
+        """Whether the block `lab1' dominates the block `lab2' (or
+        post-dominates it if `post' is true), in constant time once the
+        dominator tree is built. Blocks that cannot be reached neither
+        dominate nor are dominated."""
+        index = self.index
+        return index.dominators(post).dominates(index.numbers[lab1],
+                                                index.numbers[lab2])
+
+    def dominance_frontier(self, lab, post=False):
+        """The set of the labels of the dominance frontier of the block
+        `lab', or of its post-dominance frontier if `post' is true"""
+        index = self.index
+        frontier = index.dominators(post).frontiers()[index.numbers[lab]]
+        return {index.labels[v] for v in frontier if v < len(index)}
 
     def nodes(self):
         return iter(self._blockmap.values())
@@ -119,12 +368,15 @@ class CFG:
         Returns an iterator over all the edges.
         Each edge is represented as 2-tuples of (source, target) labels.
         """
-        for lab_from in self._fwd:
-            for lab_to in self._fwd[lab_from]:
-                yield (lab_from, lab_to)
+        index = self.index
+        labels, succ_start, succ = index.labels, index.succ_start, index.succ
+        for u, lab_from in enumerate(labels):
+            for k in range(succ_start[u], succ_start[u + 1]):
+                yield (lab_from, labels[succ[k]])
 
     def add_node(self, block):
         assert block.label not in self._blockmap
+        self._index = None
         self._blockmap[block.label] = block
         self._fwd[block.label] = set()
         self._bwd[block.label] = set()
@@ -135,16 +387,22 @@ class CFG:
 
     def remove_node(self, block):
         assert block.label in self._blockmap
+        self._index = None
         del self._blockmap[block.label]
         for lab_to in self._fwd[block.label]:
-            self._bwd[lab_to].remove(block.label)
+            self._bwd[lab_to].discard(block.label)
+        for lab_from in self._bwd[block.label]:
+            self._fwd[lab_from].discard(block.label)
         del self._fwd[block.label]
+        del self._bwd[block.label]
 
     def add_edge(self, lab_from, lab_to):
+        self._index = None
         self._fwd[lab_from].add(lab_to)
         self._bwd[lab_to].add(lab_from)
 
     def remove_edge(self, lab_from, lab_to):
+        self._index = None
         self._fwd[lab_from].remove(lab_to)
         self._bwd[lab_to].remove(lab_from)
 
@@ -378,42 +636,562 @@ def filter_liveset(lab, lset):
             yield x
 
 
+def _bits(x):
+    """Generate the positions of the set bits of the int `x'"""
+    while x:
+        low = x & -x
+        yield low.bit_length() - 1
+        x ^= low
+
+
+class Dataflow:
+    """A bit-vector dataflow problem on a CFG, solved per block on a
+    worklist. The facts are numbered by fact() and the sets of facts are
+    ints used as bitsets. Every instruction has a gen and a kill set and
+    turns a set s into gen | (s & ~kill); the gen and kill sets of a
+    block are composed from those of its instructions.
+
+    A subclass sets `forward' (the direction of the analysis), `may' (if
+    the sets coming from several blocks are met by union, or else by
+    intersection) and `boundary' (the set at the start of a block with no
+    predecessors, or at the end of one with no successors when going
+    backward). Its __init__ fills `gens' and `kills', which give the sets
+    of each instruction of each block number, and then calls solve(). It
+    can override edge() to filter the sets that flow along the edges.
+
+    The worklist starts with the blocks in reverse postorder for a
+    forward problem and in postorder for a backward one. Afterwards,
+    `block_in' and `block_out' hold the sets at the start and at the end
+    of each block, and before() and after() give the facts at each
+    instruction, which are only computed for the blocks asked for. When
+    the instructions of some blocks change, update() brings the solution
+    up to date without solving the whole problem again."""
+
+    forward = True
+    may = True
+    boundary = 0
+
+    def __init__(self, cfg):
+        self.cfg = cfg
+        index = self.index = cfg.index
+        self.bits = dict()      # fact -> bit
+        self.elems = []         # bit -> fact
+        self.instrs = [list(cfg[lab].instrs()) for lab in index.labels]
+        self.where = {instr: (u, k) for u, instrs in enumerate(self.instrs)
+                      for k, instr in enumerate(instrs)}
+        self.gens = [None] * len(index)
+        self.kills = [None] * len(index)
+        self._expanded = dict()     # block number -> (befores, afters)
+        self._sets = dict()         # bitset -> frozenset of its facts
+
+    def fact(self, x):
+        """The bit of the fact `x', numbering it if it is new"""
+        b = self.bits.get(x)
+        if b is None:
+            b = self.bits[x] = len(self.elems)
+            self.elems.append(x)
+        return b
+
+    def facts(self, xs):
+        """The bitset of the facts `xs'"""
+        s = 0
+        for x in xs:
+            s |= 1 << self.fact(x)
+        return s
+
+    @property
+    def universe(self):
+        """The bitset of all the facts"""
+        return (1 << len(self.elems)) - 1
+
+    def edge(self, u, v, s):
+        """The set that flows along the edge from block number `u' to block
+        number `v' (against the edge for a backward problem), when the set
+        `s' is at its start"""
+        return s
+
+    def _compose(self, u):
+        """The gen and kill sets of block number `u'"""
+        gen = kill = 0
+        pairs = list(zip(self.gens[u], self.kills[u]))
+        if not self.forward:
+            pairs.reverse()
+        for igen, ikill in pairs:
+            gen = igen | (gen & ~ikill)
+            kill |= ikill
+        return gen, kill
+
+    def _flow(self):
+        """The block numbers in worklist order and the functions giving
+        the sources and the targets of a block in the analysis direction"""
+        index = self.index
+        if self.forward:
+            return index.rpo, index.predecessors, index.successors
+        return index.postorder, index.successors, index.predecessors
+
+    def solve(self):
+        n = len(self.index)
+        self.block_gens, self.block_kills = [0] * n, [0] * n
+        for u in range(n):
+            self.block_gens[u], self.block_kills[u] = self._compose(u)
+        order = self._flow()[0]
+        top = 0 if self.may else self.universe
+        self.heads, self.tails = [0] * n, [top] * n
+        seen = bytearray(n)
+        for u in order:
+            seen[u] = 1
+        work = list(order)
+        work.extend(u for u in range(n) if not seen[u])
+        self._propagate(work)
+        if self.forward:
+            self.block_in, self.block_out = self.heads, self.tails
+        else:
+            self.block_in, self.block_out = self.tails, self.heads
+
+    def _propagate(self, work):
+        """Run the worklist from the block numbers `work' until the sets
+        stop changing; returns the block numbers whose head set changed"""
+        _, sources, targets = self._flow()
+        edge, may, boundary = self.edge, self.may, self.boundary
+        heads, tails = self.heads, self.tails
+        gens, kills = self.block_gens, self.block_kills
+        work = deque(work)
+        queued = bytearray(len(heads))
+        for u in work:
+            queued[u] = 1
+        changed = set()
+        while len(work) > 0:
+            u = work.popleft()
+            queued[u] = 0
+            head = None
+            for v in sources(u):
+                s = edge(v, u, tails[v]) if self.forward \
+                    else edge(u, v, tails[v])
+                head = s if head is None else head | s if may else head & s
+            head = boundary if head is None else head
+            if head != heads[u]:
+                heads[u] = head
+                changed.add(u)
+            tail = gens[u] | (head & ~kills[u])
+            if tail != tails[u]:
+                tails[u] = tail
+                for v in targets(u):
+                    if not queued[v]:
+                        queued[v] = 1
+                        work.append(v)
+        return changed
+
+    def _generated_before(self, u, b):
+        """Whether the fact numbered `b' reaches the head of block number
+        `u' from a block that generates it, going back along the sources
+        of the blocks that let it through unchanged"""
+        _, sources, _ = self._flow()
+        gens, kills = self.block_gens, self.block_kills
+        bit = 1 << b
+        seen, stack = {u}, [u]
+        while len(stack) > 0:
+            x = stack.pop()
+            for v in sources(x):
+                if self.forward:
+                    def edge(s): return self.edge(v, x, s)
+                else:
+                    def edge(s): return self.edge(x, v, s)
+                if edge(gens[v]) & bit:
+                    return True
+                if v not in seen and not kills[v] & bit and edge(bit) & bit:
+                    seen.add(v)
+                    stack.append(v)
+        return False
+
+    def update(self, blocks):
+        """Bring the solution up to date after the gen and kill sets of
+        the instructions of the block numbers `blocks' changed, and return
+        the block numbers whose sets changed. Only for a may problem: the
+        facts that a changed block may no longer give are first removed
+        from every block that they could have flowed to, and the worklist
+        then runs from all these blocks, which puts back the facts that
+        still come from elsewhere."""
+        if not self.may:
+            raise RuntimeError('Only a may problem can be updated')
+        _, sources, targets = self._flow()
+        heads, tails = self.heads, self.tails
+        gens, kills = self.block_gens, self.block_kills
+        affected = set(blocks)
+        old = {u: heads[u] for u in affected}
+        old_gens = {u: gens[u] for u in affected}
+        for u in affected:
+            gens[u], kills[u] = self._compose(u)
+        lost = []       # (block number, facts removed from its tail)
+        for u in affected:
+            tail = gens[u] | (heads[u] & ~kills[u])
+            gone = tails[u] & ~tail
+            # a fact that the block no longer generates may still be in
+            # its head only because it went around a loop from the block
+            for b in _bits(tail & old_gens[u] & ~gens[u]):
+                if not self._generated_before(u, b):
+                    gone |= 1 << b
+            if gone:
+                lost.append((u, gone))
+                tails[u] &= ~gone
+        while len(lost) > 0:
+            u, s = lost.pop()
+            for v in targets(u):
+                gone = heads[v] & (self.edge(u, v, s) if self.forward
+                                   else self.edge(v, u, s))
+                if not gone:
+                    continue
+                affected.add(v)
+                old.setdefault(v, heads[v])
+                heads[v] &= ~gone
+                gone &= tails[v] & ~gens[v] & ~kills[v]
+                if gone:
+                    tails[v] &= ~gone
+                    lost.append((v, gone))
+        changed = {u for u in self._propagate(sorted(affected))
+                   if heads[u] != old.get(u)}
+        changed.update(u for u in affected
+                       if heads[u] != old[u] or u in blocks)
+        for u in changed:
+            self._expanded.pop(u, None)
+        return changed
+
+    def to_set(self, s):
+        """A new set of the facts of the bitset `s'"""
+        elems = self._sets.get(s)
+        if elems is None:
+            elems = self._sets[s] = frozenset(
+                self.elems[b] for b, c in enumerate(reversed(bin(s)))
+                if c == '1')
+        return set(elems)
+
+    def _expand(self, u):
+        """The bitsets before and after each instruction of block `u'"""
+        sets = self._expanded.get(u)
+        if sets is not None:
+            return sets
+        gens, kills = self.gens[u], self.kills[u]
+        n = len(gens)
+        befores, afters = [0] * n, [0] * n
+        if self.forward:
+            s = self.block_in[u]
+            for k in range(n):
+                befores[k] = s
+                s = afters[k] = gens[k] | (s & ~kills[k])
+        else:
+            s = self.block_out[u]
+            for k in reversed(range(n)):
+                afters[k] = s
+                s = befores[k] = gens[k] | (s & ~kills[k])
+        sets = self._expanded[u] = (befores, afters)
+        return sets
+
+    def before(self, instr):
+        """The set of the facts just before `instr'"""
+        u, k = self.where[instr]
+        return self.to_set(self._expand(u)[0][k])
+
+    def after(self, instr):
+        """The set of the facts just after `instr'"""
+        u, k = self.where[instr]
+        return self.to_set(self._expand(u)[1][k])
+
+
+class Liveness(Dataflow):
+    """Liveness analysis. The facts are the temporaries and, for the phi
+    nodes, (label, temporary) pairs, as in Instr.uses(). Along an edge
+    from a block, the pairs go through filter_liveset() with the label of
+    the block, except on an edge from a block to itself.
+
+    The results are the same as the instruction-level definition: the
+    livein set of an instruction is its uses, plus the livein set of the
+    next instruction of its block (or, on the last instruction, of the
+    first instruction of each successor, filtered as above) minus its
+    defs. Its liveout set is the filter_liveset() of the livein sets of
+    the instructions after it. The pairs are replaced by their
+    temporaries in the final livein sets."""
+
+    forward = False
+
+    def __init__(self, cfg):
+        super().__init__(cfg)
+        self.temp_mask = 0      # the bits of the temporaries
+        self.pair_temp = dict()  # bit of (label, temporary) -> bit of temp
+        self.pair_label = dict()  # bit of (label, temporary) -> label
+        # a def of a temporary kills the temporary and its pairs
+        self.kill_of = dict()   # temporary -> bitset of it and its pairs
+        self.def_blocks = dict()  # temporary -> block numbers defining it
+        self.defs = []          # the defs of each instruction of each block
+        self._stale = set()     # block numbers with out of date kill sets
+        for u, instrs in enumerate(self.instrs):
+            self.gens[u] = [self.facts(i.uses()) for i in instrs]
+            self.defs.append([set(i.defs()) for i in instrs])
+            for ds in self.defs[u]:
+                for t in ds:
+                    self.def_blocks.setdefault(t, set()).add(u)
+        for u, bdefs in enumerate(self.defs):
+            self.kills[u] = [self._kill(ds) for ds in bdefs]
+        self._stale.clear()
+        self.solve()
+
+    def fact(self, x):
+        b = self.bits.get(x)
+        if b is None:
+            temp = x[1] if isinstance(x, tuple) else x
+            if isinstance(x, tuple):
+                temp_bit = self.fact(temp)
+            b = super().fact(x)
+            if isinstance(x, tuple):
+                self.pair_temp[b] = temp_bit
+                self.pair_label[b] = x[0]
+            else:
+                self.temp_mask |= 1 << b
+            # the defs of the temporary now kill one more fact
+            self.kill_of[temp] = self.kill_of.get(temp, 0) | 1 << b
+            self._stale.update(self.def_blocks.get(temp, ()))
+        return b
+
+    def _kill(self, defs):
+        """The kill set of an instruction that defines `defs'"""
+        return sum(self.kill_of.get(t, 0) for t in defs)
+
+    # Changes to the CFG: each of these changes a block and then only
+    # updates the sets of the blocks that it affects (see update())
+
+    def _changed(self, blocks):
+        """Update the solution after the instructions of the block numbers
+        `blocks' changed; returns the block numbers whose sets changed"""
+        for u in self._stale:
+            self.kills[u] = [self._kill(ds) for ds in self.defs[u]]
+        blocks = set(blocks) | self._stale
+        self._stale = set()
+        return self.update(blocks)
+
+    def _renumber(self, u, start=0):
+        for k in range(start, len(self.instrs[u])):
+            self.where[self.instrs[u][k]] = (u, k)
+
+    def remove_instrs(self, instrs):
+        """Remove each of `instrs' from its block; returns the block numbers
+        whose sets changed"""
+        positions = dict()      # block number -> positions to remove
+        for instr in instrs:
+            u, k = self.where.pop(instr)
+            positions.setdefault(u, []).append(k)
+        for u, ks in positions.items():
+            bl = self.cfg[self.index.labels[u]]
+            for k in sorted(ks, reverse=True):
+                if k < len(bl.body):
+                    del bl.body[k]
+                else:
+                    del bl.jumps[k - len(bl.body)]
+                del self.instrs[u][k], self.gens[u][k], \
+                    self.kills[u][k], self.defs[u][k]
+            self._renumber(u, min(ks))
+        return self._changed(positions)
+
+    def remove_instr(self, instr):
+        """Remove `instr' from its block"""
+        self.remove_instrs([instr])
+
+    def insert_instr(self, lab, k, instr):
+        """Insert `instr' in the block labeled `lab', so that it is its
+        k-th instruction counting from 0 as in Block.instrs(). Only
+        instructions that do not jump can be inserted, since the edges of
+        the CFG stay the same."""
+        if _enders.fullmatch(instr.opcode) or instr.opcode == 'label':
+            raise ValueError(f'Cannot insert {instr} in a block')
+        u = self.index.numbers[lab]
+        bl = self.cfg[lab]
+        if k <= len(bl.body):
+            bl.body.insert(k, instr)
+        else:
+            bl.jumps.insert(k - len(bl.body), instr)
+        self.instrs[u].insert(k, instr)
+        self.gens[u].insert(k, self.facts(instr.uses()))
+        defs = set(instr.defs())
+        for t in defs:
+            self.def_blocks.setdefault(t, set()).add(u)
+        self.defs[u].insert(k, defs)
+        self.kills[u].insert(k, self._kill(defs))
+        self._renumber(u, k)
+        self._changed([u])
+
+    def replace_operand(self, instr, old, new):
+        """Replace the uses of the temporary `old' by `new' in `instr'"""
+        u, k = self.where[instr]
+        new = tac._intern(new)
+        if instr.arg1 == old and instr._istemp(old):
+            instr.arg1 = new
+        if instr.arg2 == old and instr._istemp(old):
+            instr.arg2 = new
+        if instr.opcode == 'phi':
+            for l, t in instr.arg1.items():
+                if t == old:
+                    instr.arg1[l] = new
+        self.gens[u][k] = self.facts(instr.uses())
+        self._changed([u])
+
+    def remove_dead_stores(self, lab, removable):
+        """Remove from the block labeled `lab' the instructions for which
+        `removable(instr)' is true and whose destination is not live after
+        them. The block is walked backward, so a chain of such
+        instructions goes in one pass. Returns the labels of the blocks
+        where something else may have become dead."""
+        u = self.index.numbers[lab]
+        bits, instrs = self.bits, self.instrs[u]
+        gens, kills = self.gens[u], self.kills[u]
+        s = self.block_out[u]
+        last = True     # no instruction kept after this one yet
+        dead = []
+        for k in reversed(range(len(instrs))):
+            instr = instrs[k]
+            if instr.dest is not None and removable(instr):
+                if last:
+                    out = 0
+                    for v in self.index.successors(u):
+                        out |= self._filter(lab, self.block_in[v])
+                else:
+                    out = self._filter(lab, s)
+                b = bits.get(instr.dest)
+                if b is None or not (out >> b) & 1:
+                    dead.append(instr)
+                    continue
+            s = gens[k] | (s & ~kills[k])
+            last = False
+        if len(dead) == 0:
+            return []
+        return [self.index.labels[v] for v in self.remove_instrs(dead)]
+
+    def _filter(self, lab, s):
+        """filter_liveset(lab, s) on a bitset"""
+        result = s & self.temp_mask
+        for b in _bits(s & ~self.temp_mask):
+            if self.pair_label[b] == lab:
+                result |= 1 << self.pair_temp[b]
+        return result
+
+    def _strip(self, s):
+        """Replace the pairs of the bitset `s' by their temporaries"""
+        result = s & self.temp_mask
+        for b in _bits(s & ~self.temp_mask):
+            result |= 1 << self.pair_temp[b]
+        return result
+
+    def edge(self, u, v, s):
+        return s if u == v else self._filter(self.index.labels[u], s)
+
+    def livein(self, instr):
+        """The set of the temporaries live before `instr'"""
+        u, k = self.where[instr]
+        return self.to_set(self._strip(self._expand(u)[0][k]))
+
+    def liveout(self, instr):
+        """The set of the temporaries live after `instr'"""
+        u, k = self.where[instr]
+        befores = self._expand(u)[0]
+        lab = self.index.labels[u]
+        if k + 1 < len(befores):
+            return self.to_set(self._filter(lab, befores[k + 1]))
+        s = 0
+        for v in self.index.successors(u):
+            s |= self._filter(lab, self.block_in[v])
+        return self.to_set(s)
+
+
+def expression(instr):
+    """The expression computed by `instr' as a tuple (opcode, arg1, arg2),
+    or None if it does not compute one"""
+    if instr.opcode in tac.binops or instr.opcode in tac.unops:
+        return (instr.opcode, instr.arg1, instr.arg2)
+
+
+class _ExpressionProblem(Dataflow):
+    """A problem whose facts are the expressions computed in the CFG. An
+    instruction kills the expressions with an operand that it changes:
+    its destination and, for a call, every global."""
+
+    may = False
+
+    def __init__(self, cfg):
+        super().__init__(cfg)
+        using = dict()      # operand -> bitset of the expressions using it
+        globals_mask = 0    # the expressions using a global
+        for instrs in self.instrs:
+            for instr in instrs:
+                e = expression(instr)
+                if e is None:
+                    continue
+                b = 1 << self.fact(e)
+                for x in e[1:]:
+                    if isinstance(x, str):
+                        using[x] = using.get(x, 0) | b
+                        if x.startswith('@'):
+                            globals_mask |= b
+        for u, instrs in enumerate(self.instrs):
+            self.gens[u] = [self.gen(instr) for instr in instrs]
+            self.kills[u] = [using.get(instr.dest, 0) |
+                             (globals_mask if instr.opcode == 'call' else 0)
+                             for instr in instrs]
+        self.solve()
+
+
+class AvailableExpressions(_ExpressionProblem):
+    """Available expressions: an expression is available at a point if
+    every path to it computes the expression, and changes none of its
+    operands afterwards"""
+
+    def gen(self, instr):
+        e = expression(instr)
+        if e is None or instr.dest in e[1:]:
+            return 0
+        return 1 << self.bits[e]
+
+
+class VeryBusyExpressions(_ExpressionProblem):
+    """Very busy expressions: an expression is very busy at a point if
+    every path from it computes the expression before changing any of
+    its operands"""
+
+    forward = False
+
+    def gen(self, instr):
+        e = expression(instr)
+        return 0 if e is None else 1 << self.bits[e]
+
+
+class ReachingDefinitions(Dataflow):
+    """Reaching definitions: the facts are the instructions that define a
+    temporary, and a definition reaches a point if some path from it gets
+    there without defining that temporary again"""
+
+    def __init__(self, cfg):
+        super().__init__(cfg)
+        defs_of = dict()    # temporary -> bitset of its definitions
+        for instrs in self.instrs:
+            for instr in instrs:
+                for t in instr.defs():
+                    defs_of[t] = defs_of.get(t, 0) | 1 << self.fact(instr)
+        for u, instrs in enumerate(self.instrs):
+            self.gens[u] = [1 << self.bits[i] if i in self.bits else 0
+                            for i in instrs]
+            self.kills[u] = [sum(defs_of[t] for t in set(i.defs()))
+                             for i in instrs]
+        self.solve()
+
+    def reaching(self, instr, tmp):
+        """The definitions of `tmp' that reach `instr'"""
+        return {d for d in self.before(instr) if d.dest == tmp}
+
+
 def recompute_liveness(cfg, livein, liveout):
     """Perform liveness analysis on the given cfg, storing the results in `livein' and `liveout'.
     Note: both `livein' and `liveout' are cleaned out before computing liveness."""
     livein.clear()
     liveout.clear()
-    # initialize livein with the use sets
+    live = Liveness(cfg)
     for i in cfg.instrs():
-        livein[i] = set(i.uses())
-        liveout[i] = set()
-    dirty = True
-
-    def update_livein(i, j_livein):
-        nonlocal dirty
-        old_count = len(livein[i])
-        old_set = str(livein[i])
-        i_defs = set(i.defs())
-        for x in j_livein:
-            if ((isinstance(x, tuple) and x[1] in i_defs) or
-                    x in i_defs):
-                continue
-            livein[i].add(x)
-        if old_count != len(livein[i]):
-            dirty = True
-    while dirty:
-        dirty = False
-        for (li, i, lj, j) in cfg.instr_pairs(labeled=True):
-            if li == lj:
-                update_livein(i, livein[j])
-            else:
-                update_livein(i, filter_liveset(li, livein[j]))
-    for li, i, lj, j in cfg.instr_pairs(labeled=True):
-        liveout[i].update(filter_liveset(li, livein[j]))
-    # fix the livein sets to remove tuples
-    for i, li in livein.items():
-        livein[i] = {x[1] if isinstance(x, tuple) else x
-                     for x in li}
+        livein[i] = live.livein(i)
+        liveout[i] = live.liveout(i)
 
 # ------------------------------------------------------------------------------
 
@@ -64,7 +64,11 @@
 import re
 import types
 import sys
+import os
 import inspect
+import hashlib
+import pickle
+import tempfile
 
 #-----------------------------------------------------------------------------
 #                     === User configurable parameters ===
@@ -79,6 +83,11 @@ debug_file  = 'parser.out'     # Default name of the debugging file
 error_count = 3                # Number of symbols that must be shifted to leave recovery mode
 resultlimit = 40               # Size limit of results when running in debug mode.
 
+cache_dir   = os.path.join(os.environ.get('XDG_CACHE_HOME') or
+                           os.path.join(os.path.expanduser('~'), '.cache'),
+                           'ply')      # Directory where the parsing tables are
+                                       # cached between runs (None to disable)
+
 MAXINT = sys.maxsize
 
 # This object is a stand-in for a logging object created by the
@@ -2262,6 +2271,62 @@ class ParserReflect(object):
 
         self.grammar = grammar
 
+# -----------------------------------------------------------------------------
+#                           === Table cache ===
+#
+# The action and goto tables computed by LRTable are saved with pickle in
+# cache_dir, in a file named after a hash of the grammar, and are read back
+# by later calls of yacc() on the same grammar instead of being recomputed.
+# Any problem with the cache just means that the tables are recomputed.
+# -----------------------------------------------------------------------------
+
+_cache_format = 1
+
+def grammar_hash(grammar):
+    parts = (_cache_format, grammar.Start,
+             sorted(grammar.Precedence.items()), sorted(grammar.Terminals),
+             [(p.name, p.prod, p.prec, p.func) for p in grammar.Productions])
+    return hashlib.sha256(repr(parts).encode('utf-8')).hexdigest()
+
+def _cache_file(directory, key):
+    return os.path.join(directory, 'lalr-%s.pickle' % key)
+
+# Return an LRTable for grammar with the tables cached under key, or None
+def read_table_cache(directory, key, grammar, log=None):
+    try:
+        with open(_cache_file(directory, key), 'rb') as f:
+            saved_key, action, goto = pickle.load(f)
+    except Exception:
+        return None
+    if saved_key != key:
+        return None
+    lr = LRTable.__new__(LRTable)
+    lr.grammar = grammar
+    lr.log = log or NullLogger()
+    lr.lr_action = action
+    lr.lr_goto = goto
+    lr.lr_productions = grammar.Productions
+    lr.sr_conflict = lr.rr_conflict = 0
+    lr.conflicts = []
+    lr.sr_conflicts = []
+    lr.rr_conflicts = []
+    return lr
+
+def write_table_cache(directory, key, lr):
+    try:
+        os.makedirs(directory, exist_ok=True)
+        fd, tmpname = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((key, lr.lr_action, lr.lr_goto), f,
+                            pickle.HIGHEST_PROTOCOL)
+            os.replace(tmpname, _cache_file(directory, key))
+        except BaseException:
+            os.unlink(tmpname)
+            raise
+    except OSError:
+        pass
+
 # -----------------------------------------------------------------------------
 # yacc(module)
 #
@@ -2270,7 +2335,7 @@ class ParserReflect(object):
 
 def yacc(*, debug=yaccdebug, module=None, start=None,
          check_recursion=True, optimize=False, debugfile=debug_file,
-         debuglog=None, errorlog=None):
+         debuglog=None, errorlog=None, cache=True):
 
     # Reference to the parsing method of the last built parser
     global parse
@@ -2430,8 +2495,16 @@ def yacc(*, debug=yaccdebug, module=None, start=None,
     if errors:
         raise YaccError('Unable to build parser')
 
-    # Run the LRTable on the grammar
-    lr = LRTable(grammar, debuglog)
+    # Run the LRTable on the grammar, unless its tables are in the cache.
+    # The cache is not used in debug mode, which reports on the construction.
+    lr = None
+    if cache and cache_dir and not debug:
+        key = grammar_hash(grammar)
+        lr = read_table_cache(cache_dir, key, grammar, debuglog)
+    if lr is None:
+        lr = LRTable(grammar, debuglog)
+        if cache and cache_dir and not debug:
+            write_table_cache(cache_dir, key, lr)
 
     if debug:
         num_sr = len(lr.sr_conflicts)
@@ -57,17 +57,11 @@ def rewrite_temps(instr, fn):
 
 
 def tmp_root(tmp):
-    try:
-        return tmp[:tmp.rindex('.')]
-    except ValueError:
-        return tmp
+    return tac.symbols.root(tmp)
 
 
 def tmp_version(tmp):
-    try:
-        return tmp[tmp.rindex('.')+1:]
-    except ValueError:
-        return ''
+    return tac.symbols.version(tmp)
 
 
 def crude_ssagen(tlv, cfg):
@@ -83,7 +77,7 @@ def crude_ssagen(tlv, cfg):
     versions = cfglib.counter(transfn=lambda x: f'.{x}')
     for i in cfg.instrs():
         if i.dest and i.dest.startswith('%'):
-            i.dest = i.dest + next(versions)
+            i.dest = tac.symbols.intern(i.dest + next(versions))
     ver_maps = {cfg.proc_name: {t: t for t in tlv.t_args}}
     for bl in cfg.nodes():
         ver_map = dict()
@@ -105,6 +99,8 @@ def crude_ssagen(tlv, cfg):
 def make_dotfiles(cfg, procname, fname, verbosity):
     if fname.endswith('.tac.json'):
         fname = fname[:-5]
+    elif fname.endswith('.tacb'):
+        fname = fname[:-1]
     kwargs = dict()
     if verbosity >= 1:
         livein, liveout = dict(), dict()
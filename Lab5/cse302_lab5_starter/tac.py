@@ -7,9 +7,18 @@ Also includes a parser and interpreter.
 """
 
 import json
+import mmap
+import re
+import struct
+import sys
 import ply.yacc
 import ply.lex
+from array import array
+from collections import OrderedDict
+from collections.abc import Mapping, MutableSequence
+from functools import partial
 from io import StringIO
+from time import perf_counter
 
 # ------------------------------------------------------------------------------
 
@@ -28,6 +37,58 @@ opcode_kinds = {
 }
 opcodes = frozenset(opcode_kinds.keys())
 
+# ------------------------------------------------------------------------------
+
+
+class Symbols:
+    """Table of the names of the temporaries, labels and globals. Every
+    name is interned: the table keeps one copy of it, which all the
+    instructions share, and gives it a small integer ID, in the order the
+    names are seen. The table also records the root and the version of
+    each name, split at its last `.', so that the SSA temporary `%12.7'
+    has the root `%12' and the version `7'; a name without a `.' is its
+    own root, with the version `'."""
+
+    def __init__(self):
+        self.ids = dict()       # name -> ID
+        self.names = []         # ID -> name
+        self.roots = []         # ID -> ID of the root
+        self.versions = []      # ID -> version
+
+    def _add(self, name):
+        dot = name.rfind('.')
+        root = None if dot < 0 else self.id(name[:dot])
+        i = self.ids[name] = len(self.names)
+        self.names.append(name)
+        self.roots.append(i if root is None else root)
+        self.versions.append('' if root is None else name[dot + 1:])
+        return i
+
+    def intern(self, x):
+        """Return the shared copy of `x' if it is a name, or `x' itself
+        if it is any other operand"""
+        if x.__class__ is not str:
+            return x
+        i = self.ids.get(x)
+        return self.names[self._add(x) if i is None else i]
+
+    def id(self, name):
+        """The ID of `name'"""
+        i = self.ids.get(name)
+        return self._add(name) if i is None else i
+
+    def root(self, name):
+        """The root of `name', e.g. `%12' for `%12.7'"""
+        return self.names[self.roots[self.id(name)]]
+
+    def version(self, name):
+        """The version of `name', e.g. `7' for `%12.7'"""
+        return self.versions[self.id(name)]
+
+
+symbols = Symbols()     # the symbols of all the TAC loaded in this process
+_intern = symbols.intern
+
 
 class Instr:
     __slots__ = ('dest', 'opcode', 'arg1', 'arg2')
@@ -38,12 +99,22 @@ class Instr:
         the opcode is.
 
         Raises ValueError if attempting to create an invalid Instr."""
-        self.dest = dest
+        self.dest = _intern(dest)
         self.opcode = opcode
-        self.arg1 = None if len(args) < 1 else args[0]
-        self.arg2 = None if len(args) < 2 else args[1]
+        self.arg1 = None if len(args) < 1 else _intern(args[0])
+        self.arg2 = None if len(args) < 2 else _intern(args[1])
+        if isinstance(self.arg1, dict):
+            self.arg1 = {_intern(l): _intern(t) for l, t in self.arg1.items()}
         self._check()
 
+    @classmethod
+    def _unchecked(cls, dest, opcode, arg1, arg2):
+        """Create an instruction that is known to be well-formed"""
+        instr = cls.__new__(cls)
+        instr.dest, instr.opcode, instr.arg1, instr.arg2 = \
+            _intern(dest), opcode, _intern(arg1), _intern(arg2)
+        return instr
+
     def __hash__(self):
         return hash(id(self))
 
@@ -162,9 +233,9 @@ class Instr:
         is no mapping. If `rew' is a function, then every temporary t will
         be mapped to `rew(t)'."""
         if isinstance(rew, dict):
-            def lookup(t): return rew.get(t, t)
+            def lookup(t): return _intern(rew.get(t, t))
         else:
-            lookup = rew
+            def lookup(t): return _intern(rew(t))
         if self._istemp(self.dest):
             self.dest = lookup(self.dest)
         if self._istemp(self.arg1):
@@ -191,11 +262,192 @@ class Instr:
                 'result': self.dest}
 
 
+_opcode_codes = {opcode: code for code, opcode in enumerate(opcode_kinds)}
+_code_opcodes = tuple(opcode_kinds)
+
+
+class ProcBody(MutableSequence):
+    """The body of a proc stored as columns: `opcodes' holds a code for the
+    opcode of each instruction (its position in opcode_kinds), and
+    `dests', `arg1s' and `arg2s' hold references to the operands. A
+    reference is the symbols.id() of a name, -1 for None, or -2 - i for
+    the i-th entry of `pool', which holds the numbers (once each) and the
+    phi arguments. An instruction costs 13 bytes instead of an Instr
+    object and a list slot, and the analyses can walk the columns
+    directly.
+
+    Indexing gives InstrView objects, so a ProcBody can be used wherever a
+    list of Instr is expected."""
+
+    def __init__(self, instrs=()):
+        self.opcodes = array('B')
+        self.dests = array('i')
+        self.arg1s = array('i')
+        self.arg2s = array('i')
+        self.pool = []
+        self._pooled = dict()   # number -> its index in the pool
+        for instr in instrs:
+            self.append(instr)
+
+    def ref(self, x):
+        """The reference to the operand `x', adding `x' to the pool if
+        needed"""
+        if x is None:
+            return -1
+        if x.__class__ is str:
+            return symbols.id(x)
+        if x.__class__ is int:
+            i = self._pooled.get(x)
+            if i is None:
+                i = self._pooled[x] = len(self.pool)
+                self.pool.append(x)
+            return -2 - i
+        self.pool.append(x)
+        return -1 - len(self.pool)
+
+    def operand(self, ref):
+        """The operand referred to by `ref'"""
+        if ref >= 0:
+            return symbols.names[ref]
+        return None if ref == -1 else self.pool[-2 - ref]
+
+    def add(self, dest, opcode, arg1, arg2):
+        """Append the instruction with the given fields, which must be
+        well-formed"""
+        self.opcodes.append(_opcode_codes[opcode])
+        self.dests.append(self.ref(dest))
+        self.arg1s.append(self.ref(arg1))
+        self.arg2s.append(self.ref(arg2))
+
+    def opcode_list(self):
+        """The opcode of every instruction, as a list"""
+        return [_code_opcodes[code] for code in self.opcodes]
+
+    def instrs(self):
+        """The instructions as a list of new Instr objects"""
+        operand = self.operand
+        return [Instr._unchecked(operand(d), _code_opcodes[code],
+                                 operand(a), operand(b))
+                for code, d, a, b in zip(self.opcodes, self.dests,
+                                         self.arg1s, self.arg2s)]
+
+    def _index(self, i):
+        n = len(self.opcodes)
+        if not -n <= i < n:
+            raise IndexError('ProcBody index out of range')
+        return i % n
+
+    def __len__(self):
+        return len(self.opcodes)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [InstrView(self, j) for j in range(*i.indices(len(self)))]
+        return InstrView(self, self._index(i))
+
+    def __iter__(self):
+        for i in range(len(self.opcodes)):
+            yield InstrView(self, i)
+
+    def __setitem__(self, i, instr):
+        if isinstance(i, slice):
+            instrs, start = list(instr), i.indices(len(self))[0]
+            del self[i]
+            for j, instr in enumerate(instrs, start):
+                self.insert(j, instr)
+            return
+        i = self._index(i)
+        self.opcodes[i] = _opcode_codes[instr.opcode]
+        self.dests[i] = self.ref(instr.dest)
+        self.arg1s[i] = self.ref(instr.arg1)
+        self.arg2s[i] = self.ref(instr.arg2)
+
+    def __delitem__(self, i):
+        if not isinstance(i, slice):
+            i = self._index(i)
+        del self.opcodes[i], self.dests[i], self.arg1s[i], self.arg2s[i]
+
+    def insert(self, i, instr):
+        self.opcodes.insert(i, _opcode_codes[instr.opcode])
+        self.dests.insert(i, self.ref(instr.dest))
+        self.arg1s.insert(i, self.ref(instr.arg1))
+        self.arg2s.insert(i, self.ref(instr.arg2))
+
+
+def _column_field(column):
+    def get(self):
+        return self.body.operand(getattr(self.body, column)[self.index])
+
+    def set(self, x):
+        getattr(self.body, column)[self.index] = self.body.ref(x)
+    return property(get, set)
+
+
+class InstrView(Instr):
+    """Flyweight Instr for the instruction at `index' of the ProcBody
+    `body': its fields are read from and written to the columns of the
+    body. Two views of the same instruction are equal. A view follows its
+    index, so it moves to another instruction when instructions are
+    inserted or deleted before it."""
+    __slots__ = ('body', 'index')
+
+    def __init__(self, body, index):
+        self.body = body
+        self.index = index
+
+    dest = _column_field('dests')
+    arg1 = _column_field('arg1s')
+    arg2 = _column_field('arg2s')
+
+    @property
+    def opcode(self):
+        return _code_opcodes[self.body.opcodes[self.index]]
+
+    @opcode.setter
+    def opcode(self, opcode):
+        self.body.opcodes[self.index] = _opcode_codes[opcode]
+
+    def __hash__(self):
+        return hash((id(self.body), self.index))
+
+    def __eq__(self, other):
+        return (isinstance(other, InstrView) and
+                self.body is other.body and self.index == other.index)
+
+
 class Proc:
     def __init__(self, name, t_args, body):
-        self.name = name
+        self.name = _intern(name)
         self.body = body or []
-        self.t_args = tuple(t_args)
+        self.t_args = tuple(map(_intern, t_args))
+
+    @property
+    def body(self):
+        return self._body
+
+    @body.setter
+    def body(self, body):
+        self._body = body
+        self._prepared = None
+
+    def compact(self):
+        """Store the body as a ProcBody, if it is not one already"""
+        if not isinstance(self.body, ProcBody):
+            self.body = ProcBody(self.body)
+
+    def invalidate(self):
+        """Discard the cached Prepared form of this proc. Replacing the body
+        does this automatically; call it after editing the body in place."""
+        self._prepared = None
+
+    def prepared(self, machine):
+        """Return this proc prepared for the interpreter `machine' (see
+        Prepared). It is built on first use and shared by all later calls
+        on the same machine, which execute() reuses from run to run (see
+        Machine.acquire())."""
+        if self._prepared is None or self._prepared.machine is not machine:
+            self._prepared = Prepared(self, machine)
+        return self._prepared
 
     def __str__(self):
         result = StringIO()
@@ -224,7 +476,7 @@ class Proc:
 
 class Gvar:
     def __init__(self, name, value):
-        self.name = name
+        self.name = _intern(name)
         self.value = value
 
     def __str__(self):
@@ -402,6 +654,457 @@ class Parser:
 # ------------------------------------------------------------------------------
 
 
+# the forms of the destination and arguments that are valid for each opcode,
+# as strings of N (none), T (temporary), G (global), L (label) and I (number)
+_kind_forms = {'N': 'N', 'I': 'I', 'V': 'TGL', 'L': 'L', 'G': 'G',
+               'O': 'NTGL', 'F': ''}
+_opcode_forms = {opcode: frozenset(d + a + b
+                                   for d in _kind_forms[kind[0]]
+                                   for a in _kind_forms[kind[1]]
+                                   for b in _kind_forms[kind[2]])
+                 for opcode, kind in opcode_kinds.items()}
+
+
+class Reader:
+    """Streaming reader of TAC text, a faster alternative to Lexer and
+    Parser: it accepts the same language, builds the same objects, and
+    reports errors in the same way. The text is read from `lines' one line
+    at a time. A line holding just one instruction or label, the usual
+    layout, is matched as a whole by a single regular expression; other
+    lines are split into tokens.
+
+    Iterating over a Reader generates the Gvar and Proc objects in order,
+    each one as soon as it is complete."""
+
+    _token = re.compile(
+        r'(?P<ws>[ \t\f\v\r]+)|(?P<comment>//.*)'
+        r'|(?P<OPCODE>[A-Za-z_][A-Za-z0-9_]*)'
+        r'|(?P<NUM64>0|-?[1-9][0-9]*)'
+        r'|(?P<TEMP>%(?:0|[1-9][0-9]*|[A-Za-z][A-Za-z0-9_]*))'
+        r'|(?P<GSYM>@[A-Za-z_][A-Za-z0-9_]*)'
+        r'|(?P<LABEL>%\.L[A-Za-z0-9_]*)'
+        r'|(?P<EQ>=)|(?P<COMMA>,)|(?P<SEMICOLON>;)|(?P<COLON>:)'
+        r'|(?P<LPAREN>\()|(?P<RPAREN>\))|(?P<error>.)')
+    _arg = (r'%(?:0|[1-9][0-9]*|[A-Za-z][A-Za-z0-9_]*)'
+            r'|0|-?[1-9][0-9]*|@[A-Za-z_][A-Za-z0-9_]*|%\.L[A-Za-z0-9_]*')
+    _line = re.compile(
+        r'[ \t\f\v\r]*(?:(?P<lab>%\.L[A-Za-z0-9_]*)[ \t\f\v\r]*:'
+        r'|(?:(?P<dest>%(?:0|[1-9][0-9]*|[A-Za-z][A-Za-z0-9_]*)'
+        r'|@[A-Za-z_][A-Za-z0-9_]*)[ \t\f\v\r]*=[ \t\f\v\r]*)?'
+        r'(?P<opcode>[A-Za-z_][A-Za-z0-9_]*)'
+        rf'(?:[ \t\f\v\r]+(?P<arg1>{_arg})'
+        rf'(?:[ \t\f\v\r]*,[ \t\f\v\r]*(?P<arg2>{_arg}))?)?'
+        r'[ \t\f\v\r]*;)[ \t\f\v\r]*(?://.*)?$')
+    _args = frozenset(('TEMP', 'NUM64', 'LABEL', 'GSYM'))
+    # the tokens that can follow an instruction; INSTR and LABELDEF stand
+    # for a whole line matched by _line
+    _follow = frozenset(('LABEL', 'TEMP', 'GSYM', 'OPCODE',
+                         'VAR', 'PROC', '$end', 'INSTR', 'LABELDEF'))
+
+    def __init__(self, lines, provenance="<unknown>", first_lineno=1,
+                 compact=False):
+        """`lines' is an iterable of lines, such as an open file, or a
+        string that is split into lines; the first one has the number
+        `first_lineno' in the messages. If `compact', the bodies of the
+        procs are built as ProcBody objects."""
+        self.lines = lines.split('\n') if isinstance(lines, str) else lines
+        self.provenance = provenance
+        self.first_lineno = first_lineno
+        self.compact = compact
+        self._boundary = False  # is the parser between two instructions?
+
+    def tokens(self):
+        """Generate the tokens as (type, value, line number) triples, with a
+        final '$end' token. At the start of a line, if the parser is between
+        two instructions, a line with just an instruction is one INSTR token
+        with the value (dest, opcode, args, valid), where `valid' tells if
+        the operands are known to be valid for the opcode, and a line with
+        just a label is one LABELDEF token."""
+        reserved = Lexer.reserved
+        line_re, forms, no_forms = self._line, _opcode_forms, frozenset()
+        lineno = self.first_lineno - 1
+        for lineno, line in enumerate(self.lines, self.first_lineno):
+            line = line.rstrip('\n')
+            m = line_re.match(line) if self._boundary else None
+            if m is not None:
+                lab, dest, opcode, arg1, arg2 = m.groups()
+                if lab is not None:
+                    yield 'LABELDEF', lab, lineno
+                    continue
+                form = 'N' if dest is None else 'G' if dest[0] == '@' else 'T'
+                args = []
+                for arg in (arg1, arg2):
+                    if arg is None:
+                        form += 'N'
+                    elif arg[0] == '@':
+                        form += 'G'
+                        args.append(arg)
+                    elif arg[0] == '%':
+                        form += 'L' if arg[1] == '.' else 'T'
+                        args.append(arg)
+                    else:
+                        form += 'I'
+                        args.append(int(arg))
+                        if args[-1] & 0xffffffffffffffff != args[-1]:
+                            break   # reported below
+                else:
+                    if opcode not in reserved:
+                        yield 'INSTR', (dest, opcode, args,
+                                        form in forms.get(opcode, no_forms)), \
+                            lineno
+                        continue
+            for m in self._token.finditer(line):
+                kind = m.lastgroup
+                if kind == 'ws' or kind == 'comment':
+                    continue
+                value = m.group()
+                if kind == 'OPCODE':
+                    kind = reserved.get(value, 'OPCODE')
+                elif kind == 'NUM64':
+                    value = int(value)
+                    if value & 0xffffffffffffffff != value:
+                        print(f'{self.provenance}:{lineno}:'
+                              f'Error: numerical literal {value} not in '
+                              f'[{-1<<63}, {1<<63})')
+                        raise SyntaxError('immint')
+                elif kind == 'error':
+                    print(f'{self.provenance}:{lineno}:'
+                          f'Warning: skipping illegal character: {value}')
+                    continue
+                yield kind, value, lineno
+        yield '$end', None, lineno
+
+    def _error(self, tok):
+        if tok[0] != '$end':
+            print(f'{self.provenance}:{tok[2]}:'
+                  f'Error:syntax error at token {tok[0]}')
+        raise RuntimeError('parsing')
+
+    def __iter__(self):
+        toks = self.tokens()
+        tok = None
+
+        def advance(boundary=False):
+            nonlocal tok
+            self._boundary = boundary
+            tok = next(toks)
+
+        def expect(kind, boundary=False):
+            if tok[0] != kind:
+                self._error(tok)
+            value = tok[1]
+            advance(boundary)
+            return value
+
+        advance()
+        while tok[0] != '$end':
+            if tok[0] == 'VAR':
+                advance()
+                name = expect('GSYM')
+                expect('EQ')
+                value = expect('NUM64')
+                expect('SEMICOLON')
+                yield Gvar(name, value)
+                continue
+            expect('PROC')
+            name = expect('GSYM')
+            t_args = []
+            if tok[0] == 'LPAREN':
+                advance()
+                if tok[0] == 'TEMP':
+                    t_args.append(tok[1])
+                    advance()
+                    while tok[0] == 'COMMA':
+                        advance()
+                        t_args.append(expect('TEMP'))
+                expect('RPAREN')
+            expect('COLON', boundary=True)
+            body = ProcBody() if self.compact else []
+            while tok[0] not in ('VAR', 'PROC', '$end'):
+                kind = tok[0]
+                valid = False
+                if kind == 'INSTR':
+                    dest, opcode, args, valid = tok[1]
+                    advance(boundary=True)
+                elif kind == 'LABELDEF':
+                    dest, opcode, args, valid = None, 'label', [tok[1]], True
+                    advance(boundary=True)
+                elif kind == 'LABEL':
+                    dest, opcode, args, valid = None, 'label', [tok[1]], True
+                    advance()
+                    expect('COLON', boundary=True)
+                else:
+                    dest = None
+                    if kind == 'TEMP' or kind == 'GSYM':
+                        dest = tok[1]
+                        advance()
+                        expect('EQ')
+                    opcode = expect('OPCODE')
+                    args = []
+                    if tok[0] in self._args:
+                        args.append(tok[1])
+                        advance()
+                        if tok[0] == 'COMMA':
+                            advance()
+                            if tok[0] not in self._args:
+                                self._error(tok)
+                            args.append(tok[1])
+                            advance()
+                    expect('SEMICOLON', boundary=True)
+                # as with Parser, the instruction is only built once the
+                # next token is known to be valid
+                if tok[0] not in self._follow:
+                    self._error(tok)
+                if valid and self.compact:
+                    body.add(dest, opcode, args[0] if len(args) > 0 else None,
+                             args[1] if len(args) > 1 else None)
+                elif valid:
+                    body.append(Instr._unchecked(
+                        dest, opcode, args[0] if len(args) > 0 else None,
+                        args[1] if len(args) > 1 else None))
+                else:
+                    body.append(Instr(dest, opcode, args))
+            yield Proc(name, t_args, body)
+
+# ------------------------------------------------------------------------------
+
+
+# The binary .tacb format. A file is a header followed by four sections:
+#
+#  - the string table: n_strings + 1 u32 offsets into the string data,
+#    then the UTF-8 string data; every opcode, temporary, label and
+#    global name is stored once and referred to by its index
+#  - the top-level table: a _tacb_tlv record for each gvar and proc, in
+#    the order of the program; a proc record gives the range of its
+#    arguments in the u32 list and of its instructions
+#  - the u32 list: the arguments of the procs and the (label, temporary)
+#    pairs of the phi nodes, as string indices
+#  - the instructions: a fixed-width _tacb_instr record for each
+#
+# Each operand is a kind and a 64-bit value: a string index for _K_STR,
+# the number for _K_INT and _K_UINT (stored minus 2**64), and for _K_PHI
+# the start of its pairs in the u32 list plus their count shifted by 32.
+# All numbers are little-endian.
+
+_tacb_magic = b'TACB'
+_tacb_version = 1
+# magic, version, n_strings, size of the string data, n_tlvs, size of the
+# u32 list, n_instrs
+_tacb_header = struct.Struct('<4sHxxIIIII')
+# is_proc, kind of the value, name, n_args, start of the arguments, start
+# of the instructions, n_instrs, value of a gvar
+_tacb_tlv = struct.Struct('<BBxxIIIIIq')
+# opcode, dest, kind of dest, of arg1 and of arg2, arg1, arg2
+_tacb_instr = struct.Struct('<IIBBBxqq')
+_K_NONE, _K_STR, _K_INT, _K_UINT, _K_PHI = range(5)
+
+
+def dump_tacb(prog, fp):
+    """Write the Gvar and Proc objects of `prog' to the binary file `fp' in
+    the .tacb format"""
+    strings = dict()
+    ulist = array('I')
+    tlvs, instrs = [], []
+
+    def intern(s):
+        i = strings.get(s)
+        if i is None:
+            i = strings[s] = len(strings)
+        return i
+
+    def operand(x):
+        if x is None:
+            return _K_NONE, 0
+        if isinstance(x, str):
+            return _K_STR, intern(x)
+        if isinstance(x, dict):
+            start = len(ulist)
+            for lab, tmp in x.items():
+                ulist.extend((intern(lab), intern(tmp)))
+            return _K_PHI, start | len(x) << 32
+        if isinstance(x, int) and -sign_mask <= x <= full_mask:
+            return (_K_INT, x) if x < sign_mask else (_K_UINT, x - (1 << 64))
+        raise ValueError(f'cannot store {x!r} in a .tacb file')
+
+    for tlv in prog:
+        if isinstance(tlv, Gvar):
+            kind, value = operand(tlv.value)
+            if kind not in (_K_INT, _K_UINT):
+                raise ValueError(f'cannot store the value of {tlv.name} '
+                                 f'in a .tacb file')
+            tlvs.append(_tacb_tlv.pack(0, kind, intern(tlv.name),
+                                       0, 0, 0, 0, value))
+            continue
+        args_start, instrs_start = len(ulist), len(instrs)
+        ulist.extend(intern(t) for t in tlv.t_args)
+        for instr in tlv.body:
+            dest_kind, dest = operand(instr.dest)
+            kind1, value1 = operand(instr.arg1)
+            kind2, value2 = operand(instr.arg2)
+            instrs.append(_tacb_instr.pack(intern(instr.opcode), dest,
+                                           dest_kind, kind1, kind2,
+                                           value1, value2))
+        tlvs.append(_tacb_tlv.pack(1, _K_NONE, intern(tlv.name),
+                                   len(tlv.t_args), args_start, instrs_start,
+                                   len(tlv.body), 0))
+    data = [s.encode() for s in strings]
+    offsets = array('I', [0])
+    for b in data:
+        offsets.append(offsets[-1] + len(b))
+    fp.write(_tacb_header.pack(_tacb_magic, _tacb_version, len(data),
+                               offsets[-1], len(tlvs), len(ulist),
+                               len(instrs)))
+    if sys.byteorder != 'little':
+        ulist.byteswap()
+        offsets.byteswap()
+    fp.write(offsets.tobytes())
+    fp.write(b''.join(data))
+    fp.write(b''.join(tlvs))
+    fp.write(ulist.tobytes())
+    fp.write(b''.join(instrs))
+
+
+class TacbFile:
+    """A .tacb file mapped into memory. Only the header is read when it is
+    opened; the gvars and procs are looked up by name and each one is
+    decoded when it is asked for, without touching the rest of the file.
+    Iterating over a TacbFile generates all of them in order. If
+    `compact', the bodies of the procs are built as ProcBody objects."""
+
+    def __init__(self, tac_file, compact=False):
+        self.provenance = tac_file
+        self.compact = compact
+        with open(tac_file, 'rb') as fp:
+            try:
+                self.mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # the file is empty
+                self.mm = b''
+        if len(self.mm) < _tacb_header.size:
+            raise ValueError(f'{tac_file}: not a .tacb file')
+        magic, version, n_strings, data_size, self.n_tlvs, n_ulist, \
+            n_instrs = _tacb_header.unpack_from(self.mm, 0)
+        if magic != _tacb_magic or version != _tacb_version:
+            raise ValueError(f'{tac_file}: not a .tacb file '
+                             f'of version {_tacb_version}')
+        self.offsets_at = _tacb_header.size
+        self.data_at = self.offsets_at + 4 * (n_strings + 1)
+        self.tlvs_at = self.data_at + data_size
+        self.ulist_at = self.tlvs_at + _tacb_tlv.size * self.n_tlvs
+        self.instrs_at = self.ulist_at + 4 * n_ulist
+        if len(self.mm) != self.instrs_at + _tacb_instr.size * n_instrs:
+            raise ValueError(f'{tac_file}: truncated .tacb file')
+        self._strings = [None] * n_strings
+        self._str_operands = [None] * n_strings
+        self._index = None
+
+    def close(self):
+        if isinstance(self.mm, mmap.mmap):
+            self.mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def string(self, i):
+        """The string of index `i' of the string table"""
+        s = self._strings[i]
+        if s is None:
+            start, end = struct.unpack_from('<II', self.mm,
+                                            self.offsets_at + 4 * i)
+            s = self._strings[i] = \
+                self.mm[self.data_at + start:self.data_at + end].decode()
+        return s
+
+    def _ulist(self, start, count):
+        return struct.unpack_from(f'<{count}I', self.mm,
+                                  self.ulist_at + 4 * start)
+
+    @property
+    def index(self):
+        """The position in the top-level table of each gvar and proc, by
+        name"""
+        if self._index is None:
+            self._index = {name: i for i, (name, _) in
+                           enumerate(self.declarations())}
+        return self._index
+
+    def declarations(self):
+        """Generate the (name, is_proc) pair of each gvar and proc, in
+        order, without decoding them"""
+        for i in range(self.n_tlvs):
+            is_proc, _, name = _tacb_tlv.unpack_from(
+                self.mm, self.tlvs_at + _tacb_tlv.size * i)[:3]
+            yield self.string(name), bool(is_proc)
+
+    def __len__(self):
+        return self.n_tlvs
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __getitem__(self, name):
+        """The Gvar or Proc called `name'"""
+        return self._decode(self.index[name])
+
+    def __iter__(self):
+        for i in range(self.n_tlvs):
+            yield self._decode(i)
+
+    def _operand(self, kind, value):
+        """The operand stored as `kind' and `value', and its form as in
+        _opcode_forms ('F' for phi arguments, '?' if not valid)"""
+        if kind == _K_STR:
+            op = self._str_operands[value]
+            if op is None:
+                s = self.string(value)
+                op = self._str_operands[value] = \
+                    s, ('G' if s[:1] == '@' else 'L' if s[:3] == '%.L'
+                        else 'T' if s[:1] == '%' else '?')
+            return op
+        if kind == _K_INT:
+            return value, 'I'
+        if kind == _K_UINT:
+            return value + (1 << 64), 'I'
+        if kind == _K_PHI:
+            pairs = self._ulist(value & 0xffffffff, 2 * (value >> 32))
+            return {self.string(pairs[j]): self.string(pairs[j + 1])
+                    for j in range(0, len(pairs), 2)}, 'F'
+        return None, 'N'
+
+    def _decode(self, i):
+        is_proc, kind, name, n_args, args_start, instrs_start, n_instrs, \
+            value = _tacb_tlv.unpack_from(self.mm,
+                                          self.tlvs_at + _tacb_tlv.size * i)
+        if not is_proc:
+            return Gvar(self.string(name), self._operand(kind, value)[0])
+        params = [self.string(t) for t in self._ulist(args_start, n_args)]
+        operand, string, forms = self._operand, self.string, _opcode_forms
+        no_forms = frozenset()
+        body = ProcBody() if self.compact else []
+        start = self.instrs_at + _tacb_instr.size * instrs_start
+        end = start + _tacb_instr.size * n_instrs
+        with memoryview(self.mm)[start:end] as records:
+            for opcode, dest, dest_kind, kind1, kind2, value1, value2 in \
+                    _tacb_instr.iter_unpack(records):
+                opcode = string(opcode)
+                dest, form0 = operand(dest_kind, dest)
+                arg1, form1 = operand(kind1, value1)
+                arg2, form2 = operand(kind2, value2)
+                # as in Reader, only the operands of unusual forms (and
+                # of phi nodes) go through Instr._check()
+                if form0 + form1 + form2 not in forms.get(opcode, no_forms):
+                    body.append(Instr(dest, opcode, (arg1, arg2)))
+                elif self.compact:
+                    body.add(dest, opcode, arg1, arg2)
+                else:
+                    body.append(Instr._unchecked(dest, opcode, arg1, arg2))
+        return Proc(self.string(name), params, body)
+
+# ------------------------------------------------------------------------------
+
+
 word_bytes = 8
 word_bits = 8 * word_bytes
 sign_mask = 1 << (word_bits - 1)
@@ -445,202 +1148,1464 @@ jumps = {
     'jnle': (lambda k: untwoc(k) > 0),
 }
 
+# Specialized kernels working directly on 64-bit words. They compute the
+# same results as binops, unops and jumps above, which remain the reference
+# definitions, but only convert operands to signed integers where the sign
+# matters. Division truncates exactly rather than via float division.
 
-class TempMap(dict):
-    """Mapping temporaries to values"""
 
-    def __init__(self, gvars):
+def _word_div(u, v):
+    x, y = untwoc(u), untwoc(v)
+    q = abs(x) // abs(y)
+    return (-q if (x < 0) != (y < 0) else q) & full_mask
+
+
+def _word_mod(u, v):
+    x = untwoc(u)
+    r = abs(x) % abs(untwoc(v))
+    return (-r if x < 0 else r) & full_mask
+
+
+def _word_shl(u, v):
+    if v & sign_mask:
+        raise ValueError('negative shift count')
+    return (u << v) & full_mask if v < word_bits else 0
+
+
+def _word_shr(u, v):
+    if v & sign_mask:
+        raise ValueError('negative shift count')
+    return (untwoc(u) >> v) & full_mask
+
+
+word_binops = {
+    'add': (lambda u, v: (u + v) & full_mask),
+    'sub': (lambda u, v: (u - v) & full_mask),
+    'mul': (lambda u, v: (u * v) & full_mask),
+    'div': _word_div,
+    'mod': _word_mod,
+    'and': (lambda u, v: u & v),
+    'or': (lambda u, v: u | v),
+    'xor': (lambda u, v: u ^ v),
+    'shl': _word_shl,
+    'shr': _word_shr,
+}
+word_unops = {
+    'neg': (lambda u: -u & full_mask),
+    'not': (lambda u: u ^ full_mask),
+}
+word_jumps = {
+    'jz':   (lambda k: k == 0),
+    'jnz':  (lambda k: k != 0),
+    'jl':   (lambda k: k >= sign_mask),
+    'jle':  (lambda k: k == 0 or k >= sign_mask),
+    'jnl':  (lambda k: k < sign_mask),
+    'jnle': (lambda k: 0 < k < sign_mask),
+}
+
+
+class Output:
+    """Buffered sink for the lines printed by a run of the interpreter.
+    The lines are written to `fp' (sys.stdout at the time of writing if
+    None) in one go when `limit' of them are pending, and on flush()."""
+
+    def __init__(self, fp=None, limit=4096):
+        self.fp = fp
+        self.limit = limit
+        self.lines = []
+
+    def write(self, line):
+        self.lines.append(line)
+        if len(self.lines) >= self.limit:
+            self.flush()
+
+    def flush(self):
+        if len(self.lines) > 0:
+            fp = sys.stdout if self.fp is None else self.fp
+            fp.write('\n'.join(self.lines) + '\n')
+            fp.flush()
+            self.lines = []
+
+
+class CaptureOutput(Output):
+    """Sink that keeps all the printed lines in memory, in `lines'"""
+
+    def __init__(self):
         super().__init__()
-        self.gvars = gvars
 
-    def _valid_temp(self, tmp):
-        return isinstance(tmp, str) and \
-            (tmp.startswith('%') or tmp.startswith('@'))
-
-    def _valid_value(self, val):
-        return isinstance(val, int) and \
-            0 <= val <= 0xffffffffffffffff
-
-    def __getitem__(self, tmp):
-        if tmp.startswith('@'):
-            return self.gvars[tmp].value
-        #print("DICT: ", self)
-        return super().__getitem__(tmp)
-
-    def copy(self):
-        tm = TempMap(self.gvars.copy())
-        for k, v in super().items():
-            tm[k] = v
-        return tm
-
-    def __setitem__(self, tmp, val):
-        assert self._valid_temp(tmp)
-        if not self._valid_value(val):
-            raise RuntimeError(f'Illegal value: {val}: '
-                               f'{-0x8000000000000000 <= val} '
-                               f'{val < 0x8000000000000000}')
-        if tmp.startswith('@'):
-            self.gvars[tmp].value = val
-        else:
-            super().__setitem__(tmp, val)
+    def write(self, line):
+        self.lines.append(line)
 
+    def flush(self):
+        pass
 
-def execute(gvars, procs, proc_name, args, **kwargs):
-    show_proc = kwargs.get('show_proc', False)
-    show_instr = kwargs.get('show_instr', False)
-    only_decimal = kwargs.get('only_decimal', True)
-    depth = kwargs.get('depth', 0)
-    indent = '  ' * depth
+    def getvalue(self):
+        """Return the output as one string, as it would have been printed"""
+        return ''.join(line + '\n' for line in self.lines)
 
-    values = TempMap(gvars)
-    proc = procs[proc_name]
 
-    for i in range(len(proc.t_args)):
-        values[proc.t_args[i]] = args[i]
+class Machine:
+    """State shared by all the frames of one run of the interpreter: the
+    global variables, the pending call parameters, the output sink, and the
+    registers used by decoded instructions to hand calls and returns over
+    to execute().
 
-    oldvalues = values.copy()
+    Every global gets a slot in the shared array `gvals'; the values are
+    written back to the Gvar objects by store_globals().
 
-    proc_desc = f'{proc_name}({",".join(k + "=" + str(v) for k, v in values.items())})'
-    if show_proc:
-        print(f'// {indent}entering {proc_desc}')
+    The procs are prepared for one Machine (see Proc.prepared()), since
+    their closures hold it and its `gvals'. So that they can be reused by
+    later runs, execute() gets its Machine from acquire(), which hands
+    out the one released by an earlier run with the same globals."""
+    __slots__ = ('gvars', 'procs', 'gslots', 'gvals', 'only_decimal', 'out',
+                 'params', 'callee', 'ret_dest', 'ret_pc', 'retval')
+    _idle = dict()      # tuple of the global names -> released Machine
 
-    labels = dict()
-    for i, instr in enumerate(proc.body):
-        if instr.opcode != 'label':
-            continue
-        if instr.arg1 in labels:
-            raise RuntimeError(f'Reused label {instr.arg1}')
-        ni = i + 1  # next instruction index
-        while ni < len(proc.body):
-            if proc.body[ni].opcode != 'label':
-                break
-            ni += 1
-        labels[instr.arg1] = ni
+    def __init__(self, gvars, procs, only_decimal=True, out=None):
+        self.gslots = {name: i for i, name in enumerate(gvars)}
+        self.gvals = []
+        self.reset(gvars, procs, only_decimal, out)
 
-    lab_prev, lab_cur = None, proc_name
+    def reset(self, gvars, procs, only_decimal=True, out=None):
+        """Start a new run on the globals `gvars', which must be the ones
+        this machine was built for, in the same order"""
+        self.gvars = gvars
+        self.procs = procs
+        self.gvals[:] = [gvar.value for gvar in gvars.values()]
+        self.only_decimal = only_decimal
+        self.out = Output() if out is None else out
+        self.params = []
+        self.callee = None
+        self.ret_dest = None
+        self.ret_pc = None
+        self.retval = None
+
+    @classmethod
+    def acquire(cls, gvars, procs, only_decimal=True, out=None):
+        """A Machine for a run on `gvars' and `procs': the released one for
+        the same global names if there is one, or else a new one"""
+        m = cls._idle.pop(tuple(gvars), None)
+        if m is None:
+            return cls(gvars, procs, only_decimal, out)
+        m.reset(gvars, procs, only_decimal, out)
+        return m
+
+    def release(self):
+        """End the run, keeping this machine for the next acquire()"""
+        self.gvars = self.procs = self.out = None
+        self.params = []
+        self.retval = None
+        Machine._idle[tuple(self.gslots)] = self
+
+    def store_globals(self):
+        for name, i in self.gslots.items():
+            self.gvars[name].value = self.gvals[i]
+
+
+# return codes of decoded instructions that leave the current closure list
+_RETURNED = -1
+_FELL_OFF = -2
+_CALLED = -3
+
+
+def _fail(msg):
+    """A decoded instruction that raises RuntimeError(msg) when run"""
+    def op(r):
+        raise RuntimeError(msg)
+    return op
+
+
+def _loader(loc, gvals):
+    """Return a function reading location `loc' (see Prepared.loc())"""
+    if loc >= 0:
+        return lambda r: r[loc]
+    loc = ~loc
+    return lambda r: gvals[loc]
+
+
+def _storer(loc, gvals):
+    """Return a function writing location `loc' (see Prepared.loc())"""
+    if loc >= 0:
+        def store(r, val):
+            r[loc] = val
+    else:
+        loc = ~loc
+
+        def store(r, val):
+            gvals[loc] = val
+    return store
+
+
+def _phi_moves(prep, src_labs, phis):
+    """Return a function that performs the phi nodes `phis' as one parallel
+    copy on an edge coming from the block labeled by any of `src_labs', or
+    None if there is nothing to copy"""
+    dests, srcs = [], []
+    for phi in phis:
+        for lab in reversed(src_labs):
+            if lab in phi.arg1:
+                dests.append(prep.loc(phi.dest))
+                srcs.append(prep.loc(phi.arg1[lab]))
+                break
+        else:
+            msg = (f'cannot resolve phi: '
+                   f'came from {src_labs[-1]}, '
+                   f'can only handle [{",".join(phi.arg1.keys())}]')
+
+            def move(r):
+                raise RuntimeError(msg)
+            return move
+    if len(dests) == 0:
+        return None
+    if min(dests + srcs) < 0:
+        gvals = prep.machine.gvals
+        moves = tuple((_storer(d, gvals), _loader(s, gvals))
+                      for d, s in zip(dests, srcs))
+
+        def move(r):
+            vals = [load(r) for _, load in moves]
+            for (store, _), val in zip(moves, vals):
+                store(r, val)
+        return move
+    if len(dests) == 1:
+        dest, src = dests[0], srcs[0]
+
+        def move(r):
+            r[dest] = r[src]
+        return move
+    dests, srcs = tuple(dests), tuple(srcs)
+
+    def move(r):
+        vals = [r[src] for src in srcs]
+        for dest, val in zip(dests, vals):
+            r[dest] = val
+    return move
+
+
+def _decode_jump(target, move):
+    if move is None:
+        def op(r):
+            return target
+    else:
+        def op(r):
+            move(r)
+            return target
+    return op
+
+
+def _binop_op(opcode, d, a, b, nxt):
+    """Closure for `d = opcode a, b' on registers"""
+    M = full_mask
+    if opcode == 'add':
+        def op(r):
+            r[d] = (r[a] + r[b]) & M
+            return nxt
+    elif opcode == 'sub':
+        def op(r):
+            r[d] = (r[a] - r[b]) & M
+            return nxt
+    elif opcode == 'mul':
+        def op(r):
+            r[d] = (r[a] * r[b]) & M
+            return nxt
+    elif opcode == 'and':
+        def op(r):
+            r[d] = r[a] & r[b]
+            return nxt
+    elif opcode == 'or':
+        def op(r):
+            r[d] = r[a] | r[b]
+            return nxt
+    elif opcode == 'xor':
+        def op(r):
+            r[d] = r[a] ^ r[b]
+            return nxt
+    else:
+        fn = word_binops[opcode]
+
+        def op(r):
+            r[d] = fn(r[a], r[b])
+            return nxt
+    return op
+
+
+def _unop_op(opcode, d, a, nxt):
+    """Closure for `d = opcode a' on registers"""
+    M = full_mask
+    if opcode == 'neg':
+        def op(r):
+            r[d] = -r[a] & M
+            return nxt
+    else:
+        def op(r):
+            r[d] = r[a] ^ M
+            return nxt
+    return op
+
+
+def _jcc_op(opcode, a, target, nxt):
+    """Closure for `opcode a, target' on registers with no phi moves"""
+    S = sign_mask
+    if opcode == 'jz':
+        def op(r):
+            return target if r[a] == 0 else nxt
+    elif opcode == 'jnz':
+        def op(r):
+            return target if r[a] != 0 else nxt
+    elif opcode == 'jl':
+        def op(r):
+            return target if r[a] >= S else nxt
+    elif opcode == 'jle':
+        def op(r):
+            k = r[a]
+            return target if k == 0 or k >= S else nxt
+    elif opcode == 'jnl':
+        def op(r):
+            return target if r[a] < S else nxt
+    else:
+        def op(r):
+            return target if 0 < r[a] < S else nxt
+    return op
+
+
+# Superinstructions: common sequences of instructions run by one closure.
+# The closures of the instructions they replace are kept, as the traced
+# interpreter runs the instructions one at a time.
+
+
+def _const_copy_op(t, value, d, nxt):
+    """Closure for `t = const value; d = copy t' on registers"""
+    def op(r):
+        r[t] = r[d] = value
+        return nxt
+    return op
+
+
+def _cmp_branch_op(opcode, d, a, b, jcc, taken, not_taken):
+    """Closure for `d = opcode a, b; jcc d, ...' on registers, going to
+    `taken' or `not_taken'"""
+    M, S = full_mask, sign_mask
+    if opcode != 'sub':
+        fn, test = word_binops[opcode], word_jumps[jcc]
+
+        def op(r):
+            k = r[d] = fn(r[a], r[b])
+            return taken if test(k) else not_taken
+    elif jcc == 'jz':
+        def op(r):
+            k = r[d] = (r[a] - r[b]) & M
+            return taken if k == 0 else not_taken
+    elif jcc == 'jnz':
+        def op(r):
+            k = r[d] = (r[a] - r[b]) & M
+            return taken if k != 0 else not_taken
+    elif jcc == 'jl':
+        def op(r):
+            k = r[d] = (r[a] - r[b]) & M
+            return taken if k >= S else not_taken
+    elif jcc == 'jle':
+        def op(r):
+            k = r[d] = (r[a] - r[b]) & M
+            return taken if k == 0 or k >= S else not_taken
+    elif jcc == 'jnl':
+        def op(r):
+            k = r[d] = (r[a] - r[b]) & M
+            return taken if k < S else not_taken
+    else:
+        def op(r):
+            k = r[d] = (r[a] - r[b]) & M
+            return taken if 0 < k < S else not_taken
+    return op
+
+
+def _call_args_op(m, srcs, param_ops, call_op):
+    """Closure for a chain of params for 1, ..., len(srcs) in some order,
+    with the sources `srcs' in that order, followed by the call `call_op'.
+    `param_ops' are the closures of the params, used if there already are
+    pending params."""
+    def op(r):
+        if len(m.params) == 0:
+            m.params = [r[s] for s in srcs]
+        else:
+            for param_op in param_ops:
+                param_op(r)
+        return call_op(r)
+    return op
+
+
+def _fuse(prep, body, ops, blocks, block_labs):
+    """Return a copy of the decoded closures `ops' of `body' where the
+    first closure of every sequence that has a superinstruction is replaced
+    by it; the sequences only use temporaries."""
+    def temp(x):
+        return prep.loc(x) if isinstance(x, str) and x.startswith('%') \
+            else None
+
+    def plain_target(pc, lab):
+        """The index jumped to by the jump at `pc' to `lab', or None if it
+        has phi moves"""
+        if lab not in blocks:
+            return None
+        target, phis = blocks[lab]
+        try:
+            move = _phi_moves(prep, block_labs[pc], phis)
+        except KeyError:
+            return None
+        return target if move is None else None
+
+    fused = list(ops)
     pc = 0
-    params = []
-    while pc in range(len(proc.body)):
-        instr = proc.body[pc]
+    while pc < len(body):
+        instr = body[pc]
+        nxt_instr = body[pc + 1] if pc + 1 < len(body) else None
+        opcode = instr.opcode
+        if (opcode == 'const' and isinstance(instr.arg1, int) and
+                nxt_instr is not None and nxt_instr.opcode == 'copy' and
+                nxt_instr.arg1 == instr.dest and
+                temp(instr.dest) is not None and
+                temp(nxt_instr.dest) is not None):
+            fused[pc] = _const_copy_op(temp(instr.dest), twoc(instr.arg1),
+                                       temp(nxt_instr.dest), pc + 2)
+            pc += 2
+            continue
+        if (opcode in binops and nxt_instr is not None and
+                nxt_instr.opcode in jumps and nxt_instr.arg1 == instr.dest and
+                None not in (temp(instr.dest), temp(instr.arg1),
+                             temp(instr.arg2))):
+            taken = plain_target(pc + 1, nxt_instr.arg2)
+            not_taken, end = pc + 2, pc + 2
+            if pc + 2 < len(body) and body[pc + 2].opcode == 'jmp':
+                not_taken, end = plain_target(pc + 2, body[pc + 2].arg1), pc + 3
+            if taken is not None and not_taken is not None:
+                fused[pc] = _cmp_branch_op(opcode, temp(instr.dest),
+                                           temp(instr.arg1), temp(instr.arg2),
+                                           nxt_instr.opcode, taken, not_taken)
+                pc = end
+                continue
+        if opcode == 'param':
+            end = pc
+            while end < len(body) and body[end].opcode == 'param':
+                end += 1
+            chain = body[pc:end]
+            indices = sorted(p.arg1 for p in chain
+                             if isinstance(p.arg1, int))
+            if (end < len(body) and body[end].opcode == 'call' and
+                    indices == list(range(1, len(chain) + 1)) and
+                    all(temp(p.arg2) is not None for p in chain)):
+                srcs = [None] * len(chain)
+                for p in chain:
+                    srcs[p.arg1 - 1] = temp(p.arg2)
+                fused[pc] = _call_args_op(prep.machine, tuple(srcs),
+                                          tuple(ops[pc:end]), ops[end])
+                pc = end + 1
+                continue
         pc += 1
-
-        if show_instr:
-            print(f'// {indent}[{pc+1: 4d}] {instr}')
-        if instr.opcode == 'nop':
-            pass
-        elif instr.opcode == 'label':
-            lab_prev, lab_cur = lab_cur, instr.arg1
-        elif instr.opcode == 'phi':
-            for lab, tmp in instr.arg1.items():
-                if lab == lab_prev:
-                    values[instr.dest] = oldvalues[tmp]
-                    break
-            else:
-                raise RuntimeError(f'cannot resolve phi: '
-                                   f'came from {lab_prev}, '
-                                   f'can only handle [{",".join(instr.arg1.keys())}]')
-        elif instr.opcode == 'jmp':
-            if instr.arg1 not in labels:
-                raise RuntimeError(f'Unknown jump destination {instr.arg1}')
-            lab_prev, lab_cur = lab_cur, instr.arg1
-            oldvalues = values.copy()
-            pc = labels[lab_cur]
-        elif instr.opcode in jumps:
-            k = values[instr.arg1]
-            if instr.arg2 not in labels:
-                raise RuntimeError(f'Unknown jump destination {instr.arg2}')
-            if jumps[instr.opcode](k):
-                lab_prev, lab_cur = lab_cur, instr.arg2
-                oldvalues = values.copy()
-                pc = labels[lab_cur]
-        elif instr.opcode == 'const':
-            if not isinstance(instr.arg1, int):
-                print(f'Missing or bad argument: {instr.arg1}')
-                raise RuntimeError
-            values[instr.dest] = twoc(instr.arg1)
-        elif instr.opcode == 'copy':
-            values[instr.dest] = values[instr.arg1]
-        elif instr.opcode == 'param':
-            if not isinstance(instr.arg1, int) or instr.arg1 < 1:
-                print(f'Bad argument to param: '
-                      f'expecting int >= 1, got {instr.arg1}')
-            # make params big enough to hold instr.arg1 items
-            for _ in range(instr.arg1 - len(params)):
+    return fused
+
+
+def _decode_instr(prep, instr, nxt, src_labs, blocks):
+    """Decode `instr' of `prep' into a closure. `nxt' is the index of the
+    instruction that follows it, `src_labs' are the labels of the block
+    containing it, and `blocks' maps labels to the index of their first
+    non-label, non-phi instruction and their phi nodes."""
+    m, gvals = prep.machine, prep.machine.gvals
+    opcode, dest, arg1, arg2 = instr.opcode, instr.dest, instr.arg1, instr.arg2
+    kind = opcode_kinds.get(opcode, 'NNN')
+    d = prep.loc(dest) if kind[0] in 'VO' and dest != None else None
+    a = prep.loc(arg1) if kind[1] in 'VO' and arg1 != None else None
+    b = prep.loc(arg2) if kind[2] == 'V' else None
+    fast = min(x for x in (d, a, b, 0) if x is not None) >= 0
+    if opcode == 'nop' or opcode == 'label':
+        def op(r):
+            return nxt
+    elif opcode == 'phi':
+        return _fail(f'cannot resolve phi: {dest} is not defined '
+                     f'at the start of a block')
+    elif opcode == 'jmp':
+        if arg1 not in blocks:
+            return _fail(f'Unknown jump destination {arg1}')
+        target, phis = blocks[arg1]
+        op = _decode_jump(target, _phi_moves(prep, src_labs, phis))
+    elif opcode in jumps:
+        if arg2 not in blocks:
+            return _fail(f'Unknown jump destination {arg2}')
+        target, phis = blocks[arg2]
+        test, move = word_jumps[opcode], _phi_moves(prep, src_labs, phis)
+        load = _loader(a, gvals)
+        if move is None and fast:
+            op = _jcc_op(opcode, a, target, nxt)
+        elif move is None:
+            def op(r):
+                return target if test(load(r)) else nxt
+        else:
+            def op(r):
+                if test(load(r)):
+                    move(r)
+                    return target
+                return nxt
+    elif opcode == 'const':
+        if not isinstance(arg1, int):
+            return _fail(f'Missing or bad argument: {arg1}')
+        value, store = twoc(arg1), _storer(d, gvals)
+        if fast:
+            def op(r):
+                r[d] = value
+                return nxt
+        else:
+            def op(r):
+                store(r, value)
+                return nxt
+    elif opcode == 'copy':
+        load, store = _loader(a, gvals), _storer(d, gvals)
+        if fast:
+            def op(r):
+                r[d] = r[a]
+                return nxt
+        else:
+            def op(r):
+                store(r, load(r))
+                return nxt
+    elif opcode == 'param':
+        if not isinstance(arg1, int) or arg1 < 1:
+            return _fail(f'Bad argument to param: '
+                         f'expecting int >= 1, got {arg1}')
+        load = _loader(b, gvals)
+
+        def op(r):
+            params = m.params
+            # make params big enough to hold arg1 items
+            for _ in range(arg1 - len(params)):
                 params.append(None)
-            params[instr.arg1 - 1] = values[instr.arg2]
-        elif instr.opcode == 'call':
-            if instr.arg1.startswith('@__bx_print'):
-                if len(params) != 1:
-                    raise RuntimeError(f'Bad number of arguments to print(): '
-                                       f'expected 1, got {len(params)}')
-                if instr.arg1 == '@__bx_print_int':
-                    u = params[0]
-                    if only_decimal:
-                        print(str(untwoc(u)))
-                    else:
-                        print(f'{untwoc(u): 20d}  0x{u:016x}  0b{u:064b}')
-                elif instr.arg1 == '@__bx_print_bool':
-                    print('false' if params[0] == 0 else 'true')
-                else:
-                    raise RuntimeError(
-                        f'Unknown print() specialization: {instr.arg1}')
+            params[arg1 - 1] = load(r)
+            return nxt
+    elif opcode == 'call' and arg1.startswith('@__bx_print'):
+        if arg1 not in ('@__bx_print_int', '@__bx_print_bool'):
+            return _fail(f'Unknown print() specialization: {arg1}')
+
+        def op(r):
+            params = m.params
+            if len(params) != 1:
+                raise RuntimeError(f'Bad number of arguments to print(): '
+                                   f'expected 1, got {len(params)}')
+            u = params[0]
+            if arg1 == '@__bx_print_bool':
+                m.out.write('false' if u == 0 else 'true')
+            elif m.only_decimal:
+                m.out.write(str(untwoc(u)))
             else:
-                if len(params) < instr.arg2:
-                    raise RuntimeError(f'Bad number of arguments to {instr.arg1}(): '
-                                       f'expected {instr.arg2}, got {len(params)}')
-                kwargs['depth'] = depth + 1
-                result = execute(gvars, procs, instr.arg1, params, **kwargs)
-                if instr.dest:
-                    values[instr.dest] = result
-            params = []
-        elif instr.opcode == 'ret':
-            retval = None if instr.arg1 == None else values[instr.arg1]
-            if show_proc:
-                print(f'// {indent}{proc_desc} --> {retval}')
-            return retval
-        elif instr.opcode in binops:
-            u = values[instr.arg1]
-            v = values[instr.arg2]
-            values[instr.dest] = binops[instr.opcode](u, v)
-        elif instr.opcode in unops:
-            u = values[instr.arg1]
-            if instr.arg2 != None:
-                print(f'Unary operator {instr.opcode} has two arguments!')
-                raise RuntimeError
-            values[instr.dest] = unops[instr.opcode](u)
+                m.out.write(f'{untwoc(u): 20d}  0x{u:016x}  0b{u:064b}')
+            m.params = []
+            return nxt
+    elif opcode == 'call':
+        def op(r):
+            if len(m.params) < arg2:
+                raise RuntimeError(f'Bad number of arguments to {arg1}(): '
+                                   f'expected {arg2}, got {len(m.params)}')
+            m.callee, m.ret_dest, m.ret_pc = arg1, d, nxt
+            return _CALLED
+    elif opcode == 'ret':
+        if arg1 == None:
+            def op(r):
+                m.retval = None
+                return _RETURNED
+        else:
+            load = _loader(a, gvals)
+
+            def op(r):
+                m.retval = load(r)
+                return _RETURNED
+    elif opcode in binops:
+        fn = word_binops[opcode]
+        load1, load2 = _loader(a, gvals), _loader(b, gvals)
+        store = _storer(d, gvals)
+        if fast:
+            op = _binop_op(opcode, d, a, b, nxt)
         else:
-            print(f'Unknown opcode {instr.opcode}')
-            raise RuntimeError
-    print(f'// {indent}{proc_desc} --> NONE')
+            def op(r):
+                store(r, fn(load1(r), load2(r)))
+                return nxt
+    elif opcode in unops:
+        if arg2 != None:
+            return _fail(f'Unary operator {opcode} has two arguments!')
+        fn = word_unops[opcode]
+        load, store = _loader(a, gvals), _storer(d, gvals)
+        if fast:
+            op = _unop_op(opcode, d, a, nxt)
+        else:
+            def op(r):
+                store(r, fn(load(r)))
+                return nxt
+    else:
+        return _fail(f'Unknown opcode {opcode}')
+    return op
+
+
+def _fall_off(r):
+    return _FELL_OFF
+
+
+def label_blocks(proc):
+    """Find the blocks of `proc' that start with a group of labels. Returns
+    a pair (blocks, block_labs): `blocks' maps every label to the index of
+    the first instruction after its label group and the phi nodes that
+    follow it, and `block_labs' gives, for every instruction, the labels of
+    the group it comes after (or just the proc name, at the start).
+
+    Raises RuntimeError if a label is reused."""
+    body = proc.body
+    opcodes = body.opcode_list() if isinstance(body, ProcBody) \
+        else [instr.opcode for instr in body]
+    blocks = dict()     # label -> (index after label group and phis, phis)
+    block_labs = []     # labels of the block containing each instruction
+    cur_labs = (proc.name,)
+    i = 0
+    while i < len(body):
+        if opcodes[i] != 'label':
+            block_labs.append(cur_labs)
+            i += 1
+            continue
+        ni = i  # next instruction index
+        while ni < len(body) and opcodes[ni] == 'label':
+            ni += 1
+        cur_labs = tuple(instr.arg1 for instr in body[i:ni])
+        pi = ni
+        while pi < len(body) and opcodes[pi] == 'phi':
+            pi += 1
+        for lab in cur_labs:
+            if lab in blocks:
+                raise RuntimeError(f'Reused label {lab}')
+            blocks[lab] = (pi, body[ni:pi])
+        block_labs.extend(cur_labs for _ in range(i, ni))
+        i = ni
+    return blocks, block_labs
+
+
+class Prepared:
+    """A procedure prepared for the interpreter: its label table, arity, and
+    its body decoded into a list of closures, one per instruction, with
+    operands, jump targets and handlers resolved. Each closure takes the
+    register list of the frame and returns the index of the next closure to
+    run, or a negative code when it leaves the procedure. There is one extra
+    closure at the end for falling off the end of the body.
+
+    Every temporary is given a slot in the register list, starting with
+    the arguments; globals are kept in the shared array of the Machine.
+
+    Common sequences of instructions are fused into superinstructions: in
+    `ops', the closure of the first instruction of such a sequence runs the
+    whole sequence. `steps' has the closures of the single instructions, and
+    is used when the instructions have to be observed one at a time.
+
+    The phi nodes at the head of a block are not run on their own: every
+    edge into the block (a jump or a fallthrough) performs them as a single
+    parallel copy that reads only the sources for that edge. `phi_heads'
+    maps the index after the phi nodes of such a block to the index of the
+    first one, so that tracing can still report them.
+
+    Use Proc.prepared() rather than building these directly."""
+    __slots__ = ('proc', 'machine', 'arity', 'slots', 'labels', 'ops',
+                 'steps', 'arg_slots', 'blank', 'phi_heads')
+
+    def __init__(self, proc, machine):
+        """Raises RuntimeError if a label is reused."""
+        self.proc = proc
+        self.machine = machine
+        self.arity = len(proc.t_args)
+        self.slots = dict()
+        self.arg_slots = [self.loc(t) for t in proc.t_args]
+        body = proc.body
+        blocks, block_labs = label_blocks(proc)
+        self.labels = {lab: target for lab, (target, _) in blocks.items()}
+        self.phi_heads = {target: target - len(phis)
+                          for target, phis in blocks.values() if len(phis) > 0}
+        ops = [self._decode(_decode_instr, self, instr, pc + 1,
+                            block_labs[pc], blocks)
+               for pc, instr in enumerate(body)]
+        for pc, instr in enumerate(body):
+            if (instr.opcode == 'label' and
+                    (pc + 1 == len(body) or body[pc + 1].opcode != 'label')):
+                # falling through into a block: resolve its phi nodes
+                first = pc + 1 - len(block_labs[pc])
+                src_labs = block_labs[first - 1] if first > 0 else (proc.name,)
+                target, phis = blocks[instr.arg1]
+                move = self._decode(_phi_moves, self, src_labs, phis)
+                ops[pc] = _decode_jump(target, move)
+        ops.append(_fall_off)
+        self.steps = ops
+        self.ops = _fuse(self, body, ops, blocks, block_labs)
+        self.blank = [None] * (len(self.slots) - self.arity)
+
+    @staticmethod
+    def _decode(decoder, *args):
+        """Call `decoder', deferring unknown global errors to run time"""
+        try:
+            return decoder(*args)
+        except KeyError as exc:
+            return _fail(f'Unknown global variable {exc.args[0]}')
+
+    def loc(self, x):
+        """Return the location of the temporary or global `x': its index in
+        the register list, or the complement ~i of its index i in the
+        global array.
+
+        Raises KeyError for an unknown global."""
+        if x.startswith('@'):
+            return ~self.machine.gslots[x]
+        return self.slots.setdefault(x, len(self.slots))
+
+    def new_regs(self, args):
+        """Return a fresh register list for a call with `args'"""
+        if len(args) < self.arity:
+            raise RuntimeError(f'Bad number of arguments to {self.proc.name}(): '
+                               f'expected {self.arity}, got {len(args)}')
+        if len(self.slots) == len(self.arg_slots) + len(self.blank):
+            return list(args[:self.arity]) + self.blank
+        regs = [None] * len(self.slots)
+        for s, val in zip(self.arg_slots, args):
+            regs[s] = val
+        return regs
+
+    def desc(self, args):
+        """Describe a call of this proc with `args' for tracing"""
+        return (f'{self.proc.name}('
+                f'{",".join(t + "=" + str(v) for t, v in zip(self.proc.t_args, args))})')
+
+
+class Tracer:
+    """Observer of execute(). Override the methods for the events of
+    interest; `depth' is the call depth of the procedure concerned. If
+    `instrs' is False, instr() and branch() are never called and the
+    instructions run at full speed."""
+    instrs = True
+
+    def enter(self, depth, proc, args):
+        """`proc' has been called with `args'"""
+
+    def leave(self, depth, proc, args, retval):
+        """`proc', called with `args', returns `retval'"""
+
+    def instr(self, depth, proc, pc, instr):
+        """`instr' at index `pc' in `proc' is about to run"""
+
+    def branch(self, depth, proc, pc, instr, lab):
+        """The jump `instr' at index `pc' in `proc' goes to `lab'"""
+
+    def fell_off(self, depth, proc, args):
+        """`proc', called with `args', ends without a ret"""
+        self.leave(depth, proc, args, None)
+
+
+class PrintTracer(Tracer):
+    """Prints procedure calls and returns and/or instructions as they run,
+    as for the --trace-procs and --trace-instrs options. The messages go to
+    the Output `out' if given, so that they stay in order with the output
+    of the program, and are printed directly otherwise."""
+
+    def __init__(self, procs=True, instrs=True, out=None):
+        self.procs = procs
+        self.instrs = instrs
+        self.out = out
+
+    def _print(self, line):
+        if self.out is None:
+            print(line)
+        else:
+            self.out.write(line)
+
+    @staticmethod
+    def _desc(proc, args):
+        return (f'{proc.name}('
+                f'{",".join(t + "=" + str(v) for t, v in zip(proc.t_args, args))})')
+
+    def enter(self, depth, proc, args):
+        if self.procs:
+            self._print(f'// {"  " * depth}entering {self._desc(proc, args)}')
+
+    def leave(self, depth, proc, args, retval):
+        if self.procs:
+            self._print(f'// {"  " * depth}{self._desc(proc, args)} --> {retval}')
+
+    def instr(self, depth, proc, pc, instr):
+        self._print(f'// {"  " * depth}[{pc+2: 4d}] {instr}')
+
+    def fell_off(self, depth, proc, args):
+        pass    # always reported by execute()
+
+
+class TeeTracer(Tracer):
+    """Reports every event to each of `tracers' in turn. instr() and
+    branch() only go to the tracers whose `instrs' is True."""
+
+    def __init__(self, *tracers):
+        self.tracers = tracers
+        self.instrs = any(tracer.instrs for tracer in tracers)
+
+    def enter(self, depth, proc, args):
+        for tracer in self.tracers:
+            tracer.enter(depth, proc, args)
+
+    def leave(self, depth, proc, args, retval):
+        for tracer in self.tracers:
+            tracer.leave(depth, proc, args, retval)
+
+    def instr(self, depth, proc, pc, instr):
+        for tracer in self.tracers:
+            if tracer.instrs:
+                tracer.instr(depth, proc, pc, instr)
+
+    def branch(self, depth, proc, pc, instr, lab):
+        for tracer in self.tracers:
+            if tracer.instrs:
+                tracer.branch(depth, proc, pc, instr, lab)
+
+    def fell_off(self, depth, proc, args):
+        for tracer in self.tracers:
+            tracer.fell_off(depth, proc, args)
+
+
+class Profiler(Tracer):
+    """Counts the instructions run by opcode, the visits of each block,
+    how often each conditional jump is taken or not, and the calls and
+    time (inclusive and exclusive of callees) of each procedure. The times
+    include the overhead of profiling itself.
+
+    The results are available as a JSON object (js_obj) and as folded call
+    stacks with exclusive times in microseconds (write_folded), which is
+    the input format of the usual flamegraph tools."""
+
+    def __init__(self):
+        self.opcodes = dict()       # opcode -> count
+        self.blocks = dict()        # proc name -> {block label -> count}
+        self.branches = dict()      # proc name -> {pc -> [instr, count, taken]}
+        self.procs = dict()         # proc name -> [calls, inclusive, exclusive]
+        self.folded = dict()        # call stack -> exclusive time
+        self._block_starts = dict()  # proc -> {pc -> block label}
+        self._stack = []            # [stack, start time, time in callees]
+        self._active = dict()       # proc name -> number of activations
+
+    def _starts(self, proc):
+        starts = self._block_starts.get(proc)
+        if starts is None:
+            blocks, _ = label_blocks(proc)
+            starts = {pc: lab for lab, (pc, _) in reversed(blocks.items())}
+            if len(proc.body) > 0 and proc.body[0].opcode != 'label':
+                starts[0] = proc.name
+            self._block_starts[proc] = starts
+        return starts
+
+    def enter(self, depth, proc, args):
+        stack = proc.name if len(self._stack) == 0 else \
+            f'{self._stack[-1][0]};{proc.name}'
+        self._stack.append([stack, perf_counter(), 0.0])
+        self._active[proc.name] = self._active.get(proc.name, 0) + 1
+
+    def leave(self, depth, proc, args, retval):
+        stack, start, inner = self._stack.pop()
+        elapsed = perf_counter() - start
+        self._active[proc.name] -= 1
+        stats = self.procs.setdefault(proc.name, [0, 0.0, 0.0])
+        stats[0] += 1
+        if self._active[proc.name] == 0:
+            stats[1] += elapsed
+        stats[2] += elapsed - inner
+        self.folded[stack] = self.folded.get(stack, 0.0) + elapsed - inner
+        if len(self._stack) > 0:
+            self._stack[-1][2] += elapsed
+
+    def instr(self, depth, proc, pc, instr):
+        self.opcodes[instr.opcode] = self.opcodes.get(instr.opcode, 0) + 1
+        lab = self._starts(proc).get(pc)
+        if lab is not None:
+            counts = self.blocks.setdefault(proc.name, dict())
+            counts[lab] = counts.get(lab, 0) + 1
+        if instr.opcode in jumps:
+            branches = self.branches.setdefault(proc.name, dict())
+            stats = branches.get(pc)
+            if stats is None:
+                stats = branches[pc] = [str(instr).strip(), 0, 0]
+            stats[1] += 1
+
+    def branch(self, depth, proc, pc, instr, lab):
+        if instr.opcode in jumps:
+            self.branches[proc.name][pc][2] += 1
+
+    @property
+    def js_obj(self):
+        """A basic Python object ready to JSONify with json.dump()"""
+        return {'opcodes': self.opcodes,
+                'blocks': self.blocks,
+                'branches': {name: [{'pc': pc, 'instr': instr,
+                                     'taken': taken,
+                                     'not_taken': count - taken}
+                                    for pc, (instr, count, taken)
+                                    in sorted(branches.items())]
+                             for name, branches in self.branches.items()},
+                'procs': {name: {'calls': calls,
+                                 'inclusive': incl,
+                                 'exclusive': excl}
+                          for name, (calls, incl, excl)
+                          in self.procs.items()}}
+
+    def write_folded(self, fp):
+        for stack, secs in self.folded.items():
+            print(f'{stack} {round(secs * 1e6)}', file=fp)
+
+
+def pure_procs(procs):
+    """Return the set of the names of the procs in `procs' that are pure:
+    they use no global variable, do not print, and only call pure procs
+    (possibly themselves). The result of a call to a pure proc depends only
+    on its arguments."""
+    callees = dict()        # name -> names of the called procs
+    for name, proc in procs.items():
+        called = set()
+        for instr in proc.body:
+            operands = [instr.dest, instr.arg2]
+            if instr.opcode == 'call':
+                called.add(instr.arg1)
+            elif instr.opcode == 'phi':
+                operands.extend(instr.arg1.values())
+            else:
+                operands.append(instr.arg1)
+            if any(isinstance(x, str) and x.startswith('@') for x in operands):
+                break
+        else:
+            callees[name] = called
+    changed = True
+    while changed:
+        changed = False
+        for name, called in list(callees.items()):
+            if not called <= callees.keys():
+                del callees[name]
+                changed = True
+    return set(callees)
+
+
+class Memo:
+    """Bounded LRU cache of the results of the calls to the pure procs of
+    `procs' (see pure_procs()), keyed on the proc name and the arguments,
+    holding at most `size' results. Only calls that return a value are
+    cached. Hits and misses are counted per proc."""
+
+    def __init__(self, procs, size=65536):
+        self.arities = {name: len(procs[name].t_args)
+                        for name in pure_procs(procs)}
+        self.size = size
+        self.cache = OrderedDict()
+        self.stats = {name: [0, 0] for name in self.arities}  # hits, misses
+
+    def key(self, name, args):
+        """Return the cache key for calling `name' with `args', or None if
+        the call cannot be cached"""
+        arity = self.arities.get(name)
+        if arity is None or len(args) < arity:
+            return None
+        return (name,) + tuple(args[:arity])
+
+    def lookup(self, key):
+        """Return the cached result for `key', or None"""
+        retval = self.cache.get(key)
+        if retval is None:
+            self.stats[key[0]][1] += 1
+        else:
+            self.stats[key[0]][0] += 1
+            self.cache.move_to_end(key)
+        return retval
+
+    def store(self, key, retval):
+        self.cache[key] = retval
+        if len(self.cache) > self.size:
+            self.cache.popitem(last=False)
+
+    def report(self, fp):
+        for name, (hits, misses) in self.stats.items():
+            if hits + misses > 0:
+                print(f'// memo {name}: {hits} hits, {misses} misses '
+                      f'({100 * hits / (hits + misses):.1f}% hit rate)',
+                      file=fp)
+
+
+def _fell_off(m, depth, prep, args):
+    m.out.write(f'// {"  " * depth}{prep.desc(args)} --> NONE')
+
+
+def _deliver(m, callee, regs, dest, retval):
+    """Store the value `retval' returned by `callee' in location `dest'"""
+    if retval is None:
+        raise RuntimeError(f'{callee.proc.name}() did not return a value')
+    if dest >= 0:
+        regs[dest] = retval
+    else:
+        m.gvals[~dest] = retval
+
+
+def _run(m, prep, args, depth):
+    """Run `prep' with `args' on `m' with no tracing"""
+    stack = []      # suspended callers: (prep, regs, args, pc, ret_dest)
+    regs = prep.new_regs(args)
+    ops, pc = prep.ops, 0
+    while True:
+        while pc >= 0:
+            pc = ops[pc](regs)
+        if pc == _CALLED:
+            stack.append((prep, regs, args, m.ret_pc, m.ret_dest))
+            args, m.params = m.params, []
+            prep = m.procs[m.callee].prepared(m)
+            regs = prep.new_regs(args)
+            ops, pc = prep.ops, 0
+            continue
+        if pc == _FELL_OFF:
+            _fell_off(m, depth + len(stack), prep, args)
+            m.retval = None
+        if len(stack) == 0:
+            return m.retval
+        callee = prep
+        prep, regs, args, pc, dest = stack.pop()
+        ops = prep.ops
+        if dest is not None:
+            _deliver(m, callee, regs, dest, m.retval)
+
+
+def _run_memo(m, prep, args, depth, memo):
+    """Run `prep' with `args' on `m' with no tracing, using the results
+    cached in `memo' (a Memo) for the calls to pure procs"""
+    stack = []      # suspended callers: (prep, regs, args, key, pc, ret_dest)
+    regs = prep.new_regs(args)
+    ops, pc = prep.ops, 0
+    key = None
+    while True:
+        while pc >= 0:
+            pc = ops[pc](regs)
+        if pc == _CALLED:
+            new_args, m.params = m.params, []
+            new_key = memo.key(m.callee, new_args)
+            if new_key is not None:
+                retval = memo.lookup(new_key)
+                if retval is not None:
+                    pc = m.ret_pc
+                    if m.ret_dest is not None:
+                        _deliver(m, None, regs, m.ret_dest, retval)
+                    continue
+            stack.append((prep, regs, args, key, m.ret_pc, m.ret_dest))
+            prep, args, key = m.procs[m.callee].prepared(m), new_args, new_key
+            regs = prep.new_regs(args)
+            ops, pc = prep.ops, 0
+            continue
+        if pc == _FELL_OFF:
+            _fell_off(m, depth + len(stack), prep, args)
+            m.retval = None
+        elif key is not None and m.retval is not None:
+            memo.store(key, m.retval)
+        if len(stack) == 0:
+            return m.retval
+        callee = prep
+        prep, regs, args, key, pc, dest = stack.pop()
+        ops = prep.ops
+        if dest is not None:
+            _deliver(m, callee, regs, dest, m.retval)
+
+
+def _run_traced(m, prep, args, depth, tracer):
+    """Run `prep' with `args' on `m', reporting to `tracer'"""
+    stack = []      # suspended callers: (prep, regs, args, pc, ret_dest)
+    regs = prep.new_regs(args)
+    tracer.enter(depth, prep.proc, args)
+    ops, pc = prep.steps, 0
+    while True:
+        if tracer.instrs:
+            proc, cur_depth = prep.proc, depth + len(stack)
+            body, phi_heads = proc.body, prep.phi_heads
+            while 0 <= pc < len(body):
+                instr = body[pc]
+                tracer.instr(cur_depth, proc, pc, instr)
+                npc = ops[pc](regs)
+                if instr.opcode == 'jmp' or \
+                        (instr.opcode in jumps and npc != pc + 1):
+                    tracer.branch(cur_depth, proc, pc, instr,
+                                  instr.arg1 if instr.opcode == 'jmp'
+                                  else instr.arg2)
+                pc = npc
+                # the phi nodes resolved on the way into a block
+                for phi_pc in range(phi_heads.get(pc, pc), pc):
+                    tracer.instr(cur_depth, proc, phi_pc, body[phi_pc])
+        while pc >= 0:
+            pc = ops[pc](regs)
+        if pc == _CALLED:
+            stack.append((prep, regs, args, m.ret_pc, m.ret_dest))
+            args, m.params = m.params, []
+            prep = m.procs[m.callee].prepared(m)
+            regs = prep.new_regs(args)
+            tracer.enter(depth + len(stack), prep.proc, args)
+            ops, pc = prep.steps, 0
+            continue
+        if pc == _FELL_OFF:
+            _fell_off(m, depth + len(stack), prep, args)
+            m.retval = None
+            tracer.fell_off(depth + len(stack), prep.proc, args)
+        else:
+            tracer.leave(depth + len(stack), prep.proc, args, m.retval)
+        if len(stack) == 0:
+            return m.retval
+        callee = prep
+        prep, regs, args, pc, dest = stack.pop()
+        ops = prep.steps
+        if dest is not None:
+            _deliver(m, callee, regs, dest, m.retval)
+
+
+def execute(gvars, procs, proc_name, args, tracer=None, out=None, memo=None,
+            **kwargs):
+    """Run the proc `proc_name' of `procs' with arguments `args' and return
+    its result. Events are reported to `tracer' (a Tracer) if given; the
+    options `show_proc' and `show_instr' use a PrintTracer. If `memo' (a
+    Memo for `procs') is given and there is no tracing, the results of
+    calls to pure procs are taken from and added to it.
+
+    The printed output goes to the Output `out', which is flushed when the
+    run ends. By default it is a buffered sink on stdout, or an unbuffered
+    one when tracing, so that the output stays in order with the trace."""
+    show_proc = kwargs.get('show_proc', False)
+    show_instr = kwargs.get('show_instr', False)
+    depth = kwargs.get('depth', 0)
+    if out is None:
+        out = Output() if tracer is None and not (show_proc or show_instr) \
+            else Output(limit=1)
+    if tracer is None and (show_proc or show_instr):
+        tracer = PrintTracer(procs=show_proc, instrs=show_instr, out=out)
+
+    m = Machine.acquire(gvars, procs, kwargs.get('only_decimal', True), out)
+    try:
+        prep = procs[proc_name].prepared(m)
+        if tracer is None and memo is not None:
+            return _run_memo(m, prep, args, depth, memo)
+        if tracer is None:
+            return _run(m, prep, args, depth)
+        return _run_traced(m, prep, args, depth, tracer)
+    finally:
+        m.store_globals()
+        m.release()
+        out.flush()
 
 # --------------------------------------------------------------------------------
 
 
-def load_tac(tac_file):
-    """Load the TAC instructions from the given `tac_file'"""
+def iter_tac(tac_file):
+    """Generate the Gvar and Proc objects of the .tac file `tac_file' as
+    they are read"""
+    with open(tac_file, 'r') as fp:
+        yield from Reader(fp, tac_file)
+
+
+def _compacted(tlv):
+    if isinstance(tlv, Proc):
+        tlv.compact()
+    return tlv
+
+
+def _load_proc(js_obj, compact):
+    proc = Proc.load(js_obj)
+    return _compacted(proc) if compact else proc
+
+
+def load_tac(tac_file, compact=False):
+    """Load the TAC instructions from the given `tac_file'. If `compact',
+    the bodies of the procs are ProcBody objects."""
+    if tac_file.endswith('.tacb'):
+        with TacbFile(tac_file, compact) as tacb:
+            return list(tacb)
     with open(tac_file, 'r') as fp:
         if tac_file.endswith('.tac'):
-            text = fp.read()
-            lexer = Lexer(text, tac_file)
-            parser = Parser(lexer)
-            return parser.parse()
+            return list(Reader(fp, tac_file, compact=compact))
         elif tac_file.endswith('.tac.json'):
-            return [Gvar.load(obj) or Proc.load(obj)
+            prog = [Gvar.load(obj) or Proc.load(obj)
                     for obj in json.load(fp)]
+            return [_compacted(tlv) for tlv in prog] if compact else prog
         else:
-            raise ValueError(f'TAC file must be a .tac or a .tac.json')
+            raise ValueError(f'TAC file must be a .tac, a .tac.json '
+                             f'or a .tacb')
+
+
+def _tac_stem(tac_file):
+    """`tac_file' without its .tac, .tac.json or .tacb extension"""
+    for ext in ('.tac', '.tac.json', '.tacb'):
+        if tac_file.endswith(ext):
+            return tac_file[:-len(ext)]
+    return tac_file
+
+
+class LazyProcs(Mapping):
+    """The procs of a program by name, each one loaded by calling its
+    loader when it is first looked up. Iterating over a LazyProcs goes
+    through the names in program order without loading anything."""
+
+    def __init__(self):
+        self.loaders = dict()   # proc name -> function returning the Proc
+        self.loaded = dict()    # proc name -> Proc
+
+    def __getitem__(self, name):
+        proc = self.loaded.get(name)
+        if proc is None:
+            proc = self.loaded[name] = self.loaders[name]()
+        return proc
+
+    def __contains__(self, name):
+        return name in self.loaders
+
+    def __iter__(self):
+        return iter(self.loaders)
+
+    def __len__(self):
+        return len(self.loaders)
+
+
+def reachable_procs(procs, roots):
+    """Return the procs of `procs' that can be reached by calls from the
+    procs named in `roots', by name in the order they are found. When
+    `procs' is a LazyProcs, only these procs are loaded."""
+    found = dict()
+    work = list(reversed(roots))
+    while len(work) > 0:
+        name = work.pop()
+        if name in found or name not in procs:
+            continue
+        proc = found[name] = procs[name]
+        work.extend(instr.arg1 for instr in reversed(proc.body)
+                    if instr.opcode == 'call')
+    return found
+
+
+_decl_line = re.compile(r'[ \t\f\v\r]*(proc|var)(?![A-Za-z0-9_])'
+                        r'(?:[ \t\f\v\r]*(@[A-Za-z_][A-Za-z0-9_]*))?')
+
+
+def _has_decl(text):
+    """Whether the TAC text `text' holds a `proc' or `var' keyword"""
+    return ('proc' in text or 'var' in text) and \
+        any(tok.lastgroup == 'OPCODE' and tok.group() in ('proc', 'var')
+            for tok in Reader._token.finditer(text))
+
+
+def _split_decls(lines):
+    """Split the lines of TAC text into ranges that hold one declaration
+    each. Returns a list of [keyword, name, start, end], the first one
+    for the lines before any declaration, or None if some declaration
+    does not start a line of its own."""
+    chunks = [[None, None, 0]]
+    for i, line in enumerate(lines):
+        m = _decl_line.match(line)
+        if m is not None:
+            if m.group(2) is None or _has_decl(line[m.end():]):
+                return None
+            chunks[-1].append(i)
+            chunks.append([m.group(1), m.group(2), i])
+        elif _has_decl(line):
+            return None
+    chunks[-1].append(len(lines))
+    return chunks
+
+
+def _read_decl(reader, keyword, name):
+    """Return the one declaration read by `reader', which must be the
+    `keyword' (proc or var) named `name'. If `keyword' is None, there
+    must be no declaration, and None is returned."""
+    decls = list(reader)
+    if keyword is None and len(decls) == 0:
+        return None
+    kind = Proc if keyword == 'proc' else Gvar
+    if len(decls) != 1 or not isinstance(decls[0], kind) or \
+            decls[0].name != name:
+        found = ', '.join(f'{"proc" if isinstance(d, Proc) else "var"} '
+                          f'{d.name}' for d in decls) or 'nothing'
+        expected = 'nothing' if keyword is None else f'{keyword} {name}'
+        raise RuntimeError(f'{reader.provenance}:{reader.first_lineno}: '
+                           f'expected {expected}, found {found}')
+    return decls[0]
+
+
+def load_tac_lazy(tac_file, compact=False):
+    """Load the given `tac_file' lazily. Returns the Gvars by name and a
+    LazyProcs of the Procs, where the body of each proc is only parsed or
+    decoded when it is first looked up, so syntax errors in a proc are
+    only reported then. Raises RuntimeError for repeated definitions. If
+    `compact', the bodies of the procs are ProcBody objects."""
+    gvars, procs = dict(), LazyProcs()
+
+    def declare(name):
+        if name in gvars or name in procs:
+            raise RuntimeError(f'Repeated definition of {name}')
+
+    if tac_file.endswith('.tacb'):
+        tacb = TacbFile(tac_file, compact)
+        for i, (name, is_proc) in enumerate(tacb.declarations()):
+            declare(name)
+            if is_proc:
+                procs.loaders[name] = partial(tacb._decode, i)
+            else:
+                gvars[name] = tacb._decode(i)
+    elif tac_file.endswith('.tac.json'):
+        with open(tac_file, 'r') as fp:
+            for obj in json.load(fp):
+                if obj.get('proc', None):
+                    declare(obj['proc'])
+                    procs.loaders[obj['proc']] = \
+                        partial(_load_proc, obj, compact)
+                else:
+                    gvar = Gvar.load(obj)
+                    declare(gvar.name)
+                    gvars[gvar.name] = gvar
+    elif tac_file.endswith('.tac'):
+        with open(tac_file, 'r') as fp:
+            lines = fp.read().split('\n')
+        chunks = _split_decls(lines)
+        if chunks is None:
+            # no cheap way to find the procs: parse everything now
+            for tlv in Reader(lines, tac_file, compact=compact):
+                declare(tlv.name)
+                if isinstance(tlv, Proc):
+                    procs.loaders[tlv.name] = None     # already loaded
+                    procs.loaded[tlv.name] = tlv
+                else:
+                    gvars[tlv.name] = tlv
+            return gvars, procs
+        for keyword, name, start, end in chunks:
+            reader = Reader(lines[start:end], tac_file, start + 1, compact)
+            if keyword is not None:
+                declare(name)
+            if keyword == 'proc':
+                procs.loaders[name] = partial(_read_decl, reader, keyword, name)
+            elif keyword == 'var':
+                gvars[name] = _read_decl(reader, keyword, name)
+            else:
+                _read_decl(reader, None, None)
+    else:
+        raise ValueError(f'TAC file must be a .tac, a .tac.json '
+                         f'or a .tacb')
+    return gvars, procs
+
+
+def _main_file(srcfile, args):
+    """Load `srcfile' and run or show it as asked by the command line
+    options `args'"""
+    show_proc = args.trace_procs or args.verbosity > 3
+    show_instr = args.trace_instrs or args.verbosity > 4
+    out = Output()
+    tracer = PrintTracer(procs=show_proc, instrs=show_instr, out=out) \
+        if show_proc or show_instr else None
+    profiler = Profiler() if args.profile else None
+    if profiler is not None:
+        tracer = profiler if tracer is None else TeeTracer(tracer, profiler)
+    kwargs = dict(only_decimal=args.verbosity <= 1, out=out)
+    gvars, procs = dict(), dict()
+    seen = set()
+    if args.lazy and not (args.dump_json or args.dump_tacb):
+        gvars, procs = load_tac_lazy(srcfile, args.compact)
+        prog = ()
+    else:
+        prog = load_tac(srcfile, args.compact)
+    if args.dump_json and not srcfile.endswith('.tac.json'):
+        with open(_tac_stem(srcfile) + '.tac.json', 'w') as fp:
+            json.dump([tlv.js_obj for tlv in prog], fp, indent=2)
+    if args.dump_tacb and not srcfile.endswith('.tacb'):
+        with open(_tac_stem(srcfile) + '.tacb', 'wb') as fp:
+            dump_tacb(prog, fp)
+    for tlv in prog:
+        if tlv.name in seen:
+            raise RuntimeError(f'Repeated definition of {tlv.name}')
+        seen.add(tlv.name)
+        if isinstance(tlv, Proc):
+            procs[tlv.name] = tlv
+        else:
+            gvars[tlv.name] = tlv
+    if args.execute and args.compile and tracer is None:
+        import tac2py
+        tac2py.execute(gvars, procs, '@main', (), **kwargs)
+    elif args.execute:
+        memo = Memo(reachable_procs(procs, ['@main']), args.memo_size) \
+            if args.memoize and tracer is None else None
+        execute(gvars, procs, '@main', (), tracer=tracer, memo=memo,
+                **kwargs)
+        if memo is not None:
+            memo.report(sys.stderr)
+        if profiler is not None:
+            with open(srcfile + '.profile.json', 'w') as fp:
+                json.dump(profiler.js_obj, fp, indent=2)
+            with open(srcfile + '.folded', 'w') as fp:
+                profiler.write_folded(fp)
+    elif args.verbosity > 0:
+        for gvar in gvars.values():
+            print(gvar)
+        for proc in procs.values():
+            print(proc)
+
+
+def _main_job(srcfile, args):
+    """Run _main_file() in a worker process of _main_pool(), capturing what
+    it prints. Returns the output, what went to stderr, the wall time, and
+    whether it failed."""
+    from contextlib import redirect_stdout, redirect_stderr
+    import traceback
+    buf, err = StringIO(), StringIO()
+    start = perf_counter()
+    failed = False
+    with redirect_stdout(buf), redirect_stderr(err):
+        try:
+            _main_file(srcfile, args)
+        except Exception:
+            traceback.print_exc(file=buf)
+            failed = True
+    return buf.getvalue(), err.getvalue(), perf_counter() - start, failed
+
+
+def _main_pool(args):
+    """Run the files of `args' on `args.jobs' worker processes, printing
+    their outputs in order and then a table of their wall times. What a
+    file prints to stderr goes to stderr after its output, under a line
+    naming the file. Returns the exit status."""
+    from concurrent.futures import ProcessPoolExecutor
+    start = perf_counter()
+    results = []
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = [pool.submit(_main_job, srcfile, args)
+                   for srcfile in args.files]
+        for srcfile, future in zip(args.files, futures):
+            text, err, secs, failed = future.result()
+            sys.stdout.write(text)
+            sys.stdout.flush()
+            if len(err) > 0:
+                sys.stderr.write(f'// {srcfile}:\n{err}')
+                sys.stderr.flush()
+            results.append((secs, failed))
+    total = perf_counter() - start
+    width = max([len('file')] + [len(srcfile) for srcfile in args.files])
+    print(f'{"file":<{width}}  {"time (s)":>9}  status')
+    for srcfile, (secs, failed) in zip(args.files, results):
+        print(f'{srcfile:<{width}}  {secs:9.3f}  '
+              f'{"FAILED" if failed else "ok"}')
+    print(f'{len(args.files)} files in {total:.3f}s with -j {args.jobs}')
+    return 1 if any(failed for _, failed in results) else 0
+
+# --------------------------------------------------------------------------------
 
 
 if __name__ == '__main__':
     from argparse import ArgumentParser
     ap = ArgumentParser(description='TAC parser and interpreter')
     ap.add_argument('files', metavar='FILE', type=str, nargs='*',
-                    help='A TAC file (.tac or .tac.json)')
+                    help='A TAC file (.tac, .tac.json or .tacb)')
     ap.add_argument('-v', dest='verbosity', default=0, action='count',
                     help='increase verbosity')
     ap.add_argument('--dump-json', dest='dump_json', action='store_true',
                     default=False,
                     help='Dump the TAC in JSON form (if needed)')
+    ap.add_argument('--dump-tacb', dest='dump_tacb', action='store_true',
+                    default=False,
+                    help='Dump the TAC in binary .tacb form (if needed)')
+    ap.add_argument('--lazy', dest='lazy', action='store_true',
+                    default=False,
+                    help='Only load the procs when they are first called')
+    ap.add_argument('--compact', dest='compact', action='store_true',
+                    default=False,
+                    help='Store the bodies of the procs as compact columns')
     ap.add_argument('--trace-procs', dest='trace_procs',
                     action='store_true', default=False,
                     help='Print enter/leave messages for procedure calls')
@@ -653,32 +2618,32 @@ if __name__ == '__main__':
     ap.add_argument('--no-exec', dest='execute', action='store_false',
                     default=True,
                     help='Do not run the interpreter')
+    ap.add_argument('--compile', dest='compile', action='store_true',
+                    default=False,
+                    help='Run the procs translated to Python, or with the '
+                    'interpreter if the recursion is too deep for Python '
+                    '(ignored when tracing)')
+    ap.add_argument('--profile', dest='profile', action='store_true',
+                    default=False,
+                    help='Profile the run; write FILE.profile.json and '
+                    'FILE.folded (also with the --trace options)')
+    ap.add_argument('--memoize', dest='memoize', action='store_true',
+                    default=False,
+                    help='Cache the results of calls to pure procs and '
+                    'report the hit rates to stderr '
+                    '(ignored when tracing or with --compile)')
+    ap.add_argument('--memo-size', dest='memo_size', metavar='N', type=int,
+                    default=65536,
+                    help='Cache at most N results with --memoize '
+                    '(default: 65536)')
+    ap.add_argument('-j', dest='jobs', metavar='N', type=int, default=1,
+                    help='Run the files on N worker processes; print their '
+                    'outputs in order, then their wall times')
     args = ap.parse_args()
     if args.trace_all:
         args.trace_procs = True
         args.trace_instrs = True
-    kwargs = dict(show_proc=args.trace_procs or args.verbosity > 3,
-                  show_instr=args.trace_instrs or args.verbosity > 4,
-                  only_decimal=args.verbosity <= 1)
+    if args.jobs > 1:
+        sys.exit(_main_pool(args))
     for srcfile in args.files:
-        gvars, procs = dict(), dict()
-        seen = set()
-        prog = load_tac(srcfile)
-        if args.dump_json and srcfile.endswith('.tac'):
-            with open(srcfile + '.json', 'w') as fp:
-                json.dump([tlv.js_obj for tlv in prog], fp, indent=2)
-        for tlv in prog:
-            if tlv.name in seen:
-                raise RuntimeError(f'Repeated definition of {tlv.name}')
-            seen.add(tlv.name)
-            if isinstance(tlv, Proc):
-                procs[tlv.name] = tlv
-            else:
-                gvars[tlv.name] = tlv
-        if args.execute:
-            execute(gvars, procs, '@main', (), **kwargs)
-        elif args.verbosity > 0:
-            for gvar in gvars.values():
-                print(gvar)
-            for proc in procs.values():
-                print(proc)
+        _main_file(srcfile, args)
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+
+"""
+Translation of TAC procedures to Python functions
+
+Every proc becomes the source of a Python function whose temporaries are
+local variables. Its blocks become the arms of a `while True' loop that
+dispatches on a block number, so straight-line code runs as plain Python
+statements, and calls are plain Python calls. The source is compiled with
+compile(), and the code objects are cached by a hash of the proc.
+
+This is a fast way to run long programs; tac.execute() remains the
+reference interpreter and is the only one that can trace execution. As
+every TAC call is a Python call, a recursion too deep for the Python stack
+is run again by tac.execute().
+"""
+
+import hashlib
+import sys
+import tac
+
+# ------------------------------------------------------------------------------
+
+_mask = tac.full_mask
+_sign = tac.sign_mask
+
+# binary operators that are the same on words and on signed integers
+_ring_binops = {'add': '+', 'sub': '-', 'mul': '*',
+                'and': '&', 'or': '|', 'xor': '^'}
+_unops = {'neg': '-', 'not': '~'}
+# conditions on a word `k' for each conditional jump
+_conds = {
+    'jz':   '{k} == 0',
+    'jnz':  '{k} != 0',
+    'jl':   '{k} >= ' f'{_sign}',
+    'jle':  '{k} == 0 or {k} >= ' f'{_sign}',
+    'jnl':  '{k} < ' f'{_sign}',
+    'jnle': '0 < {k} < ' f'{_sign}',
+}
+
+
+class _Translator:
+    """Builds the Python source for one proc"""
+
+    def __init__(self, proc):
+        self.proc = proc
+        self.names = dict()     # temporary -> Python local variable
+        self.lines = []
+
+    def var(self, x):
+        if x.startswith('@'):
+            return f'G[{x!r}]'
+        return self.names.setdefault(x, f't{len(self.names)}')
+
+    def emit(self, depth, line):
+        self.lines.append('    ' * depth + line)
+
+    def emit_edge(self, depth, src_labs, lab):
+        """Emit the code that goes to the block of `lab' from the block
+        labeled by `src_labs', resolving the phi nodes of the target"""
+        if lab not in self.block_ids:
+            self.emit(depth, f'raise RuntimeError('
+                      f'{"Unknown jump destination " + lab!r})')
+            return
+        dests, srcs = [], []
+        for phi in self.blocks[lab][1]:
+            for src_lab in reversed(src_labs):
+                if src_lab in phi.arg1:
+                    dests.append(self.var(phi.dest))
+                    srcs.append(self.var(phi.arg1[src_lab]))
+                    break
+            else:
+                msg = (f'cannot resolve phi: '
+                       f'came from {src_labs[-1]}, '
+                       f'can only handle [{",".join(phi.arg1.keys())}]')
+                self.emit(depth, f'raise RuntimeError({msg!r})')
+                return
+        if len(dests) > 0:
+            self.emit(depth, f'{", ".join(dests)} = {", ".join(srcs)}')
+        self.emit(depth, f'_b = {self.block_ids[lab]}')
+        self.emit(depth, 'continue')
+
+    def emit_instr(self, depth, instr, src_labs):
+        """Emit `instr'; returns False if control cannot go past it"""
+        opcode, dest, arg1, arg2 = \
+            instr.opcode, instr.dest, instr.arg1, instr.arg2
+        if opcode == 'nop' or opcode == 'label':
+            pass
+        elif opcode == 'phi':
+            self.emit(depth, f'raise RuntimeError('
+                      f'{"cannot resolve phi: " + dest + " is not defined at the start of a block"!r})')
+            return False
+        elif opcode == 'jmp':
+            self.emit_edge(depth, src_labs, arg1)
+            return False
+        elif opcode in _conds:
+            self.emit(depth, f'if {_conds[opcode].format(k=self.var(arg1))}:')
+            self.emit_edge(depth + 1, src_labs, arg2)
+        elif opcode == 'const':
+            self.emit(depth, f'{self.var(dest)} = {tac.twoc(arg1)}')
+        elif opcode == 'copy':
+            self.emit(depth, f'{self.var(dest)} = {self.var(arg1)}')
+        elif opcode in _ring_binops:
+            self.emit(depth, f'{self.var(dest)} = ({self.var(arg1)} '
+                      f'{_ring_binops[opcode]} {self.var(arg2)}) & {_mask}')
+        elif opcode in tac.word_binops:
+            self.emit(depth, f'{self.var(dest)} = _{opcode}({self.var(arg1)}, '
+                      f'{self.var(arg2)})')
+        elif opcode in _unops:
+            self.emit(depth, f'{self.var(dest)} = '
+                      f'{_unops[opcode]}{self.var(arg1)} & {_mask}')
+        elif opcode == 'param':
+            self.emit(depth, f'_p{arg1} = {self.var(arg2)}')
+        elif opcode == 'call' and arg1 in ('@__bx_print_int',
+                                           '@__bx_print_bool'):
+            self.emit(depth, f'_{arg1[6:]}(_p1)')
+        elif opcode == 'call' and arg1.startswith('@__bx_print'):
+            self.emit(depth, f'raise RuntimeError('
+                      f'{"Unknown print() specialization: " + arg1!r})')
+            return False
+        elif opcode == 'call':
+            call = f'F[{arg1!r}]({", ".join(f"_p{i + 1}" for i in range(arg2))})'
+            if dest == None:
+                self.emit(depth, call)
+            else:
+                self.emit(depth, f'_r = {call}')
+                self.emit(depth, f'if _r is None: _no_value({arg1!r})')
+                self.emit(depth, f'{self.var(dest)} = _r')
+        elif opcode == 'ret':
+            self.emit(depth, 'return' if arg1 == None
+                      else f'return {self.var(arg1)}')
+            return False
+        else:
+            self.emit(depth, f'raise RuntimeError('
+                      f'{"Unknown opcode " + opcode!r})')
+            return False
+        return True
+
+    def translate(self):
+        proc, body = self.proc, self.proc.body
+        self.blocks, block_labs = tac.label_blocks(proc)
+        # (labels, index of first instruction, index past the end) of each
+        # block; the first block is the (possibly empty) entry block
+        spans = [((proc.name,), 0, 0)]
+        for pc, instr in enumerate(body):
+            if instr.opcode == 'label':
+                if block_labs[pc] is not spans[-1][0]:
+                    labs = block_labs[pc]
+                    spans.append((labs, self.blocks[labs[0]][0], pc))
+            else:
+                spans[-1] = spans[-1][:2] + (pc + 1,)
+        self.block_ids = {lab: i for i, (labs, _, _) in enumerate(spans)
+                          for lab in labs}
+        args = [self.var(t) for t in proc.t_args]
+        self.emit(0, f'def run({", ".join(args + ["*_"])}):')
+        fell_off = []
+        self.emit(1, '_b = 0')
+        self.emit(1, 'while True:')
+        self.emit_dispatch(2, spans, 0, len(spans), fell_off)
+        if len(fell_off) > 0:
+            # the arguments are needed to report falling off the end
+            self.lines.insert(1, f'    _args = ({"".join(a + ", " for a in args)})')
+        return '\n'.join(self.lines) + '\n'
+
+    def emit_dispatch(self, depth, spans, lo, hi, fell_off):
+        """Emit a binary search on `_b' for the blocks in spans[lo:hi]"""
+        if hi - lo == 1:
+            self.emit_block(depth, spans, lo, fell_off)
+            return
+        mid = (lo + hi) // 2
+        self.emit(depth, f'if _b < {mid}:')
+        self.emit_dispatch(depth + 1, spans, lo, mid, fell_off)
+        self.emit(depth, 'else:')
+        self.emit_dispatch(depth + 1, spans, mid, hi, fell_off)
+
+    def emit_block(self, depth, spans, i, fell_off):
+        labs, start, end = spans[i]
+        for instr in self.proc.body[start:end]:
+            if not self.emit_instr(depth, instr, labs):
+                return
+        if i + 1 < len(spans):
+            self.emit_edge(depth, labs, spans[i + 1][0][-1])
+        else:
+            fell_off.append(i)
+            self.emit(depth, f'return _fell_off({self.proc.name!r}, '
+                      f'{self.proc.t_args!r}, _args)')
+
+
+def translate(proc):
+    """Return the Python source of a function `run' that runs `proc'. The
+    function expects the globals `G' (global variable values by name) and
+    `F' (functions for the procs by name), and the helpers of Runtime."""
+    return _Translator(proc).translate()
+
+
+_code_cache = dict()    # hash of str(proc) -> code object
+
+
+def compiled(proc):
+    """Return the compiled code of translate(proc), cached by a hash of
+    the proc"""
+    key = hashlib.sha1(str(proc).encode()).hexdigest()
+    code = _code_cache.get(key)
+    if code is None:
+        code = compile(translate(proc), f'<tac2py {proc.name}>', 'exec')
+        _code_cache[key] = code
+    return code
+
+# ------------------------------------------------------------------------------
+
+
+class Runtime(dict):
+    """The functions for the procs of one run, by name, compiled on first
+    use. Also holds the global variable values, the output sink (a
+    tac.Output) and the helpers used by the translated code."""
+
+    def __init__(self, gvars, procs, only_decimal=True, out=None):
+        super().__init__()
+        self.gvars = gvars
+        self.procs = procs
+        self.only_decimal = only_decimal
+        self.out = tac.Output() if out is None else out
+        self.gvals = {name: gvar.value for name, gvar in gvars.items()}
+        self.env = {'G': self.gvals, 'F': self,
+                    '_print_int': self.print_int,
+                    '_print_bool': self.print_bool,
+                    '_no_value': self.no_value,
+                    '_fell_off': self.fell_off}
+        for opcode, fn in tac.word_binops.items():
+            if opcode not in _ring_binops:
+                self.env[f'_{opcode}'] = fn
+
+    def __missing__(self, name):
+        env = dict(self.env)
+        exec(compiled(self.procs[name]), env)
+        self[name] = env['run']
+        return self[name]
+
+    def print_int(self, u):
+        if self.only_decimal:
+            self.out.write(str(tac.untwoc(u)))
+        else:
+            self.out.write(f'{tac.untwoc(u): 20d}  0x{u:016x}  0b{u:064b}')
+
+    def print_bool(self, u):
+        self.out.write('false' if u == 0 else 'true')
+
+    @staticmethod
+    def no_value(name):
+        raise RuntimeError(f'{name}() did not return a value')
+
+    def fell_off(self, name, t_args, args):
+        # the call depth is the number of translated functions running,
+        # the one falling off included
+        depth, frame = -1, sys._getframe(1)
+        while frame is not None:
+            depth += frame.f_code.co_filename.startswith('<tac2py ')
+            frame = frame.f_back
+        self.out.write(f'// {"  " * depth}{name}({",".join(t + "=" + str(v) for t, v in zip(t_args, args))}) --> NONE')
+
+    def store_globals(self):
+        for name, gvar in self.gvars.items():
+            gvar.value = self.gvals[name]
+
+
+def execute(gvars, procs, proc_name, args, **kwargs):
+    """Like tac.execute(), but runs the procs translated to Python. Only the
+    `only_decimal' and `out' options are supported.
+
+    Every TAC call is a Python call, so a deep recursion can overflow the
+    Python stack. The output is held back until the run ends, and if it
+    ends with a RecursionError, the whole run is done again by
+    tac.execute() instead."""
+    only_decimal = kwargs.get('only_decimal', True)
+    out = kwargs.get('out')
+    if out is None:
+        out = tac.Output()
+    rt = Runtime(gvars, procs, only_decimal, tac.CaptureOutput())
+    try:
+        return rt[proc_name](*args)
+    except RecursionError:
+        rt = None
+        return tac.execute(gvars, procs, proc_name, list(args), out=out,
+                           only_decimal=only_decimal)
+    finally:
+        if rt is not None:
+            rt.store_globals()
+            for line in rt.out.lines:
+                out.write(line)
+            out.flush()
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    ap = ArgumentParser(description='Translate TAC procs to Python')
+    ap.add_argument('file', metavar='FILE', type=str,
+                    nargs=1, help='A TAC file (.tac, .tac.json or .tacb)')
+    args = ap.parse_args()
+    for tlv in tac.load_tac(args.file[0]):
+        if isinstance(tlv, tac.Proc):
+            print(f'# {tlv.name}')
+            print(translate(tlv))
@@ -31,22 +31,15 @@ if __name__ == '__main__':
 
     # DSE
     for name, CFG in CFGs.items():
-        change = True
-        while change == True:
-            change = False
+        def removable(instr):
+            return not (instr.opcode in ['div', 'mod', 'call'] or instr.dest in gvars.keys() or instr.arg1 in gvars.keys() or instr.arg2 in gvars.keys())
 
-            livein, liveout = dict(), dict()
-            cfg.recompute_liveness(CFG, livein, liveout)
-            for instr in CFG.instrs():
-                if instr.opcode in ['div', 'mod', 'call'] or instr.dest in gvars.keys() or instr.arg1 in gvars.keys() or instr.arg2 in gvars.keys():
-                    continue
-                elif instr.dest != None and (instr.dest not in liveout[instr]):
-                    change = True
-                    # delete dead store instr
-                    for block in CFG._blockmap.values():
-                        if instr in block.body:
-                            block.body.remove(instr)
-                            break
+        # removing a dead store only updates the liveness of the blocks it
+        # affects, and only those blocks are looked at again
+        live = cfg.Liveness(CFG)
+        work = [block.label for block in CFG.nodes()]
+        while len(work) > 0:
+            work.extend(live.remove_dead_stores(work.pop(), removable))
 
     # SSA Generation from procs and cfgs
     for name in CFGs:
@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+
+"""
+Lane-parallel execution of TAC procedures over batches of inputs
+
+A batch is an int64 NumPy matrix with one row per lane and one column per
+argument of the proc. Every lane is an independent run of the proc with its
+own globals and its own output. The lanes are kept in groups that are at
+the same instruction, and every TAC instruction is run as one vectorized
+operation on 64-bit words (uint64 arrays, so arithmetic wraps around) for
+all the lanes of a group. A conditional jump splits a group by the lanes
+that take it, and groups that meet at the same instruction are merged
+again. Calls run the callee as a batch of the calling lanes.
+
+An error in a lane (such as a division by zero) stops that lane only; the
+message is recorded in the result. Recursion is limited by the Python
+stack, as in tac2py. Requires NumPy.
+"""
+
+import numpy as np
+import tac
+
+# ------------------------------------------------------------------------------
+
+_sign = np.uint64(tac.sign_mask)
+_one = np.uint64(1)
+
+
+def _magnitude(u):
+    """Absolute values of the signed words `u', as words"""
+    return np.where(u >= _sign, ~u + _one, u)
+
+
+def _div(u, v):
+    neg = (u >= _sign) != (v >= _sign)
+    q = _magnitude(u) // _magnitude(v)
+    return np.where(neg, ~q + _one, q)
+
+
+def _mod(u, v):
+    r = _magnitude(u) % _magnitude(v)
+    return np.where(u >= _sign, ~r + _one, r)
+
+
+def _shl(u, v):
+    return np.where(v < 64, u << np.minimum(v, 63), np.uint64(0))
+
+
+def _shr(u, v):
+    return (u.view(np.int64) >> np.minimum(v, 63).view(np.int64)) \
+        .view(np.uint64)
+
+
+# the binary operators, with the lanes on which they fail
+binops = {
+    'add': np.add, 'sub': np.subtract, 'mul': np.multiply,
+    'and': np.bitwise_and, 'or': np.bitwise_or, 'xor': np.bitwise_xor,
+    'div': _div, 'mod': _mod, 'shl': _shl, 'shr': _shr,
+}
+_binop_errors = {
+    'div': (lambda u, v: v == 0, 'integer division or modulo by zero'),
+    'mod': (lambda u, v: v == 0, 'integer division or modulo by zero'),
+    'shl': (lambda u, v: v >= _sign, 'negative shift count'),
+    'shr': (lambda u, v: v >= _sign, 'negative shift count'),
+}
+unops = {
+    'neg': (lambda u: ~u + _one),
+    'not': np.invert,
+}
+jumps = {
+    'jz':   (lambda k: k == 0),
+    'jnz':  (lambda k: k != 0),
+    'jl':   (lambda k: k >= _sign),
+    'jle':  (lambda k: (k == 0) | (k >= _sign)),
+    'jnl':  (lambda k: k < _sign),
+    'jnle': (lambda k: (k != 0) & (k < _sign)),
+}
+
+# ------------------------------------------------------------------------------
+
+
+class BatchResult:
+    """The outcome of every lane of a batch: the returned words `values'
+    (uint64, meaningful only where `has_value'), the error message of the
+    lanes that failed in `errors' (None for the others), the printed lines
+    of each lane in `outputs', and the final values of the globals in
+    `gvals' (name -> uint64 array)."""
+
+    def __init__(self, values, has_value, errors, outputs, gvals):
+        self.values = values
+        self.has_value = has_value
+        self.errors = errors
+        self.outputs = outputs
+        self.gvals = gvals
+
+    def signed(self):
+        """The returned words as signed integers (int64)"""
+        return self.values.view(np.int64)
+
+
+class _Group:
+    """Lanes of one call that are at the same instruction: `sel' are their
+    positions in the call, `regs' maps temporaries to their values, and
+    `params' are the pending call parameters."""
+    __slots__ = ('sel', 'regs', 'params')
+
+    def __init__(self, sel, regs, params):
+        self.sel = sel
+        self.regs = regs
+        self.params = params
+
+    def subset(self, keep):
+        return _Group(self.sel[keep],
+                      {x: v[keep] for x, v in self.regs.items()},
+                      [None if p is None else p[keep] for p in self.params])
+
+    @staticmethod
+    def merge(groups):
+        """Merge `groups', which have the same temporaries and no
+        pending parameters"""
+        if len(groups) == 1:
+            return groups[0]
+        return _Group(np.concatenate([g.sel for g in groups]),
+                      {x: np.concatenate([g.regs[x] for g in groups])
+                       for x in groups[0].regs},
+                      [])
+
+
+class _Call:
+    """One batched call of a proc on the lanes `lanes' of the batch"""
+
+    def __init__(self, run, proc, lanes, args, depth):
+        self.run = run
+        self.proc = proc
+        self.lanes = lanes
+        self.args = args
+        self.depth = depth
+        self.values = np.zeros(len(lanes), dtype=np.uint64)
+        self.has_value = np.zeros(len(lanes), dtype=bool)
+        self.alive = np.ones(len(lanes), dtype=bool)
+        self.blocks, self.block_labs = run.label_blocks(proc)
+        self.pending = dict()   # pc -> groups waiting to run from there
+
+    def fail(self, group, bad, msg):
+        """Stop the lanes `bad' (a mask) of `group' with the error `msg';
+        returns the group of the other lanes"""
+        for lane in self.lanes[group.sel[bad]]:
+            self.run.errors[lane] = msg
+        self.alive[group.sel[bad]] = False
+        return group.subset(~bad)
+
+    def fail_all(self, group, msg):
+        self.fail(group, np.ones(len(group.sel), dtype=bool), msg)
+
+    def load(self, group, x):
+        if x.startswith('@'):
+            return self.run.gvals[x][self.lanes[group.sel]]
+        return group.regs[x]
+
+    def store(self, group, x, value):
+        if x.startswith('@'):
+            self.run.gvals[x][self.lanes[group.sel]] = value
+        else:
+            group.regs[x] = value
+
+    def goto(self, group, src_labs, lab):
+        """Send `group' to the block of `lab' from the block labeled by
+        `src_labs', resolving the phi nodes of the target"""
+        if lab not in self.blocks:
+            self.fail_all(group, f'Unknown jump destination {lab}')
+            return
+        target, phis = self.blocks[lab]
+        moves = []
+        for phi in phis:
+            for src_lab in reversed(src_labs):
+                if src_lab in phi.arg1:
+                    moves.append((phi.dest, phi.arg1[src_lab]))
+                    break
+            else:
+                self.fail_all(group, f'cannot resolve phi: '
+                              f'came from {src_labs[-1]}, '
+                              f'can only handle [{",".join(phi.arg1.keys())}]')
+                return
+        values = [self.load(group, src) for _, src in moves]
+        for (dest, _), value in zip(moves, values):
+            self.store(group, dest, value)
+        self.pending.setdefault(target, []).append(group)
+
+    def execute(self):
+        args = list(self.args[:len(self.proc.t_args)])
+        self.pending[0] = [_Group(np.arange(len(self.lanes)),
+                                  dict(zip(self.proc.t_args, args)), [])]
+        while len(self.pending) > 0:
+            pc = min(self.pending)
+            groups = self.pending.pop(pc)
+            ready = [g for g in groups if len(g.params) > 0]
+            rest = [g for g in groups if len(g.params) == 0]
+            while len(rest) > 0:
+                temps = rest[0].regs.keys()
+                ready.append(_Group.merge([g for g in rest
+                                           if g.regs.keys() == temps]))
+                rest = [g for g in rest if g.regs.keys() != temps]
+            for group in ready:
+                self.step(pc, group)
+        return self.values, self.has_value, self.alive
+
+    def step(self, pc, group):
+        """Run `group' from `pc' until it leaves the straight-line code"""
+        body = self.proc.body
+        while len(group.sel) > 0:
+            if pc >= len(body):
+                name, t_args = self.proc.name, self.proc.t_args
+                for i, lane in zip(group.sel, self.lanes[group.sel]):
+                    desc = ",".join(t + "=" + str(int(a[i]))
+                                    for t, a in zip(t_args, self.args))
+                    self.run.outputs[lane].append(
+                        f'// {"  " * self.depth}{name}({desc}) --> NONE')
+                return
+            instr = body[pc]
+            opcode, dest, arg1, arg2 = \
+                instr.opcode, instr.dest, instr.arg1, instr.arg2
+            if opcode == 'nop':
+                pass
+            elif opcode == 'label':
+                if pc + 1 < len(body) and body[pc + 1].opcode == 'label':
+                    pc += 1
+                    continue
+                # falling through into a block: resolve its phi nodes
+                first = pc + 1 - len(self.block_labs[pc])
+                src_labs = self.block_labs[first - 1] if first > 0 \
+                    else (self.proc.name,)
+                self.goto(group, src_labs, arg1)
+                return
+            elif opcode == 'phi':
+                self.fail_all(group, f'cannot resolve phi: {dest} is not '
+                              f'defined at the start of a block')
+                return
+            elif opcode == 'jmp':
+                self.goto(group, self.block_labs[pc], arg1)
+                return
+            elif opcode in jumps:
+                taken = jumps[opcode](self.load(group, arg1))
+                if taken.any():
+                    self.goto(group.subset(taken), self.block_labs[pc], arg2)
+                if not taken.all():
+                    self.pending.setdefault(pc + 1, []) \
+                        .append(group.subset(~taken))
+                return
+            elif opcode == 'const':
+                self.store(group, dest, np.full(len(group.sel), tac.twoc(arg1),
+                                                dtype=np.uint64))
+            elif opcode == 'copy':
+                self.store(group, dest, self.load(group, arg1))
+            elif opcode in binops:
+                u, v = self.load(group, arg1), self.load(group, arg2)
+                if opcode in _binop_errors:
+                    test, msg = _binop_errors[opcode]
+                    bad = test(u, v)
+                    if bad.any():
+                        keep = ~bad
+                        group = self.fail(group, bad, msg)
+                        u, v = u[keep], v[keep]
+                        if len(group.sel) == 0:
+                            return
+                self.store(group, dest, binops[opcode](u, v))
+            elif opcode in unops:
+                self.store(group, dest, unops[opcode](self.load(group, arg1)))
+            elif opcode == 'param':
+                params = group.params
+                for _ in range(arg1 - len(params)):
+                    params.append(None)
+                params[arg1 - 1] = self.load(group, arg2)
+            elif opcode == 'call' and arg1.startswith('@__bx_print'):
+                if arg1 not in ('@__bx_print_int', '@__bx_print_bool'):
+                    self.fail_all(group,
+                                  f'Unknown print() specialization: {arg1}')
+                    return
+                if len(group.params) != 1:
+                    self.fail_all(group, f'Bad number of arguments to print(): '
+                                  f'expected 1, got {len(group.params)}')
+                    return
+                for lane, u in zip(self.lanes[group.sel], group.params[0]):
+                    self.run.outputs[lane].append(self.run.show(arg1, int(u)))
+                group.params = []
+            elif opcode == 'call':
+                group = self.call(group, instr)
+            elif opcode == 'ret':
+                if arg1 != None:
+                    self.values[group.sel] = self.load(group, arg1)
+                    self.has_value[group.sel] = True
+                return
+            else:
+                self.fail_all(group, f'Unknown opcode {opcode}')
+                return
+            pc += 1
+
+    def call(self, group, instr):
+        """Run the call `instr' for `group'; returns the group of the lanes
+        that survive it"""
+        name, params = instr.arg1, group.params
+        if len(params) < instr.arg2:
+            self.fail_all(group, f'Bad number of arguments to {name}(): '
+                          f'expected {instr.arg2}, got {len(params)}')
+            return group.subset(np.zeros(len(group.sel), dtype=bool))
+        callee = self.run.procs.get(name)
+        if callee is None:
+            self.fail_all(group, f'Unknown procedure {name}')
+            return group.subset(np.zeros(len(group.sel), dtype=bool))
+        if len(params) < len(callee.t_args):
+            self.fail_all(group, f'Bad number of arguments to {name}(): '
+                          f'expected {len(callee.t_args)}, got {len(params)}')
+            return group.subset(np.zeros(len(group.sel), dtype=bool))
+        group.params = []
+        values, has_value, alive = _Call(self.run, callee,
+                                         self.lanes[group.sel], params,
+                                         self.depth + 1).execute()
+        if not alive.all():
+            self.alive[group.sel[~alive]] = False
+            group, values, has_value = \
+                group.subset(alive), values[alive], has_value[alive]
+        if instr.dest != None:
+            if not has_value.all():
+                group = self.fail(group, ~has_value,
+                                  f'{name}() did not return a value')
+                values = values[has_value]
+            self.store(group, instr.dest, values)
+        return group
+
+
+class _Run:
+    """State shared by all the calls of one batch"""
+
+    def __init__(self, gvars, procs, lanes, only_decimal):
+        self.procs = procs
+        self.only_decimal = only_decimal
+        self.gvals = {name: np.full(lanes, tac.twoc(gvar.value),
+                                    dtype=np.uint64)
+                      for name, gvar in gvars.items()}
+        self.errors = [None] * lanes
+        self.outputs = [[] for _ in range(lanes)]
+        self._blocks = dict()
+
+    def label_blocks(self, proc):
+        if proc.name not in self._blocks:
+            self._blocks[proc.name] = tac.label_blocks(proc)
+        return self._blocks[proc.name]
+
+    def show(self, callee, u):
+        if callee == '@__bx_print_bool':
+            return 'false' if u == 0 else 'true'
+        if self.only_decimal:
+            return str(tac.untwoc(u))
+        return f'{tac.untwoc(u): 20d}  0x{u:016x}  0b{u:064b}'
+
+
+def execute_batch(gvars, procs, proc_name, inputs, only_decimal=True):
+    """Run the proc `proc_name' of `procs' once for every row of the int64
+    matrix `inputs', whose columns are the arguments, and return a
+    BatchResult. The Gvar objects of `gvars' are not modified."""
+    inputs = np.asarray(inputs, dtype=np.int64)
+    if inputs.ndim != 2:
+        raise ValueError('inputs must be a matrix with one row per lane')
+    lanes = inputs.shape[0]
+    words = inputs.view(np.uint64)
+    run = _Run(gvars, procs, lanes, only_decimal)
+    proc = procs[proc_name]
+    if words.shape[1] < len(proc.t_args):
+        raise RuntimeError(f'Bad number of arguments to {proc_name}(): '
+                           f'expected {len(proc.t_args)}, '
+                           f'got {words.shape[1]}')
+    args = [words[:, i].copy() for i in range(words.shape[1])]
+    values, has_value, _ = _Call(run, proc, np.arange(lanes), args, 0) \
+        .execute()
+    return BatchResult(values, has_value, run.errors, run.outputs, run.gvals)
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    ap = ArgumentParser(description='Run a TAC proc over a batch of inputs')
+    ap.add_argument('file', metavar='FILE', type=str,
+                    help='A TAC file (.tac, .tac.json or .tacb)')
+    ap.add_argument('proc', metavar='PROC', type=str,
+                    help='The proc to run, such as @fib')
+    ap.add_argument('inputs', metavar='INPUTS', type=str,
+                    help='A text file with the arguments of one run per line')
+    args = ap.parse_args()
+    gvars, procs = dict(), dict()
+    for tlv in tac.load_tac(args.file):
+        if isinstance(tlv, tac.Proc):
+            procs[tlv.name] = tlv
+        else:
+            gvars[tlv.name] = tlv
+    inputs = np.loadtxt(args.inputs, dtype=np.int64, ndmin=2)
+    result = execute_batch(gvars, procs, args.proc, inputs)
+    for i, row in enumerate(inputs):
+        desc = f'{args.proc}({",".join(str(x) for x in row)})'
+        if result.errors[i] is not None:
+            print(f'{desc} !! {result.errors[i]}')
+        elif result.has_value[i]:
+            print(f'{desc} --> {result.signed()[i]}')
+        else:
+            print(f'{desc} --> NONE')
@@ -0,0 +1,432 @@
+#!/usr/bin/env python3
+
+"""
+Checks of the analyses of cfg.py on the examples in testing_examples/,
+against simple instruction-level definitions
+"""
+
+import copy
+import glob
+import os
+import random
+import unittest
+
+import tac
+import cfg
+import ssagen
+
+_here = os.path.dirname(os.path.abspath(__file__))
+_examples = os.path.join(_here, 'testing_examples')
+
+
+def _procs():
+    """The procs of the examples"""
+    files = sorted(glob.glob(os.path.join(_examples, '*.tac.json')))
+    files.append(os.path.join(_examples, 'layout.tac'))
+    return [tlv for tac_file in files for tlv in tac.load_tac(tac_file)
+            if isinstance(tlv, tac.Proc)]
+
+
+def _cfgs():
+    """Generate (description, CFG) pairs for the procs of the examples: as
+    inferred, in SSA form, and in SSA form with some extra edges. Each CFG
+    is a copy that can be changed."""
+    for proc in _procs():
+        c = cfg.infer(proc)
+        yield proc.name, copy.deepcopy(c)
+        ssagen.crude_ssagen(proc, c)
+        yield f'{proc.name} in SSA', copy.deepcopy(c)
+        rng = random.Random(proc.name)
+        labs = [bl.label for bl in c.nodes()]
+        for _ in range(3):
+            c.add_edge(rng.choice(labs), rng.choice(labs))
+        yield f'{proc.name} in SSA with extra edges', c
+
+# ------------------------------------------------------------------------------
+
+
+def _reference_postorder(c):
+    """The labels of the blocks that can be reached from the entry of `c',
+    in the postorder of a depth-first search that visits the successors in
+    order"""
+    order, seen = [], {c.lab_entry}
+    stack = [(c.lab_entry, iter(list(c.successors(c.lab_entry))))]
+    while len(stack) > 0:
+        lab, succ = stack[-1]
+        for lab_to in succ:
+            if lab_to not in seen:
+                seen.add(lab_to)
+                stack.append((lab_to, iter(list(c.successors(lab_to)))))
+                break
+        else:
+            stack.pop()
+            order.append(lab)
+    return order
+
+
+class CFGIndexTest(unittest.TestCase):
+    """The CSR arrays of CFGIndex must hold the edges of the CFG"""
+
+    def check(self, c):
+        index = c.index
+        labs = [bl.label for bl in c.nodes()]
+        self.assertEqual(index.labels, labs)
+        self.assertEqual(len(index), len(labs))
+        for starts, targets, adj in ((index.succ_start, index.succ, c._fwd),
+                                     (index.pred_start, index.pred, c._bwd)):
+            self.assertEqual(len(starts), len(labs) + 1)
+            self.assertEqual(starts[0], 0)
+            self.assertEqual(starts[-1], len(targets))
+            for u, lab in enumerate(labs):
+                self.assertEqual(index.numbers[lab], u)
+                self.assertEqual(sorted(labs[v] for v in
+                                        targets[starts[u]:starts[u + 1]]),
+                                 sorted(adj[lab]))
+        for u, lab in enumerate(labs):
+            self.assertEqual([labs[v] for v in index.successors(u)],
+                             list(c.successors(lab)))
+            self.assertEqual([labs[v] for v in index.predecessors(u)],
+                             list(c.predecessors(lab)))
+            self.assertEqual(sorted(c.successors(lab)), sorted(c._fwd[lab]))
+            self.assertEqual(sorted(c.predecessors(lab)),
+                             sorted(c._bwd[lab]))
+            self.assertEqual(c.out_degree(lab), len(c._fwd[lab]))
+            self.assertEqual(c.in_degree(lab), len(c._bwd[lab]))
+        self.assertEqual(list(c.edges()),
+                         [(lab, lab_to) for lab in labs
+                          for lab_to in c.successors(lab)])
+        self.assertEqual([labs[u] for u in index.postorder],
+                         _reference_postorder(c))
+        self.assertEqual(list(index.rpo), list(reversed(index.postorder)))
+
+    def test_examples(self):
+        for desc, c in _cfgs():
+            with self.subTest(cfg=desc):
+                self.check(c)
+
+    def test_changes(self):
+        """The index follows the changes to the CFG"""
+        for desc, c in _cfgs():
+            rng = random.Random(desc)
+            labs = [bl.label for bl in c.nodes()]
+            for step in range(4):
+                edges = list(c.edges())
+                if step % 2 == 1 and len(edges) > 0:
+                    c.remove_edge(*rng.choice(edges))
+                else:
+                    c.add_edge(rng.choice(labs), rng.choice(labs))
+                with self.subTest(cfg=desc, step=step):
+                    self.check(c)
+            others = [lab for lab in labs if lab != c.lab_entry]
+            if len(others) > 0:
+                c.remove_node(c[rng.choice(others)])
+                with self.subTest(cfg=desc, removed=True):
+                    self.check(c)
+
+def _reference_liveness(c):
+    """The livein and liveout sets of the instructions of `c', by iterating
+    over the pairs of consecutive instructions as the original
+    recompute_liveness() did"""
+    livein = {i: set(i.uses()) for i in c.instrs()}
+    liveout = {i: set() for i in c.instrs()}
+    pairs = list(c.instr_pairs(labeled=True))
+    dirty = True
+    while dirty:
+        dirty = False
+        for li, i, lj, j in pairs:
+            facts = livein[j] if li == lj \
+                else set(cfg.filter_liveset(li, livein[j]))
+            defs = set(i.defs())
+            for x in facts:
+                if (x[1] if isinstance(x, tuple) else x) not in defs and \
+                        x not in livein[i]:
+                    livein[i].add(x)
+                    dirty = True
+    for li, i, lj, j in pairs:
+        liveout[i].update(cfg.filter_liveset(li, livein[j]))
+    livein = {i: {x[1] if isinstance(x, tuple) else x for x in s}
+              for i, s in livein.items()}
+    return livein, liveout
+
+
+class LivenessTest(unittest.TestCase):
+
+    def test_examples(self):
+        for desc, c in _cfgs():
+            with self.subTest(cfg=desc):
+                ref_in, ref_out = _reference_liveness(c)
+                livein, liveout = dict(), dict()
+                cfg.recompute_liveness(c, livein, liveout)
+                self.assertEqual(livein, ref_in)
+                self.assertEqual(liveout, ref_out)
+                live = cfg.Liveness(c)
+                for i in c.instrs():
+                    self.assertEqual(live.livein(i), ref_in[i])
+                    self.assertEqual(live.liveout(i), ref_out[i])
+
+
+def _instr_graph(c):
+    """The successors and the predecessors of each instruction of `c'"""
+    succ = {i: [] for i in c.instrs()}
+    pred = {i: [] for i in c.instrs()}
+    for bl in c.nodes():
+        seq = list(bl.instrs())
+        for i, j in zip(seq, seq[1:]):
+            succ[i].append(j)
+            pred[j].append(i)
+    for lab_from, lab_to in c.edges():
+        i, j = c[lab_from].last_instr(), c[lab_to].first_instr()
+        succ[i].append(j)
+        pred[j].append(i)
+    return succ, pred
+
+
+def _reference_solve(c, forward, may, universe, gen, kill):
+    """The sets before and after each instruction of `c' for a dataflow
+    problem given by sets of facts, solved by iterating over all the
+    instructions until nothing changes"""
+    succ, pred = _instr_graph(c)
+    sources = pred if forward else succ
+    heads = {i: set() for i in c.instrs()}
+    tails = {i: set(universe) for i in c.instrs()}
+    changed = True
+    while changed:
+        changed = False
+        for i in c.instrs():
+            incoming = [tails[j] for j in sources[i]]
+            if len(incoming) == 0:
+                head = set()
+            elif may:
+                head = set().union(*incoming)
+            else:
+                head = set.intersection(*incoming)
+            tail = gen(i) | (head - kill(i))
+            if head != heads[i] or tail != tails[i]:
+                heads[i], tails[i] = head, tail
+                changed = True
+    return (heads, tails) if forward else (tails, heads)
+
+
+class DataflowTest(unittest.TestCase):
+
+    def check(self, c, problem, reference):
+        before, after = reference
+        for i in c.instrs():
+            self.assertEqual(problem.before(i), before[i])
+            self.assertEqual(problem.after(i), after[i])
+
+    def test_reaching_definitions(self):
+        for desc, c in _cfgs():
+            with self.subTest(cfg=desc):
+                instrs = list(c.instrs())
+                ref = _reference_solve(
+                    c, True, True, set(),
+                    lambda i: {i} if len(list(i.defs())) > 0 else set(),
+                    lambda i: {d for d in instrs
+                               if set(d.defs()) & set(i.defs())})
+                self.check(c, cfg.ReachingDefinitions(c), ref)
+
+    def test_expressions(self):
+        for desc, c in _cfgs():
+            exprs = {cfg.expression(i) for i in c.instrs()} - {None}
+            using_globals = {e for e in exprs
+                             if any(isinstance(x, str) and x.startswith('@')
+                                    for x in e[1:])}
+
+            def kill(i):
+                killed = {e for e in exprs
+                          if i.dest is not None and i.dest in e[1:]}
+                return killed | (using_globals if i.opcode == 'call'
+                                 else set())
+
+            def available(i):
+                e = cfg.expression(i)
+                return {e} if e is not None and i.dest not in e[1:] \
+                    else set()
+
+            def busy(i):
+                e = cfg.expression(i)
+                return set() if e is None else {e}
+
+            with self.subTest(cfg=desc, problem='available'):
+                ref = _reference_solve(c, True, False, exprs, available, kill)
+                self.check(c, cfg.AvailableExpressions(c), ref)
+            with self.subTest(cfg=desc, problem='very busy'):
+                ref = _reference_solve(c, False, False, exprs, busy, kill)
+                self.check(c, cfg.VeryBusyExpressions(c), ref)
+
+
+def _removable(instr):
+    """Whether tac_dfopt.py may remove `instr' when its destination is
+    dead"""
+    return not (instr.opcode in ['div', 'mod', 'call'] or
+                any(isinstance(x, str) and x.startswith('@')
+                    for x in (instr.dest, instr.arg1, instr.arg2)))
+
+
+def _reference_dse(c):
+    """Dead store elimination as tac_dfopt.py did it before the liveness
+    could be updated: recompute the liveness of the whole CFG after each
+    pass, until a pass removes nothing"""
+    change = True
+    while change:
+        change = False
+        livein, liveout = dict(), dict()
+        cfg.recompute_liveness(c, livein, liveout)
+        for instr in c.instrs():
+            if _removable(instr) and instr.dest is not None and \
+                    instr.dest not in liveout[instr]:
+                change = True
+                for bl in c.nodes():
+                    if instr in bl.body:
+                        bl.body.remove(instr)
+                        break
+
+
+class LivenessUpdateTest(unittest.TestCase):
+    """Liveness updated after changes to the CFG must be the same as
+    Liveness computed again"""
+
+    def check(self, c, live):
+        fresh = cfg.Liveness(c)
+        for i in c.instrs():
+            self.assertEqual(live.livein(i), fresh.livein(i))
+            self.assertEqual(live.liveout(i), fresh.liveout(i))
+
+    def test_changes(self):
+        for desc, c in _cfgs():
+            rng = random.Random(desc)
+            live = cfg.Liveness(c)
+            temps = sorted({t for i in c.instrs()
+                            for t in list(i.defs()) + list(i.uses())
+                            if isinstance(t, str)}) + ['%new.0', '%new.1']
+            labs = [bl.label for bl in c.nodes()]
+            for step in range(12):
+                body = [(lab, i) for lab in labs for i in c[lab].body]
+                uses = [(i, t) for _, i in body
+                        for t in (list(i.arg1.values())
+                                  if i.opcode == 'phi'
+                                  else [i.arg1, i.arg2])
+                        if isinstance(t, str) and t.startswith('%')]
+                kind = step % 3
+                if kind == 0 and len(body) > 0:
+                    lab, instr = rng.choice(body)
+                    live.remove_instr(instr)
+                elif kind == 1 and len(uses) > 0:
+                    instr, old = rng.choice(uses)
+                    live.replace_operand(instr, old, rng.choice(temps))
+                else:
+                    lab = rng.choice(labs)
+                    instr = tac.Instr(rng.choice(temps), 'add',
+                                      [rng.choice(temps), rng.choice(temps)])
+                    live.insert_instr(lab, rng.randrange(
+                        len(c[lab].body) + 1), instr)
+                with self.subTest(cfg=desc, step=step):
+                    self.check(c, live)
+
+    def test_insert_jump(self):
+        c = next(c for _, c in _cfgs())
+        live = cfg.Liveness(c)
+        with self.assertRaises(ValueError):
+            live.insert_instr(c.lab_entry, 0, tac.Instr(None, 'ret', []))
+
+    def test_dead_stores(self):
+        """Dead store elimination as tac_dfopt.py does it removes the same
+        instructions as before"""
+        for desc, c in _cfgs():
+            with self.subTest(cfg=desc):
+                expected = copy.deepcopy(c)
+                _reference_dse(expected)
+                live = cfg.Liveness(c)
+                work = [bl.label for bl in c.nodes()]
+                while len(work) > 0:
+                    work.extend(live.remove_dead_stores(work.pop(),
+                                                        _removable))
+                self.assertEqual([str(i) for i in c.instrs()],
+                                 [str(i) for i in expected.instrs()])
+
+def _reference_dominators(c, post):
+    """The set of the dominators (or post-dominators) of each block of `c'
+    that can be reached, by iterating on sets, and the predecessors of
+    each block in the direction of the analysis"""
+    labs = [bl.label for bl in c.nodes()]
+    succ = {lab: set(c.successors(lab)) for lab in labs}
+    pred = {lab: set(c.predecessors(lab)) for lab in labs}
+    if post:
+        succ, pred = pred, succ
+        roots = [lab for lab in labs if len(pred[lab]) == 0]
+    else:
+        roots = [c.lab_entry]
+    reached, work = set(roots), list(roots)
+    while len(work) > 0:
+        for lab in succ[work.pop()]:
+            if lab not in reached:
+                reached.add(lab)
+                work.append(lab)
+    doms = {lab: set(reached) for lab in reached}
+    for lab in roots:
+        doms[lab] = {lab}
+    changed = True
+    while changed:
+        changed = False
+        for lab in reached - set(roots):
+            new = set.intersection(*[doms[p] for p in pred[lab]
+                                     if p in reached]) | {lab}
+            if new != doms[lab]:
+                doms[lab], changed = new, True
+    return doms, pred
+
+
+class DominatorsTest(unittest.TestCase):
+
+    def check(self, c):
+        labs = [bl.label for bl in c.nodes()]
+        for post in (False, True):
+            doms, pred = _reference_dominators(c, post)
+            for a in labs:
+                for b in labs:
+                    self.assertEqual(c.dominates(a, b, post),
+                                     b in doms and a in doms[b])
+                if a not in doms:
+                    self.assertIsNone(c.idom(a, post))
+                    continue
+                strict = doms[a] - {a}
+                self.assertEqual(c.idom(a, post),
+                                 max(strict, key=lambda d: len(doms[d]))
+                                 if len(strict) > 0 else None)
+                # b is in the frontier of a if a dominates a predecessor
+                # of b but does not strictly dominate b
+                frontier = {b for b in doms
+                            if any(p in doms and a in doms[p]
+                                   for p in pred[b]) and
+                            (a == b or a not in doms[b])}
+                self.assertEqual(c.dominance_frontier(a, post), frontier)
+
+    def test_examples(self):
+        for desc, c in _cfgs():
+            with self.subTest(cfg=desc):
+                self.check(c)
+
+    def test_changes(self):
+        """The dominators follow the changes to the CFG"""
+        for desc, c in _cfgs():
+            rng = random.Random(desc)
+            labs = [bl.label for bl in c.nodes()]
+            for step in range(6):
+                edges = list(c.edges())
+                if step % 3 == 2 and len(edges) > 0:
+                    c.remove_edge(*rng.choice(edges))
+                else:
+                    c.add_edge(rng.choice(labs), rng.choice(labs))
+                with self.subTest(cfg=desc, step=step):
+                    self.check(c)
+            others = [lab for lab in labs if lab != c.lab_entry]
+            if len(others) > 0:
+                lab = rng.choice(others)
+                c.remove_node(c[lab])
+                with self.subTest(cfg=desc, removed=lab):
+                    self.check(c)
+
+
+if __name__ == '__main__':
+    unittest.main()
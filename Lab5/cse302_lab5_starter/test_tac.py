@@ -0,0 +1,718 @@
+#!/usr/bin/env python3
+
+"""
+Checks of tac.py
+"""
+
+import contextlib
+import copy
+import fractions
+import glob
+import io
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import tac
+import cfg
+import ssagen
+
+_here = os.path.dirname(os.path.abspath(__file__))
+_examples = os.path.join(_here, 'testing_examples')
+
+
+def _words():
+    """Words at the edges of the signed and unsigned ranges, and some
+    random ones"""
+    rng = random.Random(302)
+    edges = (0, 1, 2, 3, 7, 63, 64, 65, 2 ** 31, 2 ** 32 + 1, 2 ** 53,
+             2 ** 53 + 1, 2 ** 62, 2 ** 63 - 1, 2 ** 63)
+    return sorted({tac.twoc(s * x) for x in edges for s in (1, -1)} |
+                  {rng.getrandbits(64) for _ in range(24)})
+
+
+def _program(tlvs):
+    """The Gvar and the Proc objects of `tlvs', by name"""
+    gvars = {tlv.name: tlv for tlv in tlvs if isinstance(tlv, tac.Gvar)}
+    procs = {tlv.name: tlv for tlv in tlvs if isinstance(tlv, tac.Proc)}
+    return gvars, procs
+
+
+def _source(text):
+    """The declarations of the TAC text `text'"""
+    return tac.Parser(tac.Lexer(text, 'test')).parse()
+
+
+def _ssa(tlvs):
+    """`tlvs' with every proc put in SSA form"""
+    for tlv in tlvs:
+        if isinstance(tlv, tac.Proc):
+            c = cfg.infer(tlv)
+            ssagen.crude_ssagen(tlv, c)
+            cfg.linearize(tlv, c)
+    return tlvs
+
+
+def _execute(gvars, procs, proc_name='@main', args=(), **kwargs):
+    """What running `proc_name' with `args' returns and prints"""
+    out = tac.CaptureOutput()
+    retval = tac.execute(gvars, procs, proc_name, list(args), out=out,
+                         **kwargs)
+    return retval, out.getvalue()
+
+
+def _texts():
+    """The TAC text of every example, by name"""
+    texts = dict()
+    for tac_file in sorted(glob.glob(os.path.join(_examples, '*.tac'))):
+        with open(tac_file) as fp:
+            texts[os.path.basename(tac_file)] = fp.read()
+    for tac_file in sorted(glob.glob(os.path.join(_examples, '*.tac.json'))):
+        texts[os.path.basename(tac_file)] = \
+            ''.join(str(tlv) for tlv in tac.load_tac(tac_file))
+    return texts
+
+
+def _run(*args, stderr=False):
+    """The standard output of `tac.py args', and its standard error if
+    `stderr'"""
+    done = subprocess.run([sys.executable, os.path.join(_here, 'tac.py'),
+                           *args], cwd=_here, capture_output=True,
+                          text=True, check=True)
+    return (done.stdout, done.stderr) if stderr else done.stdout
+
+# ------------------------------------------------------------------------------
+
+
+class KernelTest(unittest.TestCase):
+    """The word kernels must compute what the reference definitions in
+    binops, unops and jumps compute"""
+
+    def check(self, fn, ref, *args):
+        """`fn(*args)' returns or raises what `ref(*args)' does"""
+        try:
+            expected = ref(*args)
+        except (ValueError, ZeroDivisionError) as exc:
+            with self.assertRaises(type(exc)):
+                fn(*args)
+        else:
+            self.assertEqual(fn(*args), expected)
+
+    def test_binops(self):
+        words = _words()
+        for opcode, fn in tac.word_binops.items():
+            with self.subTest(opcode=opcode):
+                for u in words:
+                    for v in words:
+                        if opcode in ('shl', 'shr') and \
+                                64 < v < tac.sign_mask:
+                            continue    # see test_shifts()
+                        if opcode in ('div', 'mod') and \
+                                max(abs(tac.untwoc(u)),
+                                    abs(tac.untwoc(v))) > 2 ** 53:
+                            continue    # see test_division()
+                        self.check(fn, tac.binops[opcode], u, v)
+
+    def test_shifts(self):
+        """Shifts by every count up to past the word size, and by counts
+        too big for the reference, which act as a shift by 64"""
+        for opcode in ('shl', 'shr'):
+            fn, ref = tac.word_binops[opcode], tac.binops[opcode]
+            for u in _words():
+                with self.subTest(opcode=opcode, u=u):
+                    for v in range(70):
+                        self.check(fn, ref, u, v)
+                    for v in (2 ** 31, 2 ** 62, tac.sign_mask - 1):
+                        self.assertEqual(fn(u, v), ref(u, 64))
+
+    def test_division(self):
+        """Division truncates toward zero exactly, also where the
+        floating-point division of the reference rounds"""
+        div, mod = tac.word_binops['div'], tac.word_binops['mod']
+        for u in _words():
+            for v in _words():
+                if v == 0:
+                    continue
+                x, y = tac.untwoc(u), tac.untwoc(v)
+                q = int(fractions.Fraction(x, y))
+                with self.subTest(u=u, v=v):
+                    self.assertEqual(div(u, v), tac.twoc(q))
+                    self.assertEqual(mod(u, v), tac.twoc(x - y * q))
+
+    def test_unops_and_jumps(self):
+        for u in _words():
+            with self.subTest(u=u):
+                for opcode, fn in tac.word_unops.items():
+                    self.assertEqual(fn(u), tac.unops[opcode](u))
+                for opcode, test in tac.word_jumps.items():
+                    self.assertEqual(test(u), tac.jumps[opcode](u))
+
+
+class OutputTest(unittest.TestCase):
+
+    def test_limit(self):
+        """Lines are held until `limit' of them are pending, or flush()"""
+        fp = io.StringIO()
+        out = tac.Output(fp, limit=3)
+        out.write('1')
+        out.write('2')
+        self.assertEqual(fp.getvalue(), '')
+        out.write('3')
+        self.assertEqual(fp.getvalue(), '1\n2\n3\n')
+        out.write('4')
+        self.assertEqual(fp.getvalue(), '1\n2\n3\n')
+        out.flush()
+        self.assertEqual(fp.getvalue(), '1\n2\n3\n4\n')
+        out.flush()
+        self.assertEqual(fp.getvalue(), '1\n2\n3\n4\n')
+
+    def test_unbuffered(self):
+        fp = io.StringIO()
+        out = tac.Output(fp, limit=1)
+        for i in range(3):
+            out.write(str(i))
+            self.assertEqual(fp.getvalue(),
+                             ''.join(f'{j}\n' for j in range(i + 1)))
+
+    def test_stdout(self):
+        """Without `fp', the lines go to sys.stdout as it is when they are
+        written out"""
+        out = tac.Output(limit=2)
+        first, second = io.StringIO(), io.StringIO()
+        with contextlib.redirect_stdout(first):
+            out.write('a')
+            out.write('b')
+        with contextlib.redirect_stdout(second):
+            out.write('c')
+            out.flush()
+        self.assertEqual(first.getvalue(), 'a\nb\n')
+        self.assertEqual(second.getvalue(), 'c\n')
+
+    def test_capture(self):
+        """CaptureOutput keeps every line, past the default limit, and
+        prints nothing"""
+        out = tac.CaptureOutput()
+        buf = io.StringIO()
+        with contextlib.redirect_stdout(buf):
+            for i in range(10000):
+                out.write(str(i))
+            out.flush()
+        self.assertEqual(buf.getvalue(), '')
+        self.assertEqual(len(out.lines), 10000)
+        self.assertEqual(out.getvalue(),
+                         ''.join(f'{i}\n' for i in range(10000)))
+
+    def test_execute(self):
+        """A run prints the same through any sink, and flushes it at the
+        end"""
+        tac_file = os.path.join(_examples, 'fizzbuzz.tac.json')
+        fp = io.StringIO()
+        tac.execute(*_program(tac.load_tac(tac_file)), '@main', [],
+                    out=tac.Output(fp, limit=7))
+        capture = tac.CaptureOutput()
+        tac.execute(*_program(tac.load_tac(tac_file)), '@main', [],
+                    out=capture)
+        self.assertGreater(len(capture.lines), 7)
+        self.assertEqual(fp.getvalue(), capture.getvalue())
+
+
+class FusionTest(unittest.TestCase):
+    """Runs with the superinstructions must give the same results as runs
+    of the single instructions"""
+
+    # every kind of fused sequence, and some sequences split by labels
+    program = '''
+var @g = 7;
+
+proc @count(%n):
+%.L9:
+  %i = const 0;
+  %s = copy %i;
+%.L0:
+  %d = sub %i, %n;
+  jnl %d, %.L3;
+  jmp %.L1;
+%.L1:
+  %s = add %s, %i;
+  %one = const 1;
+  %i = add %i, %one;
+  %c = and %i, %one;
+  jz %c, %.L0;
+%.L2:
+  %s = add %s, %one;
+  jmp %.L0;
+%.L3:
+  ret %s;
+
+proc @pick(%a, %b, %c):
+%.L9:
+  %x = sub %a, %b;
+  jl %x, %.L1;
+  %y = mul %x, %c;
+  jle %y, %.L2;
+  %z = xor %y, %c;
+  jnle %z, %.L1;
+%.L0:
+  jnz %z, %.L2;
+  ret %c;
+%.L1:
+  ret %a;
+%.L2:
+  ret %b;
+
+proc @main:
+%.L9:
+  %k = const 3;
+%.L0:
+  %m = copy %k;
+  %n = const 10;
+  param 1, %n;
+  %s = call @count, 1;
+  param 1, %s;
+  call @__bx_print_int, 1;
+  %two = const 2;
+  param 2, %m;
+  param 1, %two;
+  param 3, %s;
+  %p = call @pick, 3;
+  param 1, %p;
+  call @__bx_print_int, 1;
+  param 3, %k;
+%.L1:
+  param 2, %n;
+  param 1, %m;
+  %p = call @pick, 3;
+  param 1, %p;
+  call @__bx_print_int, 1;
+  %one = const 1;
+  %k = sub %k, %one;
+%.L2:
+  jnl %k, %.L0;
+  param 1, @g;
+  call @__bx_print_int, 1;
+  %q = const 5;
+  %r = copy %q;
+  @g = copy %r;
+  ret;
+'''
+
+    def check(self, tlvs):
+        """Run @main of the declarations `tlvs' with and without the
+        superinstructions"""
+        fused = _execute(*_program(copy.deepcopy(tlvs)))
+        with mock.patch.object(tac, '_fuse',
+                               lambda prep, body, ops, *rest: list(ops)):
+            single = _execute(*_program(copy.deepcopy(tlvs)))
+        self.assertEqual(fused, single)
+
+    def test_program(self):
+        self.check(_source(self.program))
+        self.check(_ssa(_source(self.program)))
+
+    def test_fused(self):
+        """The program above has superinstructions"""
+        gvars, procs = _program(_source(self.program))
+        m = tac.Machine(gvars, procs)
+        preps = [proc.prepared(m) for proc in procs.values()]
+        self.assertGreaterEqual(sum(op is not step for prep in preps
+                                    for op, step in zip(prep.ops,
+                                                        prep.steps)), 8)
+
+    def test_examples(self):
+        for tac_file in sorted(glob.glob(os.path.join(_examples,
+                                                      '*.tac.json'))):
+            with self.subTest(tac_file=os.path.basename(tac_file)):
+                self.check(tac.load_tac(tac_file))
+                self.check(_ssa(tac.load_tac(tac_file)))
+
+
+class ReaderTest(unittest.TestCase):
+    """The Reader must build the same objects as the PLY parser, and
+    report the same errors"""
+
+    broken = [
+        'var @x = ;',
+        'var @x = 99999999999999999999;',
+        'proc @main:\n  %x = add %a;\n  ret;',
+        'proc @main:\n  %x = frob %a, %b;',
+        'proc @main(%a:\n  ret;',
+        'proc @main:\n  jmp 3;',
+        'proc @main:\n  %.L0 = copy %x;',
+        'proc @main:\n  ret %x\n  ret;',
+        'var @x = 1;\nvar @y 2; $',
+        'proc main:\n  ret;',
+    ]
+
+    @staticmethod
+    def _parse(parse, text):
+        """What `parse(text)' returns or raises, and what it prints"""
+        buf = io.StringIO()
+        with contextlib.redirect_stdout(buf):
+            try:
+                result = ('ok', [str(tlv) for tlv in parse(text)])
+            except Exception as exc:
+                result = ('exc', type(exc).__name__, str(exc))
+        return result, buf.getvalue()
+
+    def check(self, text):
+        ply = self._parse(
+            lambda t: tac.Parser(tac.Lexer(t, 'test')).parse(), text)
+        self.assertEqual(self._parse(lambda t: list(tac.Reader(t, 'test')),
+                                     text), ply)
+        return ply
+
+    def test_examples(self):
+        # some of the .tac.json examples use labels that are not valid in
+        # TAC text, so only the .tac examples have to parse
+        for name, text in _texts().items():
+            with self.subTest(example=name):
+                result = self.check(text)[0][0]
+                if name.endswith('.tac'):
+                    self.assertEqual(result, 'ok')
+
+    def test_errors(self):
+        for text in self.broken:
+            with self.subTest(text=text):
+                self.assertEqual(self.check(text)[0][0], 'exc')
+
+
+class TacbTest(unittest.TestCase):
+    """A program written by dump_tacb() must read back the same"""
+
+    def test_round_trip(self):
+        programs = {os.path.basename(f): tac.load_tac(f)
+                    for f in sorted(glob.glob(os.path.join(_examples,
+                                                           '*.tac.json')) +
+                                    glob.glob(os.path.join(_examples,
+                                                           '*.tac')))}
+        with tempfile.TemporaryDirectory() as tmp:
+            tacb_file = os.path.join(tmp, 'prog.tacb')
+            for name, prog in programs.items():
+                with self.subTest(example=name):
+                    with open(tacb_file, 'wb') as fp:
+                        tac.dump_tacb(prog, fp)
+                    for compact in (False, True):
+                        back = tac.load_tac(tacb_file, compact)
+                        self.assertEqual([str(tlv) for tlv in back],
+                                         [str(tlv) for tlv in prog])
+                        self.assertEqual([tlv.js_obj for tlv in back],
+                                         [tlv.js_obj for tlv in prog])
+                    with tac.TacbFile(tacb_file) as tacb:
+                        for tlv in reversed(prog):
+                            self.assertEqual(str(tacb[tlv.name]), str(tlv))
+
+    def test_not_tacb(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            tacb_file = os.path.join(tmp, 'prog.tacb')
+            for data in (b'', b'not a tacb file at all, just some text'):
+                with open(tacb_file, 'wb') as fp:
+                    fp.write(data)
+                with self.assertRaises(ValueError):
+                    tac.TacbFile(tacb_file)
+
+
+class LazyTest(unittest.TestCase):
+    """`--lazy' must give the same output as loading everything"""
+
+    def test_examples(self):
+        for tac_file in sorted(glob.glob(os.path.join(_examples, '*.tac')) +
+                               glob.glob(os.path.join(_examples,
+                                                      '*.tac.json'))):
+            with self.subTest(tac_file=os.path.basename(tac_file)):
+                self.assertEqual(_run('--lazy', tac_file), _run(tac_file))
+
+    def test_decls_on_one_line(self):
+        for name, expected in (('var_then_proc.tac', '1\n'),
+                               ('proc_then_var.tac', '5\n')):
+            tac_file = os.path.join(_examples, name)
+            with self.subTest(tac_file=name):
+                self.assertEqual(_run(tac_file), expected)
+                self.assertEqual(_run('--lazy', tac_file), expected)
+                with open(tac_file) as fp:
+                    self.assertIsNone(tac._split_decls(fp.read().split('\n')))
+
+    def test_read_decl(self):
+        read = tac._read_decl
+        self.assertEqual(read(tac.Reader('var @x = 1;'), 'var', '@x').value, 1)
+        for text, keyword, name in (('var @x = 1;\nvar @y = 2;', 'var', '@x'),
+                                    ('var @x = 1;', 'var', '@y'),
+                                    ('var @x = 1;', 'proc', '@x'),
+                                    ('var @x = 1;', None, None)):
+            with self.subTest(text=text, keyword=keyword, name=name):
+                with self.assertRaises(RuntimeError):
+                    read(tac.Reader(text), keyword, name)
+
+
+class SymbolsTest(unittest.TestCase):
+
+    names = ['%1', '%x.2', '.L0', '@g', '%x', '%12.7', '%x.1.2', '@main']
+
+    def test_intern(self):
+        symbols = tac.Symbols()
+        for name in self.names:
+            # an equal string that is another object
+            other = ''.join(list(name))
+            self.assertIsNot(other, name)
+            shared = symbols.intern(name)
+            self.assertEqual(shared, name)
+            self.assertIs(symbols.intern(other), shared)
+        for x in (None, 42, {'%.L0': '%1'}):
+            self.assertIs(symbols.intern(x), x)
+
+    def test_ids(self):
+        """Every name has its own ID, and the IDs are 0, 1, ..."""
+        symbols = tac.Symbols()
+        ids = {name: symbols.id(name) for name in self.names}
+        self.assertEqual(len(set(ids.values())), len(self.names))
+        self.assertEqual(sorted(symbols.ids.values()),
+                         list(range(len(symbols.names))))
+        for name, i in ids.items():
+            self.assertEqual(symbols.id(name), i)
+            self.assertEqual(symbols.names[i], name)
+
+    def test_roots_and_versions(self):
+        symbols = tac.Symbols()
+        for name, root, version in (('%12.7', '%12', '7'),
+                                    ('%12', '%12', ''),
+                                    ('%x.1.2', '%x.1', '2'),
+                                    ('%x.1', '%x', '1'),
+                                    ('@g', '@g', '')):
+            with self.subTest(name=name):
+                self.assertEqual(symbols.root(name), root)
+                self.assertEqual(symbols.version(name), version)
+
+    def test_loaded(self):
+        """Programs loaded separately share their names"""
+        tac_file = os.path.join(_examples, 'fib.tac.json')
+        first, second = tac.load_tac(tac_file), tac.load_tac(tac_file)
+        for a, b in zip(first, second):
+            self.assertIs(a.name, b.name)
+            if isinstance(a, tac.Proc):
+                for x, y in zip(a.t_args, b.t_args):
+                    self.assertIs(x, y)
+                for i, j in zip(a.body, b.body):
+                    for f in ('dest', 'arg1', 'arg2'):
+                        if isinstance(getattr(i, f), str):
+                            self.assertIs(getattr(i, f), getattr(j, f))
+
+
+class ProcBodyTest(unittest.TestCase):
+    """A ProcBody must hold the same instructions as a list of Instr"""
+
+    @staticmethod
+    def _procs():
+        """The procs of the examples, as they are and in SSA form"""
+        files = sorted(glob.glob(os.path.join(_examples, '*.tac.json')))
+        return [tlv for tac_file in files
+                for tlvs in (tac.load_tac(tac_file),
+                             _ssa(tac.load_tac(tac_file)))
+                for tlv in tlvs if isinstance(tlv, tac.Proc)]
+
+    def test_round_trip(self):
+        for proc in self._procs():
+            with self.subTest(proc=proc.name):
+                instrs = list(proc.body)
+                body = tac.ProcBody(instrs)
+                self.assertEqual(len(body), len(instrs))
+                self.assertEqual(body.opcode_list(),
+                                 [i.opcode for i in instrs])
+                self.assertEqual([str(i) for i in body.instrs()],
+                                 [str(i) for i in instrs])
+                self.assertEqual([str(v) for v in body],
+                                 [str(i) for i in instrs])
+                self.assertEqual([v.js_obj for v in body],
+                                 [i.js_obj for i in instrs])
+                self.assertEqual([str(v) for v in tac.ProcBody(body)],
+                                 [str(i) for i in instrs])
+
+    def test_compact(self):
+        """A compacted program prints and runs the same"""
+        for tac_file in sorted(glob.glob(os.path.join(_examples,
+                                                      '*.tac.json'))):
+            with self.subTest(tac_file=os.path.basename(tac_file)):
+                prog, compact = tac.load_tac(tac_file), \
+                    tac.load_tac(tac_file, True)
+                for tlv in compact:
+                    if isinstance(tlv, tac.Proc):
+                        self.assertIsInstance(tlv.body, tac.ProcBody)
+                self.assertEqual([str(tlv) for tlv in compact],
+                                 [str(tlv) for tlv in prog])
+                self.assertEqual(_execute(*_program(compact)),
+                                 _execute(*_program(prog)))
+
+    def test_edits(self):
+        """Changes made through the sequence methods follow a list"""
+        proc = _program(tac.load_tac(os.path.join(_examples,
+                                                  'fib.tac.json')))[1]['@fib']
+        instrs = list(proc.body)
+        body = tac.ProcBody(instrs)
+        extra = [tac.Instr('%new', 'const', [42]),
+                 tac.Instr(None, 'nop', []),
+                 tac.Instr('%new', 'add', ['%new', '%n'])]
+        rng = random.Random(20)
+        for step in range(60):
+            k = rng.randrange(len(instrs))
+            kind = step % 5
+            if kind == 0:
+                instrs.insert(k, extra[step % 3])
+                body.insert(k, extra[step % 3])
+            elif kind == 1:
+                del instrs[k - len(instrs)]
+                del body[k - len(body)]
+            elif kind == 2:
+                instrs[k] = extra[step % 3]
+                body[k] = extra[step % 3]
+            elif kind == 3:
+                instrs[k:k + 2] = extra
+                body[k:k + 2] = extra
+            else:
+                del instrs[k:k + 2]
+                del body[k:k + 2]
+            self.assertEqual([str(v) for v in body],
+                             [str(i) for i in instrs])
+        with self.assertRaises(IndexError):
+            body[len(body)]
+        with self.assertRaises(IndexError):
+            body[-len(body) - 1]
+
+    def test_views(self):
+        body = tac.ProcBody([tac.Instr('%a', 'const', [5]),
+                             tac.Instr('%b', 'const', [5]),
+                             tac.Instr('%c', 'add', ['%a', '%b'])])
+        self.assertEqual(body.pool, [5])
+        view = body[2]
+        self.assertEqual(view, body[-1])
+        self.assertEqual(hash(view), hash(body[2]))
+        self.assertNotEqual(view, body[1])
+        view.dest, view.arg2 = '%d', '%a'
+        view.opcode = 'mul'
+        self.assertEqual(str(body[2]), '  %d = mul %a, %a;')
+        # a view stays at its index
+        body.insert(0, tac.Instr(None, 'nop', []))
+        self.assertEqual(str(view), '  %b = const 5;')
+
+
+class _Walk(tac.Tracer):
+    """Checks that the instructions are reported in the order they run:
+    each one follows the previous one in its proc, or is the first one
+    after the labels of a jump target. Counts the phi nodes reported."""
+
+    def __init__(self, test):
+        self.test = test
+        self.last = dict()      # depth -> index of the last instruction
+        self.jump = None        # index where the last branch goes
+        self.phis = 0
+
+    def enter(self, depth, proc, args):
+        self.last[depth] = -1
+
+    def instr(self, depth, proc, pc, instr):
+        expected = self.last[depth] + 1
+        if self.jump is not None:
+            expected, self.jump = self.jump, None
+        self.test.assertEqual(pc, expected, f'{proc.name}: {instr}')
+        self.last[depth] = pc
+        self.phis += instr.opcode == 'phi'
+
+    def branch(self, depth, proc, pc, instr, lab):
+        body = proc.body
+        target = next(i for i, instr in enumerate(body)
+                      if instr.opcode == 'label' and instr.arg1 == lab)
+        while target < len(body) and body[target].opcode == 'label':
+            target += 1
+        self.jump = target
+
+
+class ExecuteTest(unittest.TestCase):
+
+    def test_prepared_reused(self):
+        """A second run decodes nothing again and prints the same"""
+        gvars, procs = _program(tac.load_tac(os.path.join(
+            _examples, 'fizzbuzz.tac.json')))
+        outs, prepared = [], []
+        for _ in range(2):
+            outs.append(tac.CaptureOutput())
+            tac.execute(gvars, procs, '@main', [], out=outs[-1])
+            prepared.append({name: proc._prepared
+                             for name, proc in procs.items()})
+        self.assertEqual(outs[0].getvalue(), outs[1].getvalue())
+        for name, prep in prepared[0].items():
+            self.assertIs(prepared[1][name], prep)
+
+    def test_memo_fell_off(self):
+        """A caller that falls off after a memoized call reports its own
+        arguments, as without the memo"""
+        tlvs = _source('''
+proc @sq(%y):
+%.L9:
+  %r = mul %y, %y;
+  ret %r;
+
+proc @g(%x):
+%.L9:
+  %c = const 7;
+  param 1, %c;
+  %s = call @sq, 1;
+  param 1, %s;
+  call @__bx_print_int, 1;
+
+proc @main():
+%.L9:
+  %a = const 3;
+  param 1, %a;
+  call @g, 1;
+  param 1, %a;
+  call @g, 1;
+  ret;
+''')
+        expected = (None, '49\n//   @g(%x=3) --> NONE\n' * 2)
+        self.assertEqual(_execute(*_program(copy.deepcopy(tlvs))), expected)
+        gvars, procs = _program(tlvs)
+        memo = tac.Memo(procs)
+        self.assertEqual(_execute(gvars, procs, memo=memo), expected)
+        self.assertEqual(memo.stats['@sq'], [1, 1])
+
+    def test_trace_phis(self):
+        """The phi nodes are traced and profiled on the way into a block"""
+        for tac_file in sorted(glob.glob(os.path.join(_examples,
+                                                      '*.tac.json'))):
+            with self.subTest(example=os.path.basename(tac_file)):
+                gvars, procs = _program(_ssa(tac.load_tac(tac_file)))
+                walk, profiler = _Walk(self), tac.Profiler()
+                tac.execute(gvars, procs, '@main', [],
+                            tracer=tac.TeeTracer(walk, profiler),
+                            out=tac.CaptureOutput())
+                self.assertGreater(walk.phis, 0)
+                self.assertEqual(profiler.opcodes['phi'], walk.phis)
+
+    def test_profile_with_trace(self):
+        """--profile keeps the trace asked for and still writes the profile"""
+        with tempfile.TemporaryDirectory() as tmp:
+            tac_file = os.path.join(tmp, 'fib.tac.json')
+            shutil.copy(os.path.join(_examples, 'fib.tac.json'), tac_file)
+            self.assertEqual(_run('--trace-all', '--profile', tac_file),
+                             _run('--trace-all', tac_file))
+            with open(tac_file + '.profile.json') as fp:
+                profile = json.load(fp)
+            self.assertIn('@fib', profile['procs'])
+
+    def test_jobs_stderr(self):
+        """With -j, what each file prints to stderr comes in input order"""
+        files = [os.path.join('testing_examples', name)
+                 for name in ('fib.tac.json', 'classic_fib.tac.json')]
+        expected = ''.join(f'// {name}:\n' +
+                           _run('--memoize', name, stderr=True)[1]
+                           for name in files)
+        out, err = _run('-j', '2', '--memoize', *files, stderr=True)
+        self.assertEqual(err, expected)
+        self.assertTrue(out.startswith(''.join(_run(name) for name in files)))
+
+
+if __name__ == '__main__':
+    unittest.main()
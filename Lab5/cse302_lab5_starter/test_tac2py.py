@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+"""
+Checks of tac2py.py against tac.execute()
+"""
+
+import copy
+import glob
+import os
+import unittest
+
+import tac
+import tac2py
+import cfg
+import ssagen
+
+_here = os.path.dirname(os.path.abspath(__file__))
+_examples = os.path.join(_here, 'testing_examples')
+
+# procs that fall off the end at several call depths
+_fall_off = '''
+var @count = 0;
+
+proc @leaf(%x):
+%.L9:
+  @count = add @count, %x;
+
+proc @mid(%y):
+%.L9:
+  param 1, %y;
+  call @leaf, 1;
+  %one = const 1;
+  jz %y, %.L1;
+  ret %one;
+%.L1:
+  nop;
+
+proc @main():
+%.L9:
+  %z = const 0;
+  param 1, %z;
+  call @mid, 1;
+  %a = const 5;
+  param 1, %a;
+  %b = call @mid, 1;
+  param 1, %b;
+  call @leaf, 1;
+'''
+
+# a recursion deeper than the Python stack allows
+_deep = '''
+var @depth = 5000;
+
+proc @down(%n):
+%.L9:
+  jz %n, %.L1;
+  %one = const 1;
+  %m = sub %n, %one;
+  param 1, %m;
+  %s = call @down, 1;
+  %s = add %s, %n;
+  ret %s;
+%.L1:
+  param 1, %n;
+  call @__bx_print_int, 1;
+  ret %n;
+
+proc @main():
+%.L9:
+  param 1, @depth;
+  %s = call @down, 1;
+  param 1, %s;
+  call @__bx_print_int, 1;
+  @depth = copy %s;
+'''
+
+
+def _program(tlvs):
+    """The Gvar and the Proc objects of `tlvs', by name"""
+    gvars = {tlv.name: tlv for tlv in tlvs if isinstance(tlv, tac.Gvar)}
+    procs = {tlv.name: tlv for tlv in tlvs if isinstance(tlv, tac.Proc)}
+    return gvars, procs
+
+
+def _ssa(tlvs):
+    """`tlvs' with every proc put in SSA form"""
+    for tlv in tlvs:
+        if isinstance(tlv, tac.Proc):
+            c = cfg.infer(tlv)
+            ssagen.crude_ssagen(tlv, c)
+            cfg.linearize(tlv, c)
+    return tlvs
+
+
+def _execute(module, tlvs):
+    """What running @main of `tlvs' with `module'.execute() returns, prints
+    and leaves in the globals"""
+    gvars, procs = _program(copy.deepcopy(tlvs))
+    out = tac.CaptureOutput()
+    retval = module.execute(gvars, procs, '@main', [], out=out)
+    return (retval, out.getvalue(),
+            {name: gvar.value for name, gvar in gvars.items()})
+
+# ------------------------------------------------------------------------------
+
+
+class CompiledTest(unittest.TestCase):
+
+    def check(self, tlvs):
+        self.assertEqual(_execute(tac2py, tlvs), _execute(tac, tlvs))
+
+    def test_examples(self):
+        for tac_file in sorted(glob.glob(os.path.join(_examples,
+                                                      '*.tac.json'))):
+            with self.subTest(example=os.path.basename(tac_file)):
+                tlvs = tac.load_tac(tac_file)
+                self.check(tlvs)
+                self.check(_ssa(tlvs))
+
+    def test_fell_off(self):
+        """Falling off is reported indented by the call depth"""
+        tlvs = tac.Parser(tac.Lexer(_fall_off, 'test')).parse()
+        self.assertEqual(_execute(tac2py, tlvs)[1],
+                         '//     @leaf(%x=0) --> NONE\n'
+                         '//   @mid(%y=0) --> NONE\n'
+                         '//     @leaf(%x=5) --> NONE\n'
+                         '//   @leaf(%x=1) --> NONE\n'
+                         '// @main() --> NONE\n')
+        self.check(tlvs)
+
+    def test_deep_recursion(self):
+        """A recursion too deep for Python runs in the interpreter"""
+        tlvs = tac.Parser(tac.Lexer(_deep, 'test')).parse()
+        retval, output, gvals = _execute(tac2py, tlvs)
+        self.assertEqual(output, '0\n12502500\n// @main() --> NONE\n')
+        self.assertEqual(gvals, {'@depth': 12502500})
+        self.check(tlvs)
+
+
+if __name__ == '__main__':
+    unittest.main()
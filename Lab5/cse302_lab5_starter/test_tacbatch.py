@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+
+"""
+Checks of tacbatch.py against tac.execute(), lane by lane
+"""
+
+import copy
+import glob
+import os
+import unittest
+
+try:
+    import numpy as np
+    import tacbatch
+except ImportError:
+    np = None
+
+import tac
+import cfg
+import ssagen
+
+_here = os.path.dirname(os.path.abspath(__file__))
+_examples = os.path.join(_here, 'testing_examples')
+
+# every operator, on operands that overflow, divide by zero and shift by
+# negative or large counts
+_arith = '''
+var @total = 0;
+
+proc @arith(%a, %b):
+%.L0:
+  %s = add %a, %b;
+  %d = sub %a, %b;
+  %m = mul %a, %b;
+  %n = neg %m;
+  %x = xor %s, %d;
+  %o = or %x, %n;
+  %y = and %o, %s;
+  %w = not %y;
+  @total = add @total, %w;
+  param 1, %w;
+  call @__bx_print_int, 1;
+  %q = div %a, %b;
+  %r = mod %a, %b;
+  param 1, %q;
+  call @__bx_print_int, 1;
+  %k = const 5;
+  %l = shl %r, %k;
+  %h = shr %l, %b;
+  %u = add %l, %h;
+  ret %u;
+'''
+
+# loops, where the lanes take different paths and meet again
+_collatz = '''
+proc @collatz(%n):
+%.L9:
+  %steps = const 0;
+%.L0:
+  %one = const 1;
+  %t = sub %n, %one;
+  jz %t, %.L3;
+  %two = const 2;
+  %p = mod %n, %two;
+  jz %p, %.L1;
+  %three = const 3;
+  %n = mul %n, %three;
+  %n = add %n, %one;
+  jmp %.L2;
+%.L1:
+  %n = div %n, %two;
+%.L2:
+  %steps = add %steps, %one;
+  jmp %.L0;
+%.L3:
+  ret %steps;
+'''
+
+# calls, recursion, printing, and falling off the end
+_calls = '''
+proc @fib(%n):
+%.L9:
+  %one = const 1;
+  %t = sub %n, %one;
+  jle %t, %.L1;
+  param 1, %t;
+  %a = call @fib, 1;
+  %t = sub %t, %one;
+  param 1, %t;
+  %b = call @fib, 1;
+  %r = add %a, %b;
+  ret %r;
+%.L1:
+  ret %n;
+
+proc @show(%x):
+%.L9:
+  param 1, %x;
+  %f = call @fib, 1;
+  param 1, %f;
+  call @__bx_print_int, 1;
+  jl %x, %.L0;
+  param 1, %x;
+  call @__bx_print_bool, 1;
+  ret %f;
+%.L0:
+  nop;
+'''
+
+
+def _program(tlvs):
+    """The Gvar and the Proc objects of `tlvs', by name"""
+    gvars = {tlv.name: tlv for tlv in tlvs if isinstance(tlv, tac.Gvar)}
+    procs = {tlv.name: tlv for tlv in tlvs if isinstance(tlv, tac.Proc)}
+    return gvars, procs
+
+
+def _ssa(tlvs):
+    """`tlvs' with every proc put in SSA form"""
+    for tlv in tlvs:
+        if isinstance(tlv, tac.Proc):
+            c = cfg.infer(tlv)
+            ssagen.crude_ssagen(tlv, c)
+            cfg.linearize(tlv, c)
+    return tlvs
+
+# ------------------------------------------------------------------------------
+
+
+@unittest.skipIf(np is None, 'tacbatch needs NumPy')
+class BatchTest(unittest.TestCase):
+    """Every lane of a batch must return, print and leave in the globals
+    what a run of tac.execute() on its inputs does"""
+
+    def check(self, tlvs, proc_name, inputs):
+        result = tacbatch.execute_batch(*_program(copy.deepcopy(tlvs)),
+                                        proc_name, inputs)
+        for lane, row in enumerate(inputs.tolist()):
+            with self.subTest(proc=proc_name, inputs=row):
+                gvars, procs = _program(copy.deepcopy(tlvs))
+                out = tac.CaptureOutput()
+                try:
+                    retval = tac.execute(gvars, procs, proc_name,
+                                         [tac.twoc(x) for x in row], out=out)
+                    error = None
+                except (RuntimeError, ValueError, ZeroDivisionError) as exc:
+                    retval, error = None, str(exc)
+                self.assertEqual(result.errors[lane], error)
+                self.assertEqual(result.outputs[lane], out.lines)
+                for name, gvar in gvars.items():
+                    self.assertEqual(int(result.gvals[name][lane]),
+                                     tac.twoc(gvar.value))
+                if error is None:
+                    self.assertEqual(bool(result.has_value[lane]),
+                                     retval is not None)
+                if retval is not None:
+                    self.assertEqual(int(result.values[lane]), retval)
+
+    def check_forms(self, text, proc_name, inputs):
+        """check() the program `text' as it is and in SSA form"""
+        tlvs = tac.Parser(tac.Lexer(text, 'test')).parse()
+        self.check(tlvs, proc_name, inputs)
+        ssa = _ssa(copy.deepcopy(tlvs))
+        self.assertTrue(any(instr.opcode == 'phi' for tlv in ssa
+                            if isinstance(tlv, tac.Proc)
+                            for instr in tlv.body))
+        self.check(ssa, proc_name, inputs)
+
+    def test_arith(self):
+        values = [0, 1, -1, 3, 7, -7, 64, 100, 2 ** 62, 2 ** 63 - 1, -2 ** 63]
+        self.check_forms(_arith, '@arith',
+                         np.array([(a, b) for a in values for b in values],
+                                  dtype=np.int64))
+
+    def test_collatz(self):
+        self.check_forms(_collatz, '@collatz',
+                         np.arange(1, 28, dtype=np.int64).reshape(-1, 1))
+
+    def test_calls(self):
+        self.check_forms(_calls, '@show',
+                         np.arange(-3, 13, dtype=np.int64).reshape(-1, 1))
+
+    def test_examples(self):
+        for tac_file in sorted(glob.glob(os.path.join(_examples,
+                                                      '*.tac.json'))):
+            with self.subTest(tac_file=os.path.basename(tac_file)):
+                tlvs = tac.load_tac(tac_file)
+                self.check(tlvs, '@main', np.zeros((2, 0), dtype=np.int64))
+                self.check(_ssa(tlvs), '@main',
+                           np.zeros((2, 0), dtype=np.int64))
+
+
+if __name__ == '__main__':
+    unittest.main()
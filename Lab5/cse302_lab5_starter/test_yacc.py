@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+"""
+Checks of the table cache of the vendored PLY
+"""
+
+import os
+import pickle
+import tempfile
+import unittest
+from unittest import mock
+
+import ply.lex
+import ply.yacc
+
+
+class _Sums:
+    """A grammar of sums of numbers, such as `1 + 2 + 3'"""
+    tokens = ('NUM', 'PLUS')
+    t_PLUS = r'\+'
+    t_ignore = ' '
+
+    def t_NUM(self, t):
+        r'[0-9]+'
+        t.value = int(t.value)
+        return t
+
+    def t_error(self, t):
+        raise RuntimeError(f'bad character {t.value[0]}')
+
+    def p_sum(self, p):
+        '''sum : sum PLUS NUM
+               | NUM'''
+        p[0] = p[1] + p[3] if len(p) == 4 else p[1]
+
+    def p_error(self, p):
+        raise RuntimeError('syntax error')
+
+
+class _Products(_Sums):
+    """Sums of products, which is another grammar"""
+    tokens = ('NUM', 'PLUS', 'TIMES')
+    t_TIMES = r'\*'
+    precedence = (('left', 'PLUS'), ('left', 'TIMES'))
+
+    def p_sum(self, p):
+        '''sum : sum PLUS sum
+               | sum TIMES sum
+               | NUM'''
+        if len(p) == 2:
+            p[0] = p[1]
+        elif p[2] == '+':
+            p[0] = p[1] + p[3]
+        else:
+            p[0] = p[1] * p[3]
+
+# ------------------------------------------------------------------------------
+
+
+class TableCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.cache_dir = os.path.join(tmp.name, 'ply')
+        patcher = mock.patch.object(ply.yacc, 'cache_dir', self.cache_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def parse(self, grammar, text, **kwargs):
+        """Build a parser for `grammar' and parse `text' with it. Returns the
+        result and the number of times the tables were computed."""
+        with mock.patch.object(ply.yacc.LRTable, '__init__', autospec=True,
+                               side_effect=ply.yacc.LRTable.__init__) as init:
+            parser = ply.yacc.yacc(module=grammar, **kwargs)
+        lexer = ply.lex.lex(module=grammar)
+        return parser.parse(text, lexer=lexer), init.call_count
+
+    def cached(self):
+        """The files in the cache"""
+        if not os.path.isdir(self.cache_dir):
+            return []
+        return sorted(os.listdir(self.cache_dir))
+
+    def test_miss_then_hit(self):
+        self.assertEqual(self.parse(_Sums(), '1 + 2 + 3'), (6, 1))
+        self.assertEqual(len(self.cached()), 1)
+        self.assertEqual(self.parse(_Sums(), '1 + 2 + 3 + 4'), (10, 0))
+        self.assertEqual(len(self.cached()), 1)
+
+    def test_other_grammar(self):
+        self.parse(_Sums(), '1')
+        self.assertEqual(self.parse(_Products(), '1 + 2 * 3'), (7, 1))
+        self.assertEqual(len(self.cached()), 2)
+        self.assertEqual(self.parse(_Products(), '2 * 3 + 1'), (7, 0))
+        self.assertEqual(self.parse(_Sums(), '1 + 2'), (3, 0))
+
+    def test_stale(self):
+        """A file that does not hold the tables of its grammar is ignored
+        and replaced"""
+        self.parse(_Sums(), '1')
+        cache_file = os.path.join(self.cache_dir, self.cached()[0])
+        for data in (pickle.dumps(('0' * 64, dict(), dict())),
+                     b'not a pickle'):
+            with self.subTest(data=data):
+                with open(cache_file, 'wb') as fp:
+                    fp.write(data)
+                self.assertEqual(self.parse(_Sums(), '1 + 2'), (3, 1))
+                self.assertEqual(self.parse(_Sums(), '1 + 2'), (3, 0))
+
+    def test_unwritable(self):
+        """The tables are just computed when the cache cannot be written"""
+        with open(self.cache_dir, 'w') as fp:
+            fp.write('a file where the cache directory should be')
+        for _ in range(2):
+            self.assertEqual(self.parse(_Sums(), '1 + 2'), (3, 1))
+        with mock.patch.object(ply.yacc, 'cache_dir',
+                               os.path.join(self.cache_dir, 'ply')):
+            self.assertEqual(self.parse(_Sums(), '1 + 2'), (3, 1))
+
+    def test_disabled(self):
+        self.assertEqual(self.parse(_Sums(), '1 + 2', cache=False), (3, 1))
+        self.assertEqual(self.cached(), [])
+        with mock.patch.object(ply.yacc, 'cache_dir', None):
+            self.assertEqual(self.parse(_Sums(), '1 + 2'), (3, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()